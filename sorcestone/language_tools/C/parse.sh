@@ -2,8 +2,9 @@
 echo "== Source file to be parsed $1"
 echo "== AST file to be created $2"
 echo "== Pre-Processor args $3"
+echo "== AST format ${4:-json}"
+echo "== Symbol index $5"
 SCRIPT_DIR=$(dirname "$0")
 cd $SCRIPT_DIR
 source toolbox/.venv/bin/activate
-python toolbox/parse.py $1 $2 
-# --cpp_args $3
+python toolbox/parse.py $1 $2 --cpp_args="$3" --format=${4:-json} --index_db="$5"
@@ -0,0 +1,6 @@
+#!/bin/bash
+# Long living parser, see toolbox/parse_server.py for the protocol
+SCRIPT_DIR=$(dirname "$0")
+cd $SCRIPT_DIR
+source toolbox/.venv/bin/activate
+exec python toolbox/parse_server.py "$@"
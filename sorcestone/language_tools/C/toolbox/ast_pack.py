@@ -0,0 +1,150 @@
+#------------------------------------------------------------------------------
+# Compact binary AST format writer
+#
+# Layout, all integers little endian:
+#     header   - magic b'SSASTPK2', u32 string count, u32 entry count,
+#                u64 strings offset, u64 index offset
+#     entries  - one encoded value per top level declaration (FileAST.ext)
+#     strings  - u32 offsets[string count + 1] followed by utf-8 blob
+#     index    - per entry: u32 node type string id, u64 offset, u64 length
+#
+# Value encoding, every value starts with a tag byte:
+#     0 null, 1 string (varint string id), 2 list (varint count, values),
+#     3 node (varint node type string id, varint coord file id + 1 or 0,
+#             varint line, varint column, varint field count,
+#             fields as varint key string id + value),
+#     4 true, 5 false, 6 integer (zigzag varint)
+#
+# Node types, file names and attribute values are interned, so repeated
+# strings are stored once.
+# sorcestone/utils/ast_pack.py is the reader.
+#------------------------------------------------------------------------------
+
+import struct
+
+from pycparser import c_ast
+
+
+MAGIC = b'SSASTPK2'
+HEADER = struct.Struct('<8sIIQQ')
+INDEX_ENTRY = struct.Struct('<IQQ')
+
+TAG_NULL, TAG_STR, TAG_LIST, TAG_NODE, TAG_TRUE, TAG_FALSE, TAG_INT = range(7)
+
+
+def write_varint(buf, value):
+    while value > 0x7F:
+        buf.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buf.append(value)
+
+
+class StringTable(object):
+
+    def __init__(self):
+        self.ids = {}
+        self.strings = []
+
+    def intern(self, value):
+        sid = self.ids.get(value)
+        if sid is None:
+            sid = self.ids[value] = len(self.strings)
+            self.strings.append(value)
+        return sid
+
+    def to_bytes(self):
+        blobs = [value.encode() for value in self.strings]
+        offsets = [0]
+        for blob in blobs:
+            offsets.append(offsets[-1] + len(blob))
+        return struct.pack(f'<{len(offsets)}I', *offsets) + b''.join(blobs)
+
+
+def encode(node, strings, iter_fields):
+    """
+    Encode node into bytes without recursion.
+
+    Args:
+        node (c_ast.Node): Node to encode
+        strings (StringTable): Table to intern strings into
+        iter_fields (callable): Yields (key, value) pairs of a node
+    """
+    buf = bytearray()
+    # Each frame is (items iterator, is_object)
+    stack = [(iter([node]), False)]
+    while stack:
+        items, is_object = stack[-1]
+        item = next(items, stack)
+        if item is stack:
+            stack.pop()
+            continue
+        if is_object:
+            key, item = item
+            write_varint(buf, strings.intern(key))
+
+        if isinstance(item, c_ast.Node):
+            fields = list(iter_fields(item))
+            # coord is kept as integers, not as a field
+            fields = [(key, value) for key, value in fields if key not in ('_nodetype', 'coord')]
+            buf.append(TAG_NODE)
+            write_varint(buf, strings.intern(item.__class__.__name__))
+            coord = item.coord
+            if coord:
+                write_varint(buf, strings.intern(coord.file) + 1)
+                write_varint(buf, int(coord.line or 0))
+                write_varint(buf, int(coord.column or 0))
+            else:
+                buf.extend(b'\x00\x00\x00')
+            write_varint(buf, len(fields))
+            stack.append((iter(fields), True))
+        elif isinstance(item, (list, tuple)):
+            buf.append(TAG_LIST)
+            write_varint(buf, len(item))
+            stack.append((iter(item), False))
+        elif item is None:
+            buf.append(TAG_NULL)
+        elif item is True:
+            buf.append(TAG_TRUE)
+        elif item is False:
+            buf.append(TAG_FALSE)
+        elif isinstance(item, int):
+            buf.append(TAG_INT)
+            write_varint(buf, (item << 1) ^ (item >> 63))
+        else:
+            buf.append(TAG_STR)
+            write_varint(buf, strings.intern(str(item)))
+    return buf
+
+
+def write_pack(ast, f, iter_fields):
+    """
+    Write FileAST into the binary file object in the compact format.
+
+    Args:
+        ast (c_ast.FileAST): Parsed translation unit
+        f: File object opened in binary mode
+        iter_fields (callable): Yields (key, value) pairs of a node
+    """
+    strings = StringTable()
+    index = []
+    offset = HEADER.size
+    f.write(b'\x00' * HEADER.size)
+    for ext in ast.ext:
+        data = encode(ext, strings, iter_fields)
+        index.append((
+            strings.intern(ext.__class__.__name__),
+            offset,
+            len(data)
+        ))
+        f.write(data)
+        offset += len(data)
+
+    strings_offset = offset
+    strings_data = strings.to_bytes()
+    f.write(strings_data)
+    index_offset = strings_offset + len(strings_data)
+    for entry in index:
+        f.write(INDEX_ENTRY.pack(*entry))
+
+    f.seek(0)
+    f.write(HEADER.pack(MAGIC, len(strings.strings), len(index), strings_offset, index_offset))
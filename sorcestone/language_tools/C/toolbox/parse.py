@@ -39,14 +39,26 @@ import json
 import re
 import argparse
 import os
+import shutil
+import hashlib
+import tempfile
 
-from pycparser import parse_file, c_ast
+import pycparser
+from pycparser import parse_file, preprocess_file, c_ast, c_parser
 from pycparser.plyparser import Coord
 
+from ast_pack import write_pack
+from symbol_index import index_unit
+
+
+# Bump whenever the AST output changes, so cached ASTs are not reused
+AST_FORMAT_VERSION = "3"
 
 # START META PROCESSING
 RE_CHILD_ARRAY = re.compile(r'(.*)\[(.*)\]')
 RE_INTERNAL_ATTR = re.compile('__.*__')
+# cpp line marker: # <line> "<file>" <flags>, flag 3 marks a system header
+RE_LINE_MARKER = re.compile(r'^# \d+ "(.*)"((?: \d)*)$', re.MULTILINE)
 
 class CJsonError(Exception):
     pass
@@ -72,6 +84,86 @@ def child_attrs_of(klass):
     return all_attrs - non_child_attrs
 
 
+@memodict
+def field_plan_of(klass):
+    """
+    Given a Node class, get the sorted list of (key, kind) pairs written for
+    its instances. Memoized, so serialization does not inspect class
+    attributes or match child names per node.
+    """
+    plan = [('_nodetype', 'nodetype'), ('coord', 'coord')]
+    plan += [(attr, 'attr') for attr in klass.attr_names]
+    plan += [(attr, 'child') for attr in child_attrs_of(klass) if attr != 'coord']
+    return sorted(plan)
+
+
+def iter_fields(node):
+    """ Yield (key, value) pairs of the node in output order """
+    for key, kind in field_plan_of(node.__class__):
+        if kind == 'nodetype':
+            yield key, node.__class__.__name__
+        elif kind == 'coord':
+            yield key, str(node.coord) if node.coord else None
+        elif kind == 'child':
+            value = getattr(node, key)
+            # Empty child arrays are missing from node.children(), so they
+            # are written as null like in to_dict
+            if isinstance(value, list) and not value:
+                value = None
+            yield key, value
+        else:
+            yield key, getattr(node, key)
+
+
+def write_json(node, f, indent=4):
+    """
+    Stream ast as json into the file object.
+
+    Produces the same text as json.dump(to_dict(node), f, indent=indent,
+    sort_keys=True), but walks the tree once with an explicit stack, so deep
+    expressions do not hit the recursion limit and no intermediate dict copy
+    of the tree is built.
+    """
+    write = f.write
+    encode_str = json.encoder.encode_basestring_ascii
+    # Each frame is [items iterator, is_object, level, is_first_item]
+    stack = []
+
+    def start(value, level):
+        if isinstance(value, c_ast.Node):
+            write('{')
+            stack.append([iter_fields(value), True, level + 1, True])
+        elif isinstance(value, (list, tuple)):
+            if value:
+                write('[')
+                stack.append([iter(value), False, level + 1, True])
+            else:
+                write('[]')
+        elif isinstance(value, str):
+            write(encode_str(value))
+        else:
+            write(json.dumps(value))
+
+    start(node, 0)
+    while stack:
+        frame = stack[-1]
+        items, is_object, level, is_first = frame
+        item = next(items, frame)
+        if item is frame:
+            stack.pop()
+            if not is_first:
+                write('\n' + ' ' * (indent * (level - 1)))
+            write('}' if is_object else ']')
+            continue
+
+        write(('\n' if is_first else ',\n') + ' ' * (indent * level))
+        frame[3] = False
+        if is_object:
+            key, item = item
+            write(encode_str(key) + ': ')
+        start(item, level)
+
+
 def to_dict(node):
     """ Recursively convert an ast into dict representation. """
     klass = node.__class__
@@ -121,15 +213,30 @@ def to_json(node, **kwargs):
     return json.dumps(to_dict(node), **kwargs)
 
 
-def file_to_dict(filename, cpp_args=None):
-    """ Load C file into dict representation of ast """
+_parser = None
+
+
+def get_parser():
+    """
+    Get shared CParser instance. Building parser tables is the most expensive
+    part of the startup, so long living processes reuse a single parser.
+    """
+    global _parser
+    if _parser is None:
+        _parser = c_parser.CParser()
+    return _parser
+
+
+def preprocess(filename, cpp_args=None):
+    """ Run C preprocessor over the file and return translation unit text """
     cpp_args = cpp_args.split() if cpp_args else []
+    return preprocess_file(filename, cpp_path='gcc', cpp_args=["-E"] + cpp_args)
 
-    ast = parse_file(filename,
-                     use_cpp=True,
-                     cpp_path='gcc',
-                     cpp_args=["-E"] + cpp_args
-                     )
+
+def file_to_dict(filename, cpp_args=None):
+    """ Load C file into dict representation of ast """
+    text = preprocess(filename, cpp_args)
+    ast = get_parser().parse(text, filename)
 
     return to_dict(ast)
 
@@ -191,7 +298,126 @@ def from_json(ast_json):
     return from_dict(json.loads(ast_json))
 
 
-def c_to_meta(file_path, ast_file_path, cpp_args=None):
+def system_files_of(text):
+    """ Get the set of system header file names from preprocessed text """
+    return set(
+        match.group(1)
+        for match in RE_LINE_MARKER.finditer(text)
+        if '3' in match.group(2).split()
+    )
+
+
+def iter_nodes(node):
+    """ Iterate over the node and all of its descendants without recursion """
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(child for _, child in node.children())
+
+
+def type_refs_of(node):
+    """ Get set of type names the node refers to: ('type', typedef) and ('tag', struct/union/enum) """
+    refs = set()
+    for item in iter_nodes(node):
+        if isinstance(item, c_ast.IdentifierType):
+            refs.update(('type', name) for name in item.names)
+        elif isinstance(item, (c_ast.Struct, c_ast.Union, c_ast.Enum)) and item.name:
+            refs.add(('tag', item.name))
+    return refs
+
+
+def type_defs_of(node):
+    """ Get set of type names the top level declaration defines """
+    defs = set()
+    if isinstance(node, c_ast.Typedef):
+        defs.add(('type', node.name))
+    for item in iter_nodes(node):
+        if isinstance(item, (c_ast.Struct, c_ast.Union, c_ast.Enum)) and item.name:
+            defs.add(('tag', item.name))
+    return defs
+
+
+def prune_ast(ast, system_files):
+    """
+    Drop top level declarations coming from system headers, except the ones
+    defining types which user declarations transitively refer to.
+
+    Args:
+        ast (c_ast.FileAST): Parsed translation unit
+        system_files (set): File names of system headers
+
+    Returns:
+        c_ast.FileAST: the same ast with pruned ext list
+    """
+    user_ext = []
+    providers = {}
+    for ext in ast.ext:
+        if ext.coord is None or ext.coord.file not in system_files:
+            user_ext.append(ext)
+            continue
+        for type_def in type_defs_of(ext):
+            providers.setdefault(type_def, []).append(ext)
+
+    keep = set(id(ext) for ext in user_ext)
+    pending = set()
+    for ext in user_ext:
+        pending |= type_refs_of(ext)
+
+    seen = set()
+    while pending:
+        ref = pending.pop()
+        seen.add(ref)
+        for ext in providers.get(ref, []):
+            if id(ext) in keep:
+                continue
+            keep.add(id(ext))
+            pending |= type_refs_of(ext) - seen
+
+    ast.ext = [ext for ext in ast.ext if id(ext) in keep]
+    return ast
+
+
+def get_cache_dir():
+    """ Get folder for cached ASTs, shared with sorcestone caches """
+    base_dir = os.environ.get(
+        'SORCESTONE_CACHE_DIR',
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../../../.cache')
+    )
+    cache_dir = os.path.normpath(os.path.join(base_dir, 'ast'))
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def ast_cache_key(text, cpp_args=None, prune=True, ast_format="json"):
+    """
+    Get cache key of the preprocessed translation unit.
+    Preprocessed text already inlines every included header, so any header
+    change results in a new key.
+    """
+    digest = hashlib.sha256()
+    for part in (AST_FORMAT_VERSION, pycparser.__version__, str(prune), ast_format, cpp_args or "", text):
+        part = part.encode()
+        digest.update(str(len(part)).encode() + b':')
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def copy_atomic(src_path, dst_path):
+    """ Copy file via temporary file, so dst_path is never partially written """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dst_path), prefix='.tmp-')
+    os.close(fd)
+    try:
+        shutil.copyfile(src_path, tmp_path)
+        os.replace(tmp_path, dst_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def c_to_meta(file_path, ast_file_path, cpp_args=None, use_cache=True, prune=True, ast_format="json",
+              index_db=None):
     """
     Convert a C file to its meta representation
     
@@ -199,11 +425,47 @@ def c_to_meta(file_path, ast_file_path, cpp_args=None):
         file_path (str): Path to the C file to convert
         ast_file_path (str): Path to the AST file to write result to
         cpp_args ([str]): List of cpp flags required for precompiler
+        use_cache (bool): Reuse stored AST of identical translation unit
+        prune (bool): Keep only user declarations and system types they depend on
+        ast_format (str): "json" or "pack" for the compact binary format
+        index_db (str): SQLite symbol index to add declarations of the file to
     """
-    ast_dict = file_to_dict(file_path, cpp_args)
-    ast = from_dict(ast_dict)
-    with open(ast_file_path, "w+") as f:
-        json.dump(to_dict(ast), f, indent=4, sort_keys=True)
+    text = preprocess(file_path, cpp_args)
+    unit_key = ast_cache_key(text, cpp_args, prune, ast_format)
+
+    ast = None
+    cached_ast_path = None
+    if use_cache:
+        cached_ast_path = os.path.join(get_cache_dir(), f"{unit_key}.ast")
+
+    if cached_ast_path and os.path.exists(cached_ast_path):
+        print(f"== Reused cached AST {cached_ast_path}")
+        copy_atomic(cached_ast_path, ast_file_path)
+    else:
+        ast = get_parser().parse(text, file_path)
+        if prune:
+            ast = prune_ast(ast, system_files_of(text))
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(ast_file_path), prefix='.tmp-')
+        try:
+            if ast_format == "pack":
+                with os.fdopen(fd, "wb") as f:
+                    write_pack(ast, f, iter_fields)
+            else:
+                with os.fdopen(fd, "w") as f:
+                    write_json(ast, f)
+            os.replace(tmp_path, ast_file_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        if cached_ast_path:
+            copy_atomic(ast_file_path, cached_ast_path)
+
+    if index_db:
+        # Cached ASTs are only parsed again if the index does not know the unit yet
+        index_unit(index_db, file_path, unit_key, system_files_of(text),
+                   lambda: ast or get_parser().parse(text, file_path))
 
 
 def process_file(file_path):
@@ -235,12 +497,39 @@ def cli():
         default="",
         help="cpp args to be provided during the meta model generation. Space separated list of flags expected"
     )
+    parser.add_argument(
+        '--no_cache',
+        action='store_true',
+        help="Always parse, do not reuse cached AST of identical preprocessed translation unit"
+    )
+    parser.add_argument(
+        '--keep_system_decls',
+        action='store_true',
+        help="Keep every declaration from system headers instead of only the types user code depends on"
+    )
+    parser.add_argument(
+        '--format',
+        type=str,
+        choices=["json", "pack"],
+        default="json",
+        help="AST file format: pretty printed json or compact binary pack"
+    )
+    parser.add_argument(
+        '--index_db',
+        type=str,
+        default="",
+        help="SQLite symbol index of the project to add declarations of the file to, see symbol_index.py"
+    )
     args = parser.parse_args()
     
     c_to_meta(
         file_path=os.path.abspath(args.src_file_path), 
         ast_file_path=os.path.abspath(args.ast_file_path), 
-        cpp_args=args.cpp_args
+        cpp_args=args.cpp_args,
+        use_cache=not args.no_cache,
+        prune=not args.keep_system_decls,
+        ast_format=args.format,
+        index_db=os.path.abspath(args.index_db) if args.index_db else None
     )
 
 
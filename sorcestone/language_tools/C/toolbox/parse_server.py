@@ -0,0 +1,149 @@
+#------------------------------------------------------------------------------
+# Long living C parser server
+#
+# Keeps a pool of worker processes with pycparser imported and its parser
+# tables built, so parsing many files is not dominated by interpreter and
+# grammar startup.
+#
+# Protocol: one JSON object per line.
+# Request on stdin:
+#     {"id": 1, "src_file_path": "...", "ast_file_path": "...", "cpp_args": "...",
+#      "format": "json", "index_db": "...", "timeout": 300}
+# Response on stdout:
+#     {"id": 1, "returncode": 0, "stdout": "...", "stderr": "..."}
+# Malformed requests are answered with returncode 1 and the error in
+# stderr, "id" is null if the request has none.
+# Optional "timeout" is in seconds since the server read the request. A job
+# which is not done by then is stopped, nothing is written to ast_file_path
+# afterwards, and it is answered with returncode 1.
+# Server exits when stdin is closed.
+#------------------------------------------------------------------------------
+
+import io
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import threading
+import traceback
+import multiprocessing
+from contextlib import redirect_stdout
+
+from parse import c_to_meta, get_parser
+
+
+class JobTimeout(Exception):
+    pass
+
+
+def on_alarm(signum, frame):
+    raise JobTimeout()
+
+
+def warm_up():
+    signal.signal(signal.SIGALRM, on_alarm)
+    get_parser()
+
+
+def timeout_response(job):
+    return {'id': job['id'], 'returncode': 1, 'stdout': "",
+            'stderr': f"Parsing {job['src_file_path']} timed out after {job['timeout']} seconds"}
+
+
+def parse_job(job):
+    """
+    Run single parse request inside a worker process, stopped by SIGALRM
+    once the deadline of the job passes.
+    """
+    deadline = job.get('deadline')
+    if deadline is not None:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return timeout_response(job)
+        signal.setitimer(signal.ITIMER_REAL, remaining)
+
+    output = io.StringIO()
+    try:
+        with redirect_stdout(output):
+            c_to_meta(
+                file_path=os.path.abspath(job['src_file_path']),
+                ast_file_path=os.path.abspath(job['ast_file_path']),
+                cpp_args=job.get('cpp_args', ""),
+                use_cache=job.get('use_cache', True),
+                prune=job.get('prune', True),
+                ast_format=job.get('format', "json"),
+                index_db=job.get('index_db')
+            )
+    except JobTimeout:
+        return timeout_response(job)
+    except Exception:
+        return {'id': job['id'], 'returncode': 1, 'stdout': output.getvalue(), 'stderr': traceback.format_exc()}
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+    return {'id': job['id'], 'returncode': 0, 'stdout': output.getvalue(), 'stderr': ""}
+
+
+def read_job(line):
+    """
+    Returns:
+        tuple: (job, None) for a valid request, (None, error response) otherwise
+    """
+    try:
+        job = json.loads(line)
+    except ValueError as e:
+        return None, {'id': None, 'returncode': 1, 'stdout': "", 'stderr': f"Malformed request: {e}"}
+    if not isinstance(job, dict) or 'id' not in job or 'src_file_path' not in job or 'ast_file_path' not in job:
+        job_id = job.get('id') if isinstance(job, dict) else None
+        return None, {'id': job_id, 'returncode': 1, 'stdout': "",
+                      'stderr': f"Malformed request, id, src_file_path and ast_file_path are required: {line.strip()}"}
+    return job, None
+
+
+def serve(workers):
+    # Responses go to a private copy of stdout, anything else printed to
+    # stdout by workers or tools they run ends up in stderr.
+    responses = os.fdopen(os.dup(sys.stdout.fileno()), 'w')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    lock = threading.Lock()
+
+    def respond(response):
+        with lock:
+            responses.write(json.dumps(response) + "\n")
+            responses.flush()
+
+    pool = multiprocessing.Pool(workers, initializer=warm_up)
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        job, error = read_job(line)
+        if error:
+            respond(error)
+            continue
+        if job.get('timeout') is not None:
+            job['deadline'] = time.time() + job['timeout']
+        pool.apply_async(
+            parse_job, (job,), callback=respond,
+            error_callback=lambda e, job_id=job['id']: respond(
+                {'id': job_id, 'returncode': 1, 'stdout': "", 'stderr': f"Parse job failed: {e!r}"})
+        )
+
+    pool.close()
+    pool.join()
+
+
+def cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=os.cpu_count(),
+        help="Number of parser worker processes"
+    )
+    args = parser.parse_args()
+    serve(args.workers)
+
+
+if __name__ == "__main__":
+    cli()
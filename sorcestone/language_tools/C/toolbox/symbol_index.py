@@ -0,0 +1,256 @@
+#------------------------------------------------------------------------------
+# Project-wide symbol index writer
+#
+# SQLite database of top level C declarations of every parsed translation
+# unit, so stages can look up definitions living in other files:
+#     files      - every indexed user file (sources and headers) with the
+#                  sha256 of its content when it was indexed
+#     units      - parsed translation units and the key of their
+#                  preprocessed text, units with an unchanged key are skipped
+#     unit_files - files each translation unit includes
+#     symbols    - functions, structs, unions, enums, typedefs and globals
+#                  with their file, line, definition flag, storage class and
+#                  declaration rendered as C. Tags are named like
+#                  'struct point', the same as in the AST utils.
+#     calls      - function calls of function definitions, by callee name
+#     type_refs  - typedef and tag names every symbol refers to
+#
+# Declarations are stored per file, so a header shared by many translation
+# units is stored once and only refreshed when its content changes.
+# Declarations from system headers are not indexed.
+# sorcestone/utils/symbol_index.py is the reader.
+#------------------------------------------------------------------------------
+
+import os
+import sqlite3
+import hashlib
+
+from pycparser import c_ast, c_generator
+
+
+SCHEMA_VERSION = "1"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, digest TEXT);
+CREATE TABLE IF NOT EXISTS units (path TEXT PRIMARY KEY, key TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS unit_files (
+    unit TEXT NOT NULL REFERENCES units(path) ON DELETE CASCADE,
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    PRIMARY KEY (unit, file_id)
+);
+CREATE TABLE IF NOT EXISTS symbols (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    line INTEGER,
+    is_definition INTEGER NOT NULL,
+    storage TEXT,
+    declaration TEXT
+);
+CREATE INDEX IF NOT EXISTS symbols_name ON symbols(name);
+CREATE INDEX IF NOT EXISTS symbols_file ON symbols(file_id);
+CREATE TABLE IF NOT EXISTS calls (
+    caller INTEGER NOT NULL REFERENCES symbols(id) ON DELETE CASCADE,
+    callee TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS calls_caller ON calls(caller);
+CREATE INDEX IF NOT EXISTS calls_callee ON calls(callee);
+CREATE TABLE IF NOT EXISTS type_refs (
+    symbol INTEGER NOT NULL REFERENCES symbols(id) ON DELETE CASCADE,
+    type TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS type_refs_symbol ON type_refs(symbol);
+CREATE INDEX IF NOT EXISTS type_refs_type ON type_refs(type);
+"""
+
+# Builtin type names are not worth a type reference
+BUILTIN_TYPES = {
+    'void', 'char', 'short', 'int', 'long', 'float', 'double', 'signed', 'unsigned', '_Bool', '_Complex'
+}
+
+
+def connect(db_path):
+    """
+    Open the index, creating it if needed. Batch workers index concurrently,
+    so writers wait for each other instead of failing.
+    """
+    connection = sqlite3.connect(db_path, timeout=120, isolation_level=None)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA foreign_keys=ON")
+    connection.executescript(SCHEMA)
+    version = connection.execute("SELECT value FROM meta WHERE key = 'schema_version'").fetchone()
+    if version is None:
+        connection.execute("INSERT OR IGNORE INTO meta VALUES ('schema_version', ?)", (SCHEMA_VERSION,))
+    elif version[0] != SCHEMA_VERSION:
+        connection.close()
+        raise Exception(f"Symbol index {db_path} has schema version {version[0]}, expected {SCHEMA_VERSION}")
+    return connection
+
+
+def file_digest(path):
+    """ Get sha256 of the file content, None if it can not be read """
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def is_unit_indexed(connection, unit_path, unit_key):
+    row = connection.execute("SELECT key FROM units WHERE path = ?", (unit_path,)).fetchone()
+    return row is not None and row[0] == unit_key
+
+
+def iter_nodes(node):
+    """ Iterate over the node and all of its descendants without recursion """
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(child for _, child in node.children())
+
+
+def tag_name(node):
+    return f"{node.__class__.__name__.lower()} {node.name}"
+
+
+def type_names_of(node):
+    """ Get names of typedefs and tags the node refers to """
+    names = set()
+    for item in iter_nodes(node):
+        if isinstance(item, c_ast.IdentifierType):
+            names.update(name for name in item.names if name not in BUILTIN_TYPES)
+        elif isinstance(item, (c_ast.Struct, c_ast.Union, c_ast.Enum)) and item.name:
+            names.add(tag_name(item))
+    return names
+
+
+def called_functions_of(node):
+    return set(
+        item.name.name for item in iter_nodes(node)
+        if isinstance(item, c_ast.FuncCall) and isinstance(item.name, c_ast.ID)
+    )
+
+
+def get_symbols(ext, generator):
+    """
+    Get index records of a top level declaration.
+
+    Returns:
+        list: dicts with name, kind, line, is_definition, storage,
+            declaration, calls and type_refs
+    """
+    def record(name, kind, node, is_definition, declaration, storage=None, calls=()):
+        return {
+            'name': name,
+            'kind': kind,
+            'line': node.coord.line if node.coord else None,
+            'is_definition': int(is_definition),
+            'storage': storage,
+            'declaration': declaration,
+            'calls': sorted(calls),
+            'type_refs': sorted(type_names_of(node) - {name}),
+        }
+
+    if isinstance(ext, c_ast.FuncDef):
+        return [record(ext.decl.name, 'function', ext, True, generator.visit(ext.decl) + ';',
+                       storage=' '.join(ext.decl.storage) or None, calls=called_functions_of(ext.body))]
+
+    records = []
+    # Structs, unions and enums defined inside the declaration, e.g. typedef struct point {...} point_t
+    for item in iter_nodes(ext):
+        if isinstance(item, (c_ast.Struct, c_ast.Union, c_ast.Enum)) and item.name:
+            members = item.values if isinstance(item, c_ast.Enum) else item.decls
+            if members is not None:
+                records.append(record(tag_name(item), item.__class__.__name__.lower(), item, True,
+                                      generator.visit(item) + ';'))
+
+    if isinstance(ext, c_ast.Typedef):
+        records.append(record(ext.name, 'typedef', ext, True, generator.visit(ext) + ';'))
+    elif isinstance(ext, c_ast.Decl) and ext.name:
+        storage = ' '.join(ext.storage) or None
+        if isinstance(ext.type, c_ast.FuncDecl):
+            records.append(record(ext.name, 'function', ext, False, generator.visit(ext) + ';', storage=storage))
+        else:
+            records.append(record(ext.name, 'variable', ext, 'extern' not in ext.storage,
+                                  generator.visit(ext) + ';', storage=storage))
+    return records
+
+
+def index_unit(db_path, unit_path, unit_key, system_files, get_ast):
+    """
+    Store symbols of a translation unit in the index.
+
+    Files already indexed with the same content, e.g. headers shared with
+    other translation units, are skipped, changed ones are reindexed.
+
+    Args:
+        db_path (str): Index database
+        unit_path (str): Path of the parsed source file
+        unit_key (str): Key of the preprocessed translation unit, the unit
+            is skipped if it was indexed with the same key
+        system_files (set): File names of system headers, not indexed
+        get_ast (callable): Returns c_ast.FileAST of the unit, only called
+            if the unit has to be indexed
+    """
+    connection = connect(db_path)
+    try:
+        if is_unit_indexed(connection, unit_path, unit_key):
+            print(f"== Symbol index of {unit_path} is up to date")
+            return
+
+        by_file = {}
+        for ext in get_ast().ext:
+            if ext.coord is None or ext.coord.file in system_files:
+                continue
+            by_file.setdefault(ext.coord.file, []).append(ext)
+
+        generator = c_generator.CGenerator()
+        indexed = []
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            file_ids = []
+            for path, exts in by_file.items():
+                digest = file_digest(path)
+                row = connection.execute("SELECT id, digest FROM files WHERE path = ?", (path,)).fetchone()
+                if row is not None and digest is not None and row[1] == digest:
+                    file_ids.append(row[0])
+                    continue
+
+                if row is None:
+                    file_id = connection.execute(
+                        "INSERT INTO files (path, digest) VALUES (?, ?)", (path, digest)
+                    ).lastrowid
+                else:
+                    file_id = row[0]
+                    connection.execute("UPDATE files SET digest = ? WHERE id = ?", (digest, file_id))
+                    connection.execute("DELETE FROM symbols WHERE file_id = ?", (file_id,))
+                file_ids.append(file_id)
+                indexed.append(path)
+
+                for ext in exts:
+                    for symbol in get_symbols(ext, generator):
+                        symbol_id = connection.execute(
+                            "INSERT INTO symbols (name, kind, file_id, line, is_definition, storage, declaration) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            (symbol['name'], symbol['kind'], file_id, symbol['line'], symbol['is_definition'],
+                             symbol['storage'], symbol['declaration'])
+                        ).lastrowid
+                        connection.executemany("INSERT INTO calls VALUES (?, ?)",
+                                               [(symbol_id, callee) for callee in symbol['calls']])
+                        connection.executemany("INSERT INTO type_refs VALUES (?, ?)",
+                                               [(symbol_id, name) for name in symbol['type_refs']])
+
+            connection.execute("INSERT OR REPLACE INTO units (path, key) VALUES (?, ?)", (unit_path, unit_key))
+            connection.execute("DELETE FROM unit_files WHERE unit = ?", (unit_path,))
+            connection.executemany("INSERT INTO unit_files VALUES (?, ?)",
+                                   [(unit_path, file_id) for file_id in file_ids])
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        print(f"== Indexed {len(indexed)} of {len(by_file)} files of {unit_path} into {os.path.abspath(db_path)}")
+    finally:
+        connection.close()
@@ -0,0 +1,4 @@
+#!/bin/bash
+# Type check without codegen and linking, so broken code fails fast.
+# Runs in the same build pool as compile.sh.
+exec /bin/bash "$(dirname "$0")/compile.sh" "$1" "" check
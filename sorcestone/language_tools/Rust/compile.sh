@@ -1,39 +1,90 @@
 #!/bin/bash
 SRC_FILE=$1
 DST_FILE=$2
+# "check" only type checks the code, no artifact is built
+MODE=${3:-build}
 
-echo "== Source file to be compiled $SRC_FILE"  
-echo "== Output file to be created $DST_FILE"  
+echo "== Source file to be compiled $SRC_FILE"
+echo "== Output file to be created $DST_FILE"
 
-BUILD_FOLDER=$(mktemp -d)
-PROJECT_NAME=$(basename $(dirname  $SRC_FILE))
+# Pool of pre-initialized cdylib crates, each with its own persistent
+# target dir, so builds in different slots run in parallel. Every build
+# only swaps src/lib.rs of a free slot, so cargo does an incremental build
+# instead of a cold one.
+POOL_FOLDER=${SORCESTONE_CARGO_POOL:-$HOME/.cache/sorcestone/cargo_pool}
+POOL_SIZE=${SORCESTONE_CARGO_POOL_SIZE:-4}
 
-cd $BUILD_FOLDER
+case "$(uname)" in
+    Darwin) LIB_EXT=dylib ;;
+    *) LIB_EXT=so ;;
+esac
+
+init_slot() {
+    # $1 - slot folder, $2 - crate name
+    echo "=== Init $2 ==="
+    cargo new --lib --vcs none --name "$2" "$1"
+    echo "" >> "$1/Cargo.toml"
+    echo "[lib]" >> "$1/Cargo.toml"
+    echo 'crate-type = ["cdylib"]' >> "$1/Cargo.toml"
+    echo "" >> "$1/Cargo.toml"
+    echo "[profile.release]" >> "$1/Cargo.toml"
+    echo "incremental = true" >> "$1/Cargo.toml"
+    echo "=== Check Cargo Toml ==="
+    cat "$1/Cargo.toml"
+}
+
+acquire_slot() {
+    # The slot is held by a flock on its lock file. The kernel releases it
+    # when this script and the cargo it runs exit, even if they are killed,
+    # so there are no stale locks to reclaim.
+    while true; do
+        for i in $(seq 0 $((POOL_SIZE - 1))); do
+            exec {SLOT_LOCK_FD}>"$POOL_FOLDER/slot_$i.flock"
+            if flock -n "$SLOT_LOCK_FD"; then
+                SLOT_ID=$i
+                return 0
+            fi
+            exec {SLOT_LOCK_FD}>&-
+        done
+        sleep 0.2
+    done
+}
+
+mkdir -p "$POOL_FOLDER"
+acquire_slot
+
+PROJECT_NAME=sorcestone_slot_$SLOT_ID
+BUILD_FOLDER=$POOL_FOLDER/slot_$SLOT_ID
+export CARGO_TARGET_DIR=$BUILD_FOLDER/target
 echo "BUILD_DIR - ${BUILD_FOLDER}"
-echo "=== Init ==="
-cargo new --lib $PROJECT_NAME 
-cd $PROJECT_NAME 
-echo "=== Fix Cargo Toml ==="
-echo "" >> Cargo.toml
-echo "[lib]" >> Cargo.toml
-echo 'crate-type = ["cdylib"]' >> Cargo.toml
-echo "" >> Cargo.toml
-echo "=== Check Cargo Toml ==="
-cat Cargo.toml
+if [ ! -f "$BUILD_FOLDER/Cargo.toml" ]; then
+    rm -rf "$BUILD_FOLDER"
+    init_slot "$BUILD_FOLDER" "$PROJECT_NAME" || exit 1
+fi
+cd "$BUILD_FOLDER" || exit 1
 
 echo "=== Copy Source Code ==="
-cp $SRC_FILE src/lib.rs
+# Keep lib.rs untouched when the source did not change, so cargo sees it fresh
+cmp -s "$SRC_FILE" src/lib.rs || cp "$SRC_FILE" src/lib.rs
 
 echo "=== Check lib RS ==="
 cat src/lib.rs
 
+if [ "$MODE" = "check" ]; then
+    echo "=== Check ==="
+    time cargo check --release --message-format=json
+    exit $?
+fi
+
 echo "=== Build ==="
-time cargo build --release
+# Diagnostics go to stdout as JSON lines, parsed into compact errors for the LLM
+time cargo build --release --message-format=json
 BUILD_RETURN_CODE=$?
 
-echo "=== Copy artefact ==="
-cp target/release/lib$PROJECT_NAME.dylib $DST_FILE
+if [ $BUILD_RETURN_CODE -eq 0 ]; then
+    echo "=== Copy artefact ==="
+    cp "$CARGO_TARGET_DIR/release/lib$PROJECT_NAME.$LIB_EXT" "$DST_FILE"
+fi
 
-rm -rf $BUILD_FOLDER
 echo "=== Done ==="
 exit $BUILD_RETURN_CODE
@@ -0,0 +1,362 @@
+import os
+import time
+import ctypes
+import random
+import statistics
+
+from sorcestone.utils.logger import logger
+from sorcestone.utils.ast_utils import split_units
+from sorcestone.main.repair_stage import RepairStage, run_isolated
+from sorcestone.main.generate_code_from_ast import IMPORTANT_REQUIREMENTS
+
+
+# ctypes type names of fixed width and platform typedefs
+NAMED_CTYPES = {
+    'int8_t': 'c_int8', 'uint8_t': 'c_uint8',
+    'int16_t': 'c_int16', 'uint16_t': 'c_uint16',
+    'int32_t': 'c_int32', 'uint32_t': 'c_uint32',
+    'int64_t': 'c_int64', 'uint64_t': 'c_uint64',
+    'size_t': 'c_size_t', 'ssize_t': 'c_ssize_t',
+    'intptr_t': 'c_ssize_t', 'uintptr_t': 'c_size_t', 'ptrdiff_t': 'c_ssize_t',
+}
+
+FLOAT_CTYPES = {'c_float', 'c_double', 'c_longdouble'}
+
+# Seconds a single timed batch of calls should take at least
+MIN_BATCH_TIME = 0.005
+SAMPLES = 10
+INPUTS = 16
+MAX_REPEATS = 1 << 20
+BOOTSTRAP_ROUNDS = 1000
+BENCHMARK_TIMEOUT = 300
+# Perf repair stops after this many rounds unless the policy is stricter
+PERF_MAX_ROUNDS = 3
+
+
+def get_ctype_name(names):
+    """
+    Map C type specifiers to the ctypes type name.
+
+    Args:
+        names ([str]): IdentifierType names, e.g. ['unsigned', 'long']
+
+    Returns:
+        str: ctypes type name, None for void, False if the type is not supported
+    """
+    names = list(names)
+    if len(names) == 1 and names[0] in NAMED_CTYPES:
+        return NAMED_CTYPES[names[0]]
+    if names == ['void']:
+        return None
+    unsigned = 'unsigned' in names
+    if 'double' in names:
+        return 'c_longdouble' if 'long' in names else 'c_double'
+    if 'float' in names:
+        return 'c_float'
+    if '_Bool' in names:
+        return 'c_bool'
+    if 'char' in names:
+        # Numeric char, c_char would turn values into bytes
+        return 'c_ubyte' if unsigned else 'c_byte'
+    if 'short' in names:
+        return 'c_ushort' if unsigned else 'c_short'
+    longs = names.count('long')
+    if longs:
+        return ('c_ulonglong' if unsigned else 'c_longlong') if longs > 1 else ('c_ulong' if unsigned else 'c_long')
+    if set(names) <= {'int', 'signed', 'unsigned'}:
+        return 'c_uint' if unsigned else 'c_int'
+    return False
+
+
+def resolve_type_names(node, typedefs):
+    """
+    Get IdentifierType names of a scalar type node, resolving typedefs.
+
+    Returns:
+        list: type specifiers, None if the type is not a scalar (pointer,
+            struct, array, ...)
+    """
+    seen = set()
+    while node and node['_nodetype'] == 'TypeDecl' and node['type']['_nodetype'] == 'IdentifierType':
+        names = node['type']['names']
+        if len(names) == 1 and names[0] in typedefs and names[0] not in NAMED_CTYPES and names[0] not in seen:
+            seen.add(names[0])
+            node = typedefs[names[0]]
+            continue
+        return names
+    return None
+
+
+def get_signatures(ast):
+    """
+    Get ctypes signatures of exported functions with scalar arguments.
+
+    Args:
+        ast (dict): FileAST node
+
+    Returns:
+        list: dicts with name, restype and argtypes (ctypes type names), or
+            name and skipped reason
+    """
+    prelude, functions = split_units(ast)
+    typedefs = {ext['name']: ext['type'] for ext in prelude if ext['_nodetype'] == 'Typedef'}
+    signatures = []
+    for name, func in functions.items():
+        decl = func['decl']
+        if 'static' in (decl.get('storage') or []):
+            continue
+        func_type = decl['type']
+        signature = {"name": name}
+        signatures.append(signature)
+
+        restype = get_ctype_name(resolve_type_names(func_type['type'], typedefs) or ['?'])
+        params = ((func_type.get('args') or {}).get('params')) or []
+        argtypes = []
+        for param in params:
+            if param['_nodetype'] == 'EllipsisParam':
+                argtypes = False
+                break
+            names = resolve_type_names(param['type'], typedefs)
+            if names == ['void'] and len(params) == 1:
+                break
+            argtypes.append(get_ctype_name(names or ['?']))
+        if restype is False or argtypes is False or False in argtypes or None in argtypes:
+            signature["skipped"] = "non scalar arguments or return type"
+            continue
+        signature["restype"] = restype
+        signature["argtypes"] = argtypes
+    return signatures
+
+
+def get_inputs(argtypes, seed=0):
+    """
+    Deterministic small arguments, so loops driven by arguments stay short.
+    """
+    rng = random.Random(seed)
+    return [
+        tuple(
+            rng.uniform(0, 100) if argtype in FLOAT_CTYPES else rng.randint(0, 100)
+            for argtype in argtypes
+        )
+        for _ in range(INPUTS)
+    ]
+
+
+def time_calls(func, inputs, repeats):
+    started = time.perf_counter()
+    for _ in range(repeats):
+        for args in inputs:
+            func(*args)
+    return time.perf_counter() - started
+
+
+def calibrate(func, inputs):
+    """
+    Get number of repeats of inputs, which takes at least MIN_BATCH_TIME.
+    """
+    repeats = 1
+    while repeats < MAX_REPEATS and time_calls(func, inputs, repeats) < MIN_BATCH_TIME:
+        repeats *= 2
+    return repeats
+
+
+def get_ratio_ci(src_samples, dst_samples, seed=0):
+    """
+    Bootstrap 95% confidence interval of the mean time ratio dst / src.
+    """
+    rng = random.Random(seed)
+    ratios = []
+    for _ in range(BOOTSTRAP_ROUNDS):
+        src = statistics.fmean(rng.choices(src_samples, k=len(src_samples)))
+        dst = statistics.fmean(rng.choices(dst_samples, k=len(dst_samples)))
+        ratios.append(dst / src)
+    ratios.sort()
+    return ratios[int(0.025 * BOOTSTRAP_ROUNDS)], ratios[int(0.975 * BOOTSTRAP_ROUNDS) - 1]
+
+
+def load_function(lib, signature):
+    func = getattr(lib, signature["name"])
+    func.restype = getattr(ctypes, signature["restype"]) if signature["restype"] else None
+    func.argtypes = [getattr(ctypes, argtype) for argtype in signature["argtypes"]]
+    return func
+
+
+def benchmark_function(src_lib, dst_lib, signature):
+    """
+    Time a function in both libraries.
+
+    Samples of both libraries are interleaved, so CPU frequency changes and
+    background load affect them alike. Times include the ctypes call
+    overhead, which is the same on both sides and pulls ratios of tiny
+    functions towards 1.
+    """
+    result = {"name": signature["name"]}
+    try:
+        src_func = load_function(src_lib, signature)
+        dst_func = load_function(dst_lib, signature)
+    except AttributeError as e:
+        result["error"] = str(e)
+        return result
+
+    inputs = get_inputs(signature["argtypes"])
+    # Each side gets its own repeat count, a much slower translation would
+    # take ages with the repeat count of the source function
+    src_repeats = calibrate(src_func, inputs)
+    dst_repeats = calibrate(dst_func, inputs)
+    src_samples = []
+    dst_samples = []
+    for _ in range(SAMPLES):
+        src_samples.append(time_calls(src_func, inputs, src_repeats) / (src_repeats * len(inputs)))
+        dst_samples.append(time_calls(dst_func, inputs, dst_repeats) / (dst_repeats * len(inputs)))
+
+    src_time = statistics.fmean(src_samples)
+    dst_time = statistics.fmean(dst_samples)
+    result.update({
+        "src_ns": round(src_time * 1e9, 2),
+        "dst_ns": round(dst_time * 1e9, 2),
+        "ratio": round(dst_time / src_time, 3),
+        "ci": [round(value, 3) for value in get_ratio_ci(src_samples, dst_samples)],
+        "repeats": [src_repeats, dst_repeats],
+        "samples": SAMPLES,
+    })
+    return result
+
+
+def benchmark_libraries(src_lib_path, dst_lib_path, signatures):
+    """ Entry point of the benchmark process """
+    src_lib = ctypes.CDLL(os.path.abspath(src_lib_path))
+    dst_lib = ctypes.CDLL(os.path.abspath(dst_lib_path))
+    results = []
+    for signature in signatures:
+        if "skipped" in signature:
+            results.append(signature)
+        else:
+            results.append(benchmark_function(src_lib, dst_lib, signature))
+    return results
+
+
+def run_benchmark(src_lib_path, dst_lib_path, signatures, timeout=BENCHMARK_TIMEOUT):
+    """
+    Benchmark functions of both libraries in a separate process, so a crash
+    or a hang in a library does not affect the pipeline.
+
+    Returns:
+        list: Per function results
+
+    Raises:
+        Exception: If the benchmark process crashes or times out
+    """
+    return run_isolated(benchmark_libraries, (src_lib_path, dst_lib_path, signatures), timeout, "Benchmark")
+
+
+def get_regressions(results, threshold):
+    """
+    Get functions which are slower than threshold times the source, with
+    the whole confidence interval above the threshold.
+    """
+    return [result for result in results if "ci" in result and result["ci"][0] > threshold]
+
+
+def format_results(results):
+    lines = []
+    for result in results:
+        if "ratio" in result:
+            lines.append(
+                f"{result['name']}: {result['dst_ns']}ns vs {result['src_ns']}ns, "
+                f"{result['ratio']}x (95% CI {result['ci'][0]}-{result['ci'][1]}x)"
+            )
+        else:
+            lines.append(f"{result['name']}: {result.get('skipped') or result.get('error')}")
+    return "\n".join(lines)
+
+
+def get_regression_message(regressions, threshold, source_lang="C"):
+    lines = [f"Performance regression, these functions are more than {threshold}x slower than {source_lang}:"]
+    lines += [
+        f"- {result['name']}: {result['ratio']}x slower (95% CI {result['ci'][0]}-{result['ci'][1]}x)"
+        for result in regressions
+    ]
+    return "\n".join(lines)
+
+
+def get_perf_query(code, message, source_lang, dest_lang):
+    return f"""
+    The following {dest_lang} code was translated from {source_lang} and compiled as a shared object (.so) file. It passes the functional tests, but it is slower than the original {source_lang} code.
+
+    <CODE>
+    {code}
+    </CODE>
+
+    {message}
+
+    Optimize the code, so it is at least as fast as the {source_lang} code. Keep the interface and the behavior unchanged. Important requirements for the {dest_lang} code:
+    {IMPORTANT_REQUIREMENTS[dest_lang]}
+    Return the complete {dest_lang} file. DO NOT INCLUDE ANY EXPLANATIONS in your response.
+    """
+
+
+class PerfStage(RepairStage):
+    """
+    Compare performance of the translated library with the source one.
+
+    Every exported function with scalar arguments is timed in both
+    libraries, results are written next to dst_file as .bench.json. If the
+    translation is slower than threshold, an Iteration asks the LLM to
+    optimize it, validated by the tests and the benchmark. Giving up on the
+    budget keeps the working translation.
+    """
+
+    name = "perf"
+    title = "Benchmark"
+    report_extension = ".bench.json"
+    max_rounds = PERF_MAX_ROUNDS
+
+    def __init__(self, meta_file, src_lib, dst_file, test_file, source_lang="C", dest_lang="Rust", threshold=1.5,
+                 policy=None):
+        super().__init__(meta_file, src_lib, dst_file, test_file, source_lang=source_lang, dest_lang=dest_lang,
+                         policy=policy)
+        self.threshold = threshold
+
+    def get_signatures(self, ast):
+        return get_signatures(ast)
+
+    def measure(self, dst_lib, signatures):
+        return run_benchmark(self.src_lib, dst_lib, signatures)
+
+    def get_failures(self, results):
+        return get_regressions(results, self.threshold)
+
+    def format_results(self, results):
+        return format_results(results)
+
+    def get_failure_message(self, failures, signatures):
+        return get_regression_message(failures, self.threshold, self.source_lang)
+
+    def get_query(self, code, failures, signatures):
+        return get_perf_query(code, self.get_failure_message(failures, signatures), self.source_lang, self.dest_lang)
+
+    def on_measure_error(self, error, signatures):
+        # The translation already passed its tests, a broken benchmark only skips the optimization
+        logger.warning(f"Skipping the benchmark of {self.dst_file}: {error}")
+        return [
+            signature if "skipped" in signature else {"name": signature["name"], "error": str(error)}
+            for signature in signatures
+        ]
+
+    def on_budget_exceeded(self, error, results):
+        logger.warning(f"Keeping the slower translation: {error}")
+        return results
+
+
+def get_perf_stage(meta_file, src_lib, dst_file, test_file, source_lang="C", dest_lang="Rust", threshold=1.5,
+                   policy=None):
+    return PerfStage(
+        meta_file=meta_file,
+        src_lib=src_lib,
+        dst_file=dst_file,
+        test_file=test_file,
+        source_lang=source_lang,
+        dest_lang=dest_lang,
+        threshold=threshold,
+        policy=policy
+    )
@@ -1,10 +1,218 @@
 import os
+import time
 import subprocess
+from functools import lru_cache
 
 from sorcestone.utils.logger import logger
+from sorcestone.utils.metrics import record
+from sorcestone.utils.diagnostics import (
+    format_diagnostics, get_output_tail, parse_compiler_output, strip_json_messages
+)
+from sorcestone.utils.cache import FileCache, hash_key, hash_file
+from sorcestone.utils.file_utils import get_temp_path
+from sorcestone.utils.process_utils import run_process
+from sorcestone.main.manifest import get_source_inputs
 
 
-def compile_code(file_path, language, output_file=None, skip=False):
+# Commands reporting toolchain version, used as a part of the artifact cache key
+TOOLCHAIN_VERSION_COMMANDS = {
+    'C': ['gcc', '--version'],
+    'Rust': ['rustc', '--version'],
+}
+
+
+def get_compile_script(language, name='compile.sh'):
+    PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(PROJECT_ROOT, f'../language_tools/{language}/{name}')
+
+
+@lru_cache(maxsize=None)
+def get_artifact_cache():
+    return FileCache('artifacts')
+
+
+@lru_cache(maxsize=None)
+def get_toolchain_version(language):
+    """
+    Get version string of the language toolchain.
+
+    Args:
+        language (str): Language name (e.g., 'C', 'Rust')
+
+    Returns:
+        str: Toolchain version output, empty string if unknown
+    """
+    command = TOOLCHAIN_VERSION_COMMANDS.get(language)
+    if not command:
+        return ""
+    try:
+        result = subprocess.run(command, capture_output=True, text=True, check=False)
+    except FileNotFoundError:
+        return ""
+    return result.stdout.strip()
+
+
+def get_artifact_key(file_path, language, build_args=""):
+    """
+    Get artifact cache key for the source file.
+
+    Key covers content of the source and local headers it includes,
+    language, toolchain version, build flags and the compile script
+    itself, since the script defines compiler flags. Headers are keyed by
+    their path relative to the source, so moving a project keeps its keys.
+    """
+    source_dir = os.path.dirname(os.path.abspath(file_path))
+    sources = [
+        part
+        for path, digest in sorted(get_source_inputs(file_path).items())
+        for part in (os.path.relpath(path, source_dir), digest)
+    ]
+    return hash_key(
+        *sources,
+        language,
+        get_toolchain_version(language),
+        hash_file(get_compile_script(language)),
+        build_args or ""
+    )
+
+
+class CompilationError(Exception):
+    """
+    Compilation failure with the parsed compiler errors.
+
+    Args:
+        message (str): Short description, e.g. "Rust code compilation failed"
+        diagnostics (list): Deduplicated errors, see utils.diagnostics
+        output (str): Raw compiler errors, used if none could be parsed
+    """
+
+    def __init__(self, message, diagnostics=(), output=""):
+        super().__init__(message)
+        self.diagnostics = list(diagnostics)
+        self.output = output
+
+    def get_message(self):
+        """
+        Get compact failure description for the LLM.
+        """
+        details = format_diagnostics(self.diagnostics) if self.diagnostics else get_output_tail(self.output)
+        return f"{self}\n{details}" if details else str(self)
+
+
+class CompileJob(object):
+    """
+    Single compilation of a source file, shared by sync and async compile.
+
+    Looks up the artifact cache and prepares the compile.sh command building
+    into a temporary file, so concurrent readers never see a partially
+    written output. finish() moves the result into place and caches it.
+
+    If asked to and the language provides check.sh, the code is type checked
+    first, so broken code fails fast without the optimized build. With
+    check_only the build is left out, nothing is written then and
+    languages without check.sh are built as usual.
+    """
+
+    def __init__(self, file_path, language, output_file=None, use_cache=True, check=False, check_only=False):
+        self.file_path = file_path
+        self.language = language
+        # Get language-specific compile.sh path
+        compile_script = get_compile_script(language)
+
+        if not os.path.exists(compile_script):
+            raise FileNotFoundError(f"Compile script not found for language {language}")
+
+        check_script = get_compile_script(language, 'check.sh')
+        self.check_command = None
+        if (check or check_only) and os.path.exists(check_script):
+            self.check_command = ['/bin/bash', check_script, file_path]
+        self.check_only = check_only and self.check_command is not None
+        self.cached_result = None
+        self.started = time.perf_counter()
+        if self.check_only:
+            return
+
+        # Generate output file path if not provided
+        if output_file is None:
+            output_file = f"{os.path.splitext(file_path)[0]}.so"
+        self.output_file = output_file
+
+        self.artifact_key = get_artifact_key(file_path, language) if use_cache else None
+        if self.artifact_key and get_artifact_cache().get(self.artifact_key, output_file):
+            logger.info(f"{language} compile output: reused cached artifact {self.artifact_key}")
+            record("compile_cache_hits", 1, language=language)
+            self.cached_result = subprocess.CompletedProcess(
+                args=['/bin/bash', compile_script, file_path, output_file],
+                returncode=0,
+                stdout=f"Reused cached artifact {self.artifact_key}",
+                stderr=""
+            )
+            return
+
+        self.build_file = get_temp_path(output_file)
+        self.command = ['/bin/bash', compile_script, file_path, self.build_file]
+
+    def raise_error(self, result):
+        with open(self.file_path, errors='replace') as f:
+            source = f.read()
+        diagnostics = parse_compiler_output(result.stdout, result.stderr, source)
+        if diagnostics:
+            logger.error(f"{self.language} compile diagnostics:\n{format_diagnostics(diagnostics)}")
+        raise CompilationError(
+            f"{self.language} code compilation failed", diagnostics, result.stderr or result.stdout
+        )
+
+    def finish_check(self, result):
+        """
+        Args:
+            result (subprocess.CompletedProcess): check.sh result
+
+        Raises:
+            CompilationError: If the check fails, the build is not needed then
+        """
+        record("check_seconds", time.perf_counter() - self.started, language=self.language)
+        if result.returncode != 0:
+            logger.error(f"{self.language} check errors: {result.stderr}")
+            self.raise_error(result)
+        # Build time is counted separately
+        self.started = time.perf_counter()
+
+    def finish(self, result):
+        """
+        Args:
+            result (subprocess.CompletedProcess): compile.sh result, None if it
+                could not be started
+
+        Returns:
+            subprocess.CompletedProcess: Compilation result
+
+        Raises:
+            CompilationError: If compilation fails
+        """
+        try:
+            if result and result.returncode == 0:
+                os.replace(self.build_file, self.output_file)
+        finally:
+            if os.path.exists(self.build_file):
+                os.remove(self.build_file)
+        if result is None:
+            return None
+
+        record("compile_seconds", time.perf_counter() - self.started, language=self.language)
+        logger.info(f"{self.language} compile output: {strip_json_messages(result.stdout)}")
+        if result.stderr:
+            logger.error(f"{self.language} compile errors: {result.stderr}")
+
+        if result.returncode != 0:
+            self.raise_error(result)
+
+        if self.artifact_key:
+            get_artifact_cache().put(self.artifact_key, self.output_file)
+
+        return result
+
+
+def compile_code(file_path, language, output_file=None, skip=False, use_cache=True, check=False, check_only=False):
     """
     Compile code using the compile.sh script from language specific folder.
 
@@ -14,41 +222,70 @@ def compile_code(file_path, language, output_file=None, skip=False):
         output_file (str, optional): Path for the output file. If not provided,
             will use source_file_path + '.so'
         skip (bool, optional): Skip compilation if True. Defaults to False.
+        use_cache (bool, optional): Reuse previously built artifact for the
+            identical source and toolchain. Defaults to True.
+        check (bool, optional): Run check.sh of the language first, if there
+            is one, and build only when it passes. Defaults to False.
+        check_only (bool, optional): Only run check.sh, output_file is not
+            written. Languages without check.sh are built. Defaults to False.
 
     Returns:
         subprocess.CompletedProcess: Compilation result
-    
+
     Raises:
         FileNotFoundError: If compile.sh is not found for the language
-        Exception: If compilation fails
+        CompilationError: If compilation fails
     """
     if skip:
         return None
 
-    # Get language-specific compile.sh path
-    PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
-    compile_script = os.path.join(PROJECT_ROOT, f'../language_tools/{language}/compile.sh')
-    
-    if not os.path.exists(compile_script):
-        raise FileNotFoundError(f"Compile script not found for language {language}")
-
-    # Generate output file path if not provided
-    if output_file is None:
-        output_file = f"{os.path.splitext(file_path)[0]}.so"
-
-    # Run compilation
-    result = subprocess.run(
-        ['/bin/bash', compile_script, file_path, output_file],
-        capture_output=True,
-        text=True,
-        check=False
-    )
+    job = CompileJob(file_path, language, output_file=output_file, use_cache=use_cache, check=check,
+                     check_only=check_only)
+    if job.cached_result:
+        return job.cached_result
+
+    if job.check_command:
+        result = subprocess.run(job.check_command, capture_output=True, text=True, check=False)
+        job.finish_check(result)
+        if job.check_only:
+            return result
+
+    result = None
+    try:
+        # Run compilation
+        result = subprocess.run(
+            job.command,
+            capture_output=True,
+            text=True,
+            check=False
+        )
+    finally:
+        job.finish(result)
+    return result
+
+
+async def acompile_code(file_path, language, output_file=None, skip=False, use_cache=True, check=False,
+                        check_only=False):
+    """
+    Same as compile_code, but does not block the event loop while compiling.
+    """
+    if skip:
+        return None
 
-    logger.info(f"{language} compile output: {result.stdout}")
-    if result.stderr:
-        logger.error(f"{language} compile errors: {result.stderr}")
+    job = CompileJob(file_path, language, output_file=output_file, use_cache=use_cache, check=check,
+                     check_only=check_only)
+    if job.cached_result:
+        return job.cached_result
 
-    if result.returncode != 0:
-        raise Exception(f"{language} code compilation failed")
+    if job.check_command:
+        result = await run_process(job.check_command)
+        job.finish_check(result)
+        if job.check_only:
+            return result
 
-    return result
\ No newline at end of file
+    result = None
+    try:
+        result = await run_process(job.command)
+    finally:
+        job.finish(result)
+    return result
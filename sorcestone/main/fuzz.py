@@ -0,0 +1,989 @@
+import os
+import math
+import time
+import zlib
+import ctypes
+import pickle
+import random
+import select
+import shutil
+import signal
+import tempfile
+import itertools
+import subprocess
+
+import cffi
+
+from sorcestone.utils.logger import logger
+from sorcestone.utils.metrics import record
+from sorcestone.utils.ast_utils import iter_nodes, split_units
+from sorcestone.main.repair_stage import RepairStage, run_isolated
+from sorcestone.main.benchmark import FLOAT_CTYPES, get_ctype_name, resolve_type_names
+from sorcestone.main.generate_code_from_ast import IMPORTANT_REQUIREMENTS
+
+try:
+    import numpy
+except ImportError:
+    # Inputs are generated with the random module instead, several times slower
+    numpy = None
+
+
+# C declarations of ctypes types for the cffi cdef, char is numeric like in the benchmark.
+# long double is left out, cffi does not convert it to a Python number
+CDEF_TYPES = {
+    'c_int8': 'int8_t', 'c_uint8': 'uint8_t',
+    'c_int16': 'int16_t', 'c_uint16': 'uint16_t',
+    'c_int32': 'int32_t', 'c_uint32': 'uint32_t',
+    'c_int64': 'int64_t', 'c_uint64': 'uint64_t',
+    'c_size_t': 'size_t', 'c_ssize_t': 'ssize_t',
+    'c_bool': '_Bool',
+    'c_byte': 'signed char', 'c_ubyte': 'unsigned char',
+    'c_short': 'short', 'c_ushort': 'unsigned short',
+    'c_int': 'int', 'c_uint': 'unsigned int',
+    'c_long': 'long', 'c_ulong': 'unsigned long',
+    'c_longlong': 'long long', 'c_ulonglong': 'unsigned long long',
+    'c_float': 'float', 'c_double': 'double',
+}
+
+UNSIGNED_CTYPES = {
+    'c_uint8', 'c_uint16', 'c_uint32', 'c_uint64', 'c_size_t',
+    'c_ubyte', 'c_ushort', 'c_uint', 'c_ulong', 'c_ulonglong',
+}
+
+DEFAULT_CASES = 100000
+BATCH_SIZE = 8192
+# Boundary value combinations tried before random inputs
+MAX_BOUNDARY_CASES = 1024
+# Constants of the function body are boundary values too, e.g. x > 1000
+MAX_CONSTANTS = 8
+MAX_ARRAY_LENGTH = 32
+# Small domain, used for every third value and when large inputs make the source hang
+SMALL_LIMIT = 100
+MEDIUM_LIMIT = 1 << 15
+# libm implementations may differ in the last bits
+REL_TOLERANCE = 1e-6
+MAX_COUNTEREXAMPLES = 3
+MAX_SHRINK_STEPS = 200
+# Inputs crashing the source are outside of its domain, stop looking for them after this many
+MAX_SOURCE_CRASHES = 32
+BATCH_TIMEOUT = 10
+CASE_TIMEOUT = 1
+# Seconds of fuzzing and shrinking per function, results are partial after that
+FUNCTION_TIMEOUT = 60
+# Seconds for loading the libraries and compiling the drivers
+SETUP_TIMEOUT = 60
+# Compiler of the loop drivers, without one every case is a separate cffi call
+DRIVER_CC = os.environ.get('CC') or 'gcc'
+# Fuzz repair stops after this many rounds unless the policy is stricter
+FUZZ_MAX_ROUNDS = 3
+
+
+class CaseCrashed(object):
+    """ Result of a forked run which crashed or timed out """
+
+    def __init__(self, reason):
+        self.reason = reason
+
+
+def get_param_type(param, typedefs):
+    """
+    Get ctypes name and pointer flags of a parameter.
+
+    Returns:
+        tuple: (ctype name or False, is pointer, is const pointer)
+    """
+    node = param['type']
+    if node['_nodetype'] == 'PtrDecl':
+        target = node['type']
+        names = resolve_type_names(target, typedefs)
+        return get_ctype_name(names or ['?']) or False, True, 'const' in (target.get('quals') or [])
+    return get_ctype_name(resolve_type_names(node, typedefs) or ['?']), False, False
+
+
+def get_fuzz_signatures(ast):
+    """
+    Get signatures of exported functions which can be fuzzed: scalar
+    arguments and pointers to scalars passed with their length, e.g.
+    (const int *values, size_t n).
+
+    Args:
+        ast (dict): FileAST node
+
+    Returns:
+        list: dicts with name, restype (ctypes type name, None for void) and
+            params, or name and skipped reason. Params have name, ctype and
+            kind 'scalar', 'array' (with const flag and length param index)
+            or 'length' (with array param index)
+    """
+    prelude, functions = split_units(ast)
+    typedefs = {ext['name']: ext['type'] for ext in prelude if ext['_nodetype'] == 'Typedef'}
+    signatures = []
+    for name, func in functions.items():
+        decl = func['decl']
+        if 'static' in (decl.get('storage') or []):
+            continue
+        func_type = decl['type']
+        signature = {"name": name}
+        signatures.append(signature)
+
+        restype = get_ctype_name(resolve_type_names(func_type['type'], typedefs) or ['?'])
+        params = [param for param in ((func_type.get('args') or {}).get('params')) or []]
+        if len(params) == 1 and resolve_type_names(params[0]['type'], typedefs) == ['void']:
+            params = []
+        if (restype is not None and restype not in CDEF_TYPES) or any(
+                param['_nodetype'] == 'EllipsisParam' for param in params):
+            signature["skipped"] = "unsupported arguments or return type"
+            continue
+
+        fuzz_params = []
+        for param in params:
+            ctype, is_pointer, is_const = get_param_type(param, typedefs)
+            if ctype not in CDEF_TYPES:
+                break
+            fuzz_params.append({
+                "name": param.get('name') or f"arg{len(fuzz_params)}",
+                "ctype": ctype,
+                "kind": "array" if is_pointer else "scalar",
+                "const": is_const,
+            })
+        else:
+            if pair_arrays(fuzz_params):
+                if restype is None and not any(
+                        param["kind"] == "array" and not param["const"] for param in fuzz_params):
+                    signature["skipped"] = "no return value or output arrays to compare"
+                    continue
+                signature["restype"] = restype
+                signature["params"] = fuzz_params
+                signature["constants"] = get_constants(func)
+                continue
+        signature["skipped"] = "unsupported arguments or return type"
+    return signatures
+
+
+def parse_constant(node):
+    """ Get value of a numeric Constant node, None for others """
+    try:
+        if node['type'] in ('float', 'double'):
+            return float(node['value'].rstrip('fFlL'))
+        value = node['value'].rstrip('uUlL')
+        if node['type'] != 'char' and value:
+            if value[0] == '0' and len(value) > 1 and value[1] not in 'xXbB':
+                return int(value, 8)
+            return int(value, 0)
+    except ValueError:
+        pass
+    return None
+
+
+def get_constants(func):
+    """ Get numeric constants of the function body, the most frequent first """
+    counts = {}
+    for node in iter_nodes(func['body']):
+        if node['_nodetype'] == 'Constant':
+            value = parse_constant(node)
+            if value is not None and value not in (0, 1):
+                counts[value] = counts.get(value, 0) + 1
+    return sorted(counts, key=lambda value: -counts[value])[:MAX_CONSTANTS]
+
+
+def pair_arrays(params):
+    """
+    Pair every array param with the integer param right after it, or right
+    before it, which is its length.
+
+    Returns:
+        bool: False if some array has no length
+    """
+    for index, param in enumerate(params):
+        if param["kind"] != "array":
+            continue
+        for length_index in (index + 1, index - 1):
+            if 0 <= length_index < len(params):
+                length = params[length_index]
+                if length["kind"] == "scalar" and length["ctype"] not in FLOAT_CTYPES | {'c_bool'}:
+                    length["kind"] = "length"
+                    length["array"] = index
+                    param["length"] = length_index
+                    break
+        else:
+            return False
+    return True
+
+
+def get_c_types(signature):
+    """
+    Returns:
+        tuple: C return type and C parameter types of the function
+    """
+    params = [
+        f"{CDEF_TYPES[param['ctype']]} *" if param["kind"] == "array" else CDEF_TYPES[param["ctype"]]
+        for param in signature["params"]
+    ]
+    return CDEF_TYPES[signature["restype"]] if signature["restype"] else "void", params
+
+
+def get_cdef(signatures):
+    """
+    Get cffi declarations of the fuzzed functions.
+    """
+    lines = []
+    for signature in signatures:
+        if "skipped" in signature:
+            continue
+        restype, params = get_c_types(signature)
+        lines.append(f"{restype} {signature['name']}({', '.join(params) or 'void'});")
+    return "\n".join(lines)
+
+
+def get_driver_name(signature):
+    return f"sorcestone_fuzz_{signature['name']}"
+
+
+def get_driver_code(signatures):
+    """
+    Get C loops calling a function through a pointer once per case, so a
+    batch of cases takes a single cffi call.
+
+    Driver of int f(const int *values, size_t n) takes the function, the
+    number of cases, a column per scalar parameter, a buffer and start
+    offsets per array parameter and the return value column:
+
+        void sorcestone_fuzz_f(int (*f)(int *, size_t), size_t count,
+                               int *p0, size_t *s0, size_t *p1, int *ret)
+
+    Returns:
+        tuple: (cffi declarations, C source)
+    """
+    declarations = []
+    definitions = []
+    for signature in signatures:
+        if "skipped" in signature:
+            continue
+        restype, params = get_c_types(signature)
+        driver_params = [f"{restype} (*f)({', '.join(params) or 'void'})", "size_t count"]
+        args = []
+        for index, (param, c_type) in enumerate(zip(signature["params"], params)):
+            if param["kind"] == "array":
+                driver_params += [f"{c_type}p{index}", f"size_t *s{index}"]
+                args.append(f"p{index} + s{index}[i]")
+            else:
+                driver_params.append(f"{c_type} *p{index}")
+                args.append(f"p{index}[i]")
+        call = f"f({', '.join(args)})"
+        if signature["restype"]:
+            driver_params.append(f"{restype} *ret")
+            call = f"ret[i] = {call}"
+        header = f"void {get_driver_name(signature)}({', '.join(driver_params)})"
+        declarations.append(f"{header};")
+        definitions.append(f"{header}\n{{\n    for (size_t i = 0; i < count; i++)\n        {call};\n}}")
+    source = "#include <stddef.h>\n#include <stdint.h>\n#include <sys/types.h>\n\n" + "\n\n".join(definitions)
+    return "\n".join(declarations), source + "\n"
+
+
+def load_drivers(ffi, signatures, build_dir):
+    """
+    Build the loop drivers with the C compiler and load them.
+
+    Returns:
+        cffi library of the drivers, None if they could not be built
+    """
+    compiler = shutil.which(DRIVER_CC)
+    if not compiler:
+        return None
+    declarations, source = get_driver_code(signatures)
+    source_path = os.path.join(build_dir, "fuzz_drivers.c")
+    lib_path = os.path.join(build_dir, "fuzz_drivers.so")
+    with open(source_path, "w") as f:
+        f.write(source)
+    result = subprocess.run([compiler, "-O2", "-shared", "-fPIC", source_path, "-o", lib_path],
+                            capture_output=True, text=True, check=False)
+    if result.returncode != 0:
+        logger.warning(f"Fuzzing calls cases one by one, the drivers did not build: {result.stderr}")
+        return None
+    ffi.cdef(declarations)
+    return ffi.dlopen(lib_path)
+
+
+def get_int_range(ctype):
+    if ctype == 'c_bool':
+        return 0, 1
+    bits = 8 * ctypes.sizeof(getattr(ctypes, ctype))
+    if ctype in UNSIGNED_CTYPES:
+        return 0, (1 << bits) - 1
+    return -(1 << (bits - 1)), (1 << (bits - 1)) - 1
+
+
+def get_boundary_values(ctype, constants=()):
+    """
+    Get edge case values of the type and values around the constants.
+    """
+    if ctype in FLOAT_CTYPES:
+        largest = 3.4028234663852886e38 if ctype == 'c_float' else 1.7976931348623157e308
+        values = [0.0, -0.0, 1.0, -1.0, 0.5, 1e-40, largest, -largest, math.inf, -math.inf, math.nan]
+        return values + [float(constant) for constant in constants if float(constant) not in values]
+    low, high = get_int_range(ctype)
+    candidates = [0, 1, -1, 2, -2, SMALL_LIMIT, -SMALL_LIMIT, low, low + 1, high, high - 1]
+    for constant in constants:
+        constant = int(constant)
+        candidates += [constant - 1, constant, constant + 1]
+    values = []
+    for value in candidates:
+        if low <= value <= high and value not in values:
+            values.append(value)
+    return values
+
+
+def get_random_values(ctype, count, rng, small=False):
+    """
+    Generate random values of the type, a third of them small, a third
+    medium sized and a third from the whole range, unless small is set.
+
+    Args:
+        rng: numpy Generator, or random.Random without numpy
+
+    Returns:
+        list: Python numbers
+    """
+    is_float = ctype in FLOAT_CTYPES
+    if not is_float:
+        low, high = get_int_range(ctype)
+        ranges = [(max(low, -limit), min(high, limit)) for limit in (SMALL_LIMIT, MEDIUM_LIMIT)] + [(low, high)]
+        if small:
+            ranges = ranges[:1]
+
+    if numpy is None:
+        if is_float:
+            return [
+                rng.uniform(-SMALL_LIMIT, SMALL_LIMIT) if small or rng.random() < 1 / 3
+                else rng.choice((-1, 1)) * 10 ** rng.uniform(-6, 12)
+                for _ in range(count)
+            ]
+        return [rng.randint(*rng.choice(ranges)) for _ in range(count)]
+
+    if is_float:
+        values = rng.uniform(-SMALL_LIMIT, SMALL_LIMIT, count)
+        if not small:
+            wide = rng.choice([-1.0, 1.0], count) * 10 ** rng.uniform(-6, 12, count)
+            values = numpy.where(rng.integers(0, 3, count) == 0, values, wide)
+        return values.tolist()
+    dtype = numpy.uint64 if low >= 0 else numpy.int64
+    choice = rng.integers(0, len(ranges), count)
+    values = numpy.zeros(count, dtype=dtype)
+    for number, (range_low, range_high) in enumerate(ranges):
+        values = numpy.where(choice == number, rng.integers(range_low, range_high, count, dtype=dtype,
+                                                            endpoint=True), values)
+    return values.tolist()
+
+
+def get_rng(seed):
+    return numpy.random.default_rng(seed) if numpy is not None else random.Random(seed)
+
+
+def get_function_seed(seed, name):
+    """ Seed of a function, stable across runs and Python processes """
+    return zlib.crc32(f"{seed}:{name}".encode())
+
+
+def get_boundary_cases(signature, seed):
+    """
+    Combinations of boundary values, all of them if there are few, a
+    deterministic sample otherwise. Arrays get lengths 0, 1 and 2.
+    """
+    choices = []
+    for param in signature["params"]:
+        if param["kind"] == "array":
+            values = get_boundary_values(param["ctype"], signature["constants"])
+            choices.append([[]] + [[value] for value in values[:3]] + [values[:2]])
+        elif param["kind"] == "length":
+            choices.append([0])
+        else:
+            choices.append(get_boundary_values(param["ctype"], signature["constants"]))
+
+    total = math.prod(len(values) for values in choices)
+    if total <= MAX_BOUNDARY_CASES:
+        cases = [list(case) for case in itertools.product(*choices)]
+    else:
+        rng = random.Random(seed)
+        cases = [[rng.choice(values) for values in choices] for _ in range(MAX_BOUNDARY_CASES)]
+    return [fix_lengths(signature, case) for case in cases]
+
+
+def get_random_cases(signature, count, seed, small=False):
+    """
+    Generate a batch of random cases, columns at once.
+    """
+    rng = get_rng(seed)
+    columns = []
+    for param in signature["params"]:
+        if param["kind"] == "array":
+            limit = 8 if small else MAX_ARRAY_LENGTH
+            lengths = [int(length) for length in (
+                rng.integers(0, limit, count, endpoint=True).tolist() if numpy is not None
+                else [rng.randint(0, limit) for _ in range(count)]
+            )]
+            values = get_random_values(param["ctype"], sum(lengths), rng, small=small)
+            offsets = list(itertools.accumulate(lengths, initial=0))
+            columns.append([values[offsets[number]:offsets[number + 1]] for number in range(count)])
+        elif param["kind"] == "length":
+            columns.append([0] * count)
+        else:
+            columns.append(get_random_values(param["ctype"], count, rng, small=small))
+    return [fix_lengths(signature, list(case)) for case in zip(*columns)] if columns else [[]] * count
+
+
+def fix_lengths(signature, case):
+    """ Set length arguments to the lengths of their arrays """
+    for index, param in enumerate(signature["params"]):
+        if param["kind"] == "length":
+            case[index] = len(case[param["array"]])
+    return case
+
+
+class Runner(object):
+    """
+    Calls a function of both libraries through cffi and compares results.
+
+    With a loop driver every batch of cases is a single call per library,
+    running about as fast as the cases can be generated. Without one every
+    case is a cffi call, which limits fuzzing to tens of thousands of cases
+    per second for functions taking arrays.
+    """
+
+    def __init__(self, ffi, src_lib, dst_lib, signature, drivers=None):
+        self.ffi = ffi
+        self.signature = signature
+        self.src_func = getattr(src_lib, signature["name"])
+        self.dst_func = getattr(dst_lib, signature["name"])
+        self.driver = getattr(drivers, get_driver_name(signature)) if drivers is not None else None
+        self.arrays = [index for index, param in enumerate(signature["params"]) if param["kind"] == "array"]
+        self.outputs = [index for index in self.arrays if not signature["params"][index]["const"]]
+        self.is_float = signature["restype"] in FLOAT_CTYPES or any(
+            signature["params"][index]["ctype"] in FLOAT_CTYPES for index in self.outputs
+        )
+
+    def call_all(self, func, cases):
+        """
+        Returns:
+            list: return value and contents of output arrays after the call
+                of every case
+        """
+        if not self.arrays and self.driver is None:
+            # Scalars only, calling one by one is fast enough
+            return [(func(*case), ()) for case in cases]
+
+        # Arrays of all cases share one buffer per param, allocating them one by one is slow
+        buffers = {}
+        offsets = {}
+        starts = {}
+        for index in self.arrays:
+            ctype = CDEF_TYPES[self.signature["params"][index]["ctype"]]
+            offsets[index] = list(itertools.accumulate((len(case[index]) for case in cases), initial=0))
+            # Empty arrays point to a zero past the others, like a buffer of their own
+            buffers[index] = self.ffi.new(f"{ctype}[]", [value for case in cases for value in case[index]] + [0])
+            starts[index] = [
+                offsets[index][number] if case[index] else offsets[index][-1] for number, case in enumerate(cases)
+            ]
+
+        if self.driver is not None:
+            results = self.call_driver(func, cases, buffers, starts)
+        else:
+            results = []
+            for number, case in enumerate(cases):
+                args = list(case)
+                for index in self.arrays:
+                    args[index] = buffers[index] + starts[index][number]
+                results.append(func(*args))
+
+        if not self.outputs:
+            return [(result, ()) for result in results]
+        outputs = {
+            index: self.ffi.unpack(buffers[index], offsets[index][-1]) for index in self.outputs
+        }
+        return [
+            (result, tuple(outputs[index][offsets[index][number]:offsets[index][number + 1]]
+                           for index in self.outputs))
+            for number, result in enumerate(results)
+        ]
+
+    def call_driver(self, func, cases, buffers, starts):
+        """
+        Call func for every case in a single driver call.
+
+        Returns:
+            list: return values
+        """
+        args = [func, len(cases)]
+        for index, param in enumerate(self.signature["params"]):
+            if param["kind"] == "array":
+                args += [buffers[index], self.ffi.new("size_t[]", starts[index])]
+            else:
+                args.append(self.ffi.new(f"{CDEF_TYPES[param['ctype']]}[]", [case[index] for case in cases]))
+        if not self.signature["restype"]:
+            self.driver(*args)
+            return [None] * len(cases)
+        ret = self.ffi.new(f"{CDEF_TYPES[self.signature['restype']]}[]", len(cases))
+        self.driver(*args, ret)
+        return self.ffi.unpack(ret, len(cases))
+
+    def get_mismatches(self, cases):
+        """
+        Run the cases in both libraries.
+
+        Returns:
+            list: (case index, source output, translation output) tuples
+        """
+        src_outputs = self.call_all(self.src_func, cases)
+        dst_outputs = self.call_all(self.dst_func, cases)
+        if src_outputs == dst_outputs:
+            return []
+        if self.is_float and numpy is not None and not self.arrays:
+            src_values = numpy.array([output[0] for output in src_outputs], dtype=float)
+            dst_values = numpy.array([output[0] for output in dst_outputs], dtype=float)
+            close = numpy.isclose(src_values, dst_values, rtol=REL_TOLERANCE, atol=0, equal_nan=True)
+            indexes = numpy.flatnonzero(~close).tolist()
+        else:
+            indexes = [index for index, (src, dst) in enumerate(zip(src_outputs, dst_outputs))
+                       if not outputs_equal(src, dst)]
+        return [(index, src_outputs[index], dst_outputs[index]) for index in indexes]
+
+    def run_side(self, side, cases):
+        return self.call_all(self.src_func if side == "src" else self.dst_func, cases)
+
+
+def values_equal(src, dst):
+    if isinstance(src, float) or isinstance(dst, float):
+        if math.isnan(src) and math.isnan(dst):
+            return True
+        return src == dst or math.isclose(src, dst, rel_tol=REL_TOLERANCE)
+    return src == dst
+
+
+def outputs_equal(src, dst):
+    src_result, src_arrays = src
+    dst_result, dst_arrays = dst
+    if not values_equal(src_result, dst_result):
+        return False
+    return all(
+        len(src_array) == len(dst_array) and all(map(values_equal, src_array, dst_array))
+        for src_array, dst_array in zip(src_arrays, dst_arrays)
+    )
+
+
+def run_forked(timeout, func, *args):
+    """
+    Run func in a forked child, so crashes and hangs of the libraries only
+    take the child down.
+
+    Returns:
+        result of func, or CaseCrashed
+
+    Raises:
+        Exception: If func raised in the child
+    """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        try:
+            data = pickle.dumps((True, func(*args)))
+        except BaseException as e:
+            data = pickle.dumps((False, f"{type(e).__name__}: {e}"))
+        with os.fdopen(write_fd, 'wb') as f:
+            f.write(data)
+        os._exit(0)
+
+    os.close(write_fd)
+    chunks = []
+    deadline = time.monotonic() + timeout
+    with os.fdopen(read_fd, 'rb') as f:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([f], [], [], remaining)[0]:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+                return CaseCrashed("timeout")
+            chunk = os.read(f.fileno(), 1 << 16)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    _, status = os.waitpid(pid, 0)
+    if status != 0 or not chunks:
+        return CaseCrashed("crash")
+    ok, result = pickle.loads(b"".join(chunks))
+    if not ok:
+        raise Exception(result)
+    return result
+
+
+class FunctionFuzzer(object):
+    """
+    Fuzz a single function, batch by batch, isolating crashing inputs.
+    """
+
+    def __init__(self, runner, cases, seed, timeout=FUNCTION_TIMEOUT):
+        self.runner = runner
+        self.signature = runner.signature
+        self.cases = cases
+        self.seed = get_function_seed(seed, self.signature["name"])
+        self.timeout = timeout
+        self.deadline = None
+        self.timed_out = False
+        self.failures = []
+        self.source_crashes = 0
+        self.ran = 0
+
+    def out_of_time(self):
+        if time.monotonic() >= self.deadline:
+            self.timed_out = True
+        return self.timed_out
+
+    def check_case(self, case):
+        """
+        Returns:
+            tuple: (source output, translation output or 'crash' or
+                'timeout'), None if the case passes or crashes the source
+        """
+        result = run_forked(CASE_TIMEOUT, self.runner.get_mismatches, [case])
+        if not isinstance(result, CaseCrashed):
+            return (result[0][1], result[0][2]) if result else None
+        src_result = run_forked(CASE_TIMEOUT, self.runner.run_side, "src", [case])
+        if isinstance(src_result, CaseCrashed):
+            return None
+        return src_result[0], result.reason
+
+    def run_batch(self, cases):
+        """
+        Returns:
+            bool: False if the source hangs on the batch
+        """
+        if self.out_of_time():
+            return True
+        result = run_forked(BATCH_TIMEOUT, self.runner.get_mismatches, cases)
+        if isinstance(result, CaseCrashed) and result.reason == "timeout":
+            src_result = run_forked(BATCH_TIMEOUT, self.runner.run_side, "src", cases)
+            if isinstance(src_result, CaseCrashed):
+                return False
+            # Source is fine, the translation hangs, find out on which input
+            result = CaseCrashed("crash")
+
+        if isinstance(result, CaseCrashed):
+            if len(cases) > 1:
+                middle = len(cases) // 2
+                return self.run_batch(cases[:middle]) and self.run_batch(cases[middle:])
+            if self.source_crashes < MAX_SOURCE_CRASHES:
+                failure = self.check_case(cases[0])
+                if failure:
+                    self.failures.append((cases[0], failure))
+                else:
+                    self.source_crashes += 1
+            return True
+
+        self.failures += [(cases[index], (src, dst)) for index, src, dst in result]
+        return True
+
+    def run(self):
+        """
+        Fuzz until cases are used up, enough counterexamples are found or
+        the timeout passes, the result says if it is partial.
+
+        Returns:
+            dict: fuzzing result of the function
+        """
+        started = time.monotonic()
+        self.deadline = started + self.timeout
+        small = False
+        batches = [get_boundary_cases(self.signature, self.seed)]
+        number = 0
+        while len(self.failures) < MAX_COUNTEREXAMPLES and not self.out_of_time():
+            if not batches:
+                if self.ran >= self.cases:
+                    break
+                number += 1
+                batches.append(get_random_cases(self.signature, min(BATCH_SIZE, self.cases - self.ran),
+                                                self.seed + number, small=small))
+            batch = batches.pop(0)
+            if not self.run_batch(batch):
+                if small:
+                    return {"name": self.signature["name"], "error": "source hangs on generated inputs"}
+                # Large inputs drive loops of the source, stay in the small domain
+                small = True
+                continue
+            if self.timed_out:
+                # Batch was not checked completely
+                break
+            self.ran += len(batch)
+
+        counterexamples = []
+        for case, failure in self.failures[:MAX_COUNTEREXAMPLES]:
+            case, failure = self.shrink(case, failure)
+            counterexample = {"args": case, "expected": failure[0], "actual": failure[1]}
+            if counterexample not in counterexamples:
+                counterexamples.append(counterexample)
+        seconds = time.monotonic() - started
+        return {
+            "name": self.signature["name"],
+            "cases": self.ran,
+            "seed": self.seed,
+            "mismatches": len(self.failures),
+            "source_crashes": self.source_crashes,
+            "counterexamples": counterexamples,
+            "timed_out": self.timed_out,
+            "seconds": round(seconds, 3),
+            "cases_per_second": round(self.ran / seconds) if seconds else None,
+        }
+
+    def shrink(self, case, failure):
+        """
+        Greedily simplify a failing case while it keeps failing: shorter
+        arrays, values closer to zero. Stops at the deadline of the function.
+        """
+        steps = 0
+        improved = True
+        while improved and steps < MAX_SHRINK_STEPS:
+            improved = False
+            for candidate in get_shrink_candidates(self.signature, case):
+                if self.out_of_time():
+                    return case, failure
+                steps += 1
+                candidate_failure = self.check_case(candidate)
+                if candidate_failure:
+                    case, failure = candidate, candidate_failure
+                    improved = True
+                    break
+                if steps >= MAX_SHRINK_STEPS:
+                    break
+        return case, failure
+
+
+def get_simpler_values(value):
+    if isinstance(value, float):
+        if math.isnan(value) or math.isinf(value):
+            return [0.0, 1.0]
+        candidates = [0.0, 1.0, float(math.trunc(value)), value / 2]
+        return [candidate for candidate in candidates if abs(candidate) < abs(value)
+                or (candidate == math.trunc(candidate) and value != math.trunc(value))]
+    # Steps toward zero halving each time, the first failing one is taken
+    candidates = [0, 1, -1, -value]
+    step = value // 2 if value > 0 else -(-value // 2)
+    while step:
+        candidates.append(value - step)
+        step = step // 2 if step > 0 else -(-step // 2)
+    if value:
+        candidates.append(value - 1 if value > 0 else value + 1)
+    simpler = []
+    for candidate in candidates:
+        if (abs(candidate) < abs(value) or (abs(candidate) == abs(value) and candidate > value)) \
+                and candidate not in simpler:
+            simpler.append(candidate)
+    return simpler
+
+
+def get_shrink_candidates(signature, case):
+    for index, param in enumerate(signature["params"]):
+        value = case[index]
+        if param["kind"] == "array":
+            shorter = [value[:len(value) // 2], value[len(value) // 2:]] if len(value) > 1 else [[]] if value else []
+            shorter += [value[:position] + value[position + 1:] for position in range(len(value))]
+            for array in shorter:
+                yield fix_lengths(signature, case[:index] + [array] + case[index + 1:])
+            for position, item in enumerate(value):
+                for simpler in get_simpler_values(item):
+                    array = value[:position] + [simpler] + value[position + 1:]
+                    yield case[:index] + [array] + case[index + 1:]
+        elif param["kind"] == "scalar":
+            for simpler in get_simpler_values(value):
+                yield case[:index] + [simpler] + case[index + 1:]
+
+
+def fuzz_libraries(src_lib_path, dst_lib_path, signatures, cases, seed, function_timeout=FUNCTION_TIMEOUT):
+    """ Entry point of the fuzzing process """
+    ffi = cffi.FFI()
+    ffi.cdef(get_cdef(signatures))
+    src_lib = ffi.dlopen(os.path.abspath(src_lib_path))
+    dst_lib = ffi.dlopen(os.path.abspath(dst_lib_path))
+    results = []
+    with tempfile.TemporaryDirectory() as build_dir:
+        drivers = load_drivers(ffi, signatures, build_dir)
+        for signature in signatures:
+            if "skipped" in signature:
+                results.append(signature)
+                continue
+            try:
+                runner = Runner(ffi, src_lib, dst_lib, signature, drivers=drivers)
+            except AttributeError as e:
+                results.append({"name": signature["name"], "error": str(e)})
+                continue
+            results.append(FunctionFuzzer(runner, cases, seed, timeout=function_timeout).run())
+    return results
+
+
+def run_fuzz(src_lib_path, dst_lib_path, signatures, cases=DEFAULT_CASES, seed=0, function_timeout=FUNCTION_TIMEOUT):
+    """
+    Fuzz functions of both libraries in a separate process, which forks
+    for every batch, so crashes and hangs of the libraries do not affect
+    the pipeline.
+
+    Args:
+        cases (int): Random cases per function, on top of boundary values
+        seed (int): Inputs are the same for the same seed
+        function_timeout (float): Seconds per function, functions which
+            run out of it report what was found so far
+
+    Returns:
+        list: Per function results
+
+    Raises:
+        Exception: If fuzzing fails or the process hangs
+    """
+    started = time.monotonic()
+    # Deadlines are checked between forks, each of them may run for a batch
+    # timeout and a case timeout for the source and the translation
+    functions = sum(1 for signature in signatures if "skipped" not in signature)
+    timeout = SETUP_TIMEOUT + functions * (function_timeout + 2 * (BATCH_TIMEOUT + CASE_TIMEOUT))
+    results = run_isolated(fuzz_libraries, (src_lib_path, dst_lib_path, signatures, cases, seed, function_timeout),
+                           timeout, "Fuzzing")
+    record("fuzz_seconds", time.monotonic() - started)
+    record("fuzz_cases", sum(result.get("cases", 0) for result in results))
+    record("fuzz_counterexamples", sum(len(result.get("counterexamples", ())) for result in results))
+    return results
+
+
+def get_failures(results):
+    return [result for result in results if result.get("counterexamples")]
+
+
+def format_call(name, args):
+    return f"{name}({', '.join(repr(arg) for arg in args)})"
+
+
+def format_output(output, signature):
+    if not isinstance(output, (list, tuple)):
+        return "crashes" if output == "crash" else "hangs"
+    value, arrays = output
+    parts = []
+    if signature["restype"]:
+        parts.append(f"returns {value!r}")
+    outputs = [param["name"] for param in signature["params"] if param["kind"] == "array" and not param["const"]]
+    parts += [f"leaves {name} = {array!r}" for name, array in zip(outputs, arrays)]
+    return " and ".join(parts)
+
+
+def format_results(results):
+    lines = []
+    for result in results:
+        if "cases" in result:
+            lines.append(
+                f"{result['name']}: {result['cases']} cases, {len(result['counterexamples'])} counterexamples, "
+                f"{result['source_crashes']} source crashes, {result['cases_per_second']} cases/s"
+                + (", stopped by the timeout" if result.get('timed_out') else "")
+            )
+        else:
+            lines.append(f"{result['name']}: {result.get('skipped') or result.get('error')}")
+    return "\n".join(lines)
+
+
+def get_counterexample_message(failures, signatures, source_lang="C"):
+    """
+    Describe minimized counterexamples for the LLM.
+    """
+    by_name = {signature["name"]: signature for signature in signatures}
+    lines = [f"Differential testing against the {source_lang} library found inputs where the translation "
+             f"behaves differently:"]
+    for result in failures:
+        signature = by_name[result["name"]]
+        for counterexample in result["counterexamples"]:
+            call = format_call(result["name"], counterexample["args"])
+            expected = format_output(counterexample["expected"], signature)
+            lines.append(f"- {call}: {source_lang} {expected}, "
+                         f"the translation {format_output(counterexample['actual'], signature)}")
+    return "\n".join(lines)
+
+
+def get_fuzz_query(code, message, source_lang, dest_lang):
+    return f"""
+    The following {dest_lang} code was translated from {source_lang} and compiled as a shared object (.so) file. It passes the functional tests, but it does not always behave like the original {source_lang} code.
+
+    <CODE>
+    {code}
+    </CODE>
+
+    {message}
+
+    Fix the code, so it returns the same results as the {source_lang} code for these and all other inputs, including integer overflow and floating point edge cases. Keep the interface unchanged. Important requirements for the {dest_lang} code:
+    {IMPORTANT_REQUIREMENTS[dest_lang]}
+    Return the complete {dest_lang} file. DO NOT INCLUDE ANY EXPLANATIONS in your response.
+    """
+
+
+class FuzzStage(RepairStage):
+    """
+    Differential fuzzing of the translated library against the source one.
+
+    Every exported function taking scalars and arrays with their length is
+    called with boundary values and random inputs in both libraries and
+    the results are compared. Results are written next to dst_file as
+    .fuzz.json. Minimized counterexamples are given to an Iteration which
+    asks the LLM to fix the code, validated by the tests and fuzzing with
+    the same seed. Running out of the budget fails the stage, the
+    translation is known to be wrong. Every function is fuzzed for at most
+    FUNCTION_TIMEOUT seconds, results of slower ones are partial.
+
+    Batches of cases go through compiled C loops, one cffi call per batch,
+    so generating the inputs in Python is the limit: about 200k cases/s
+    for scalar functions and 35k cases/s for functions taking arrays.
+    Without a C compiler every case is a cffi call, about 20k cases/s for
+    functions taking arrays, size cases accordingly.
+    """
+
+    name = "fuzz"
+    title = "Fuzzing"
+    report_extension = ".fuzz.json"
+    max_rounds = FUZZ_MAX_ROUNDS
+
+    def __init__(self, meta_file, src_lib, dst_file, test_file, source_lang="C", dest_lang="Rust",
+                 cases=DEFAULT_CASES, seed=0, policy=None):
+        super().__init__(meta_file, src_lib, dst_file, test_file, source_lang=source_lang, dest_lang=dest_lang,
+                         policy=policy)
+        self.cases = cases
+        self.seed = seed
+
+    def get_signatures(self, ast):
+        return get_fuzz_signatures(ast)
+
+    def measure(self, dst_lib, signatures):
+        return run_fuzz(self.src_lib, dst_lib, signatures, cases=self.cases, seed=self.seed)
+
+    def on_measure_error(self, error, signatures):
+        # Nothing is known about the translation, the report says why
+        logger.warning(f"Fuzzing of {self.dst_file} failed: {error}")
+        return [
+            signature if "skipped" in signature else {"name": signature["name"], "error": str(error)}
+            for signature in signatures
+        ]
+
+    def get_failures(self, results):
+        return get_failures(results)
+
+    def format_results(self, results):
+        return format_results(results)
+
+    def get_failure_message(self, failures, signatures):
+        return get_counterexample_message(failures, signatures, self.source_lang)
+
+    def get_query(self, code, failures, signatures):
+        return get_fuzz_query(code, self.get_failure_message(failures, signatures), self.source_lang, self.dest_lang)
+
+
+def get_fuzz_stage(meta_file, src_lib, dst_file, test_file, source_lang="C", dest_lang="Rust",
+                   cases=DEFAULT_CASES, seed=0, policy=None):
+    return FuzzStage(
+        meta_file=meta_file,
+        src_lib=src_lib,
+        dst_file=dst_file,
+        test_file=test_file,
+        source_lang=source_lang,
+        dest_lang=dest_lang,
+        cases=cases,
+        seed=seed,
+        policy=policy
+    )
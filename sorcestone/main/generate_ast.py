@@ -1,10 +1,143 @@
 import os
+import time
+import atexit
+import tempfile
+import threading
 import subprocess
+from concurrent.futures import TimeoutError
 
 from sorcestone.utils.logger import logger
+from sorcestone.utils.metrics import timer
+from sorcestone.utils.process_utils import JsonLinesClient
 
 
-def generate_ast(file_path, language, output_file=None, cpp_args="", skip=False):
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Seconds the parser server may spend on a job, it answers with an error then
+PARSE_TIMEOUT = float(os.environ.get('SORCESTONE_PARSE_TIMEOUT') or 300)
+# Extra seconds to wait for that answer before the server is considered stuck
+# and the file is parsed with parse.sh instead. The server job is stopped by
+# then, so the two never write the same AST file at once.
+PARSE_GRACE = 30
+
+
+def get_parse_script(language, name='parse.sh'):
+    return os.path.join(PROJECT_ROOT, f'../language_tools/{language}/{name}')
+
+
+class ParserPool(JsonLinesClient):
+    """
+    Client of a long living parser server started from parse_server.sh.
+    """
+
+    name = "Parser server"
+
+    def __init__(self, server_script, workers=None):
+        command = ['/bin/bash', server_script]
+        if workers:
+            command += ['--workers', str(workers)]
+        super().__init__(command)
+
+    def make_result(self, response):
+        return subprocess.CompletedProcess(
+            args=response['id'],
+            returncode=response['returncode'],
+            stdout=response['stdout'],
+            stderr=response['stderr']
+        )
+
+    def submit(self, file_path, output_file, cpp_args="", ast_format="json", index_db=None):
+        """
+        Send parse job to the server, it is stopped after PARSE_TIMEOUT.
+
+        Returns:
+            concurrent.futures.Future: resolves to subprocess.CompletedProcess
+        """
+        return self.send({
+            'src_file_path': os.path.abspath(file_path),
+            'ast_file_path': os.path.abspath(output_file),
+            'cpp_args': cpp_args or "",
+            'format': ast_format,
+            'index_db': os.path.abspath(index_db) if index_db else None,
+            'timeout': PARSE_TIMEOUT
+        })
+
+
+_parser_pools = {}
+_parser_pools_lock = threading.Lock()
+
+
+def get_parser_pool(language):
+    """
+    Get running parser pool for the language.
+
+    Returns:
+        ParserPool: pool instance, or None if language has no parse_server.sh
+    """
+    server_script = get_parse_script(language, 'parse_server.sh')
+    if not os.path.exists(server_script):
+        return None
+
+    with _parser_pools_lock:
+        pool = _parser_pools.get(language)
+        if pool is None or not pool.is_alive():
+            workers = os.environ.get('SORCESTONE_PARSER_WORKERS')
+            pool = _parser_pools[language] = ParserPool(server_script, workers=workers)
+    return pool
+
+
+@atexit.register
+def close_parser_pools():
+    with _parser_pools_lock:
+        for pool in _parser_pools.values():
+            pool.close()
+        _parser_pools.clear()
+
+
+def run_parse_script(parse_script, file_path, output_file, cpp_args="", ast_format="json", index_db=None):
+    """
+    Parse file in a new process with parse.sh.
+
+    Returns:
+        subprocess.CompletedProcess: Parse result
+    """
+    return subprocess.run(
+        ['/bin/bash', parse_script, file_path, output_file, cpp_args, ast_format,
+         os.path.abspath(index_db) if index_db else ""],
+        capture_output=True,
+        text=True,
+        check=False
+    )
+
+
+def wait_for_pool(pool, future, parse_script, file_path, output_file, cpp_args="", ast_format="json",
+                  index_db=None, deadline=None):
+    """
+    Wait for the parser server to parse the file, parse it with parse.sh
+    if the server does not answer at all.
+
+    Args:
+        pool (ParserPool): Pool the job was submitted to
+        future (concurrent.futures.Future): Submitted job
+        deadline (float, optional): time.monotonic() to wait until, defaults
+            to PARSE_TIMEOUT + PARSE_GRACE from now
+
+    Returns:
+        subprocess.CompletedProcess: Parse result, a job stopped by the
+            server's timeout is a failed result
+    """
+    if deadline is None:
+        deadline = time.monotonic() + PARSE_TIMEOUT + PARSE_GRACE
+    try:
+        return future.result(timeout=max(deadline - time.monotonic(), 0))
+    except TimeoutError:
+        pool.forget(future)
+        logger.warning(f"Parser server did not answer for {file_path}, running parse.sh")
+        return run_parse_script(parse_script, file_path, output_file, cpp_args, ast_format, index_db)
+
+
+def generate_ast(file_path, language, output_file=None, cpp_args="", skip=False, use_pool=True,
+                 ast_format="json", index_db=None):
     """
     Generate AST using the parse.sh script from language specific folder.
 
@@ -15,10 +148,15 @@ def generate_ast(file_path, language, output_file=None, cpp_args="", skip=False)
             will use source_file_path + '.ast'
         cpp_args (str, optional): Additional arguments to pass to the parser. Defaults to "".
         skip (bool, optional): Skip AST generation if True. Defaults to False.
+        use_pool (bool, optional): Send the job to the long living parser
+            server if language provides parse_server.sh. Defaults to True.
+        ast_format (str, optional): "json" or compact binary "pack". Defaults to "json".
+        index_db (str, optional): Project symbol index to add declarations of
+            the file to. Defaults to None.
 
     Returns:
         subprocess.CompletedProcess: Parse result
-    
+
     Raises:
         FileNotFoundError: If parse.sh is not found for the language
         Exception: If parsing fails
@@ -27,9 +165,8 @@ def generate_ast(file_path, language, output_file=None, cpp_args="", skip=False)
         return None
 
     # Get language-specific parse.sh path
-    PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
-    parse_script = os.path.join(PROJECT_ROOT, f'../language_tools/{language}/parse.sh')
-    
+    parse_script = get_parse_script(language)
+
     if not os.path.exists(parse_script):
         raise FileNotFoundError(f"Parse script not found for language {language}")
 
@@ -37,13 +174,14 @@ def generate_ast(file_path, language, output_file=None, cpp_args="", skip=False)
     if output_file is None:
         output_file = f"{os.path.splitext(file_path)[0]}.ast"
 
-    # Run parsing
-    result = subprocess.run(
-        ['/bin/bash', parse_script, file_path, output_file, cpp_args],
-        capture_output=True,
-        text=True,
-        check=False
-    )
+    pool = get_parser_pool(language) if use_pool else None
+    with timer("parse_seconds", language=language):
+        if pool:
+            result = wait_for_pool(pool, pool.submit(file_path, output_file, cpp_args, ast_format, index_db),
+                                   parse_script, file_path, output_file, cpp_args, ast_format, index_db)
+        else:
+            # Run parsing
+            result = run_parse_script(parse_script, file_path, output_file, cpp_args, ast_format, index_db)
 
     logger.info(f"{language} parse output: {result.stdout}")
     if result.stderr:
@@ -52,4 +190,41 @@ def generate_ast(file_path, language, output_file=None, cpp_args="", skip=False)
     if result.returncode != 0:
         raise Exception(f"{language} code parsing failed")
 
-    return result
\ No newline at end of file
+    return result
+
+
+def index_sources(file_paths, language, index_db, cpp_args=""):
+    """
+    Add declarations of all files to the project symbol index before they
+    are translated, so every file sees definitions of the others. ASTs are
+    thrown away, the AST cache makes parsing them again later cheap.
+
+    Returns:
+        list: files which failed to parse, their jobs fail on their own later
+    """
+    pool = get_parser_pool(language)
+    parse_script = get_parse_script(language)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        outputs = [os.path.join(tmp_dir, f"{number}.ast") for number in range(len(file_paths))]
+        if pool:
+            futures = [pool.submit(file_path, output, cpp_args, index_db=index_db)
+                       for file_path, output in zip(file_paths, outputs)]
+            # Jobs run concurrently, so they share one deadline
+            deadline = time.monotonic() + PARSE_TIMEOUT + PARSE_GRACE
+            results = [
+                wait_for_pool(pool, future, parse_script, file_path, output, cpp_args, index_db=index_db,
+                              deadline=deadline)
+                for future, file_path, output in zip(futures, file_paths, outputs)
+            ]
+        else:
+            results = [
+                run_parse_script(parse_script, file_path, output, cpp_args, index_db=index_db)
+                for file_path, output in zip(file_paths, outputs)
+            ]
+
+    failed = [file_path for file_path, result in zip(file_paths, results) if result.returncode != 0]
+    for file_path, result in zip(file_paths, results):
+        if result.returncode != 0:
+            logger.error(f"Indexing {file_path} failed: {result.stderr}")
+    logger.info(f"Indexed symbols of {len(file_paths) - len(failed)} of {len(file_paths)} files into {index_db}")
+    return failed
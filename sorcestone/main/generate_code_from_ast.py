@@ -1,45 +1,164 @@
 import os
-import subprocess
+import asyncio
 from functools import partial
-import json
 
-from sorcestone.utils.code_utils import extract_code
+from sorcestone.utils.code_utils import extract_code, get_rust_items
+from sorcestone.utils.file_utils import write_atomic
+from sorcestone.utils.ast_pack import load_ast
+from sorcestone.utils.ast_render import render_ast, AST_VIEW_DESCRIPTIONS
+from sorcestone.utils.ast_utils import (
+    split_units, get_call_graph, get_dependency_levels, get_called_functions, get_coord_file
+)
+from sorcestone.utils.symbol_index import SymbolIndex, format_symbols
 from sorcestone.main.iteration import Iteration
 from sorcestone.utils.logger import logger
-from sorcestone.main.compile import compile_code
+from sorcestone.main.compile import CompilationError, compile_code, acompile_code
+from sorcestone.main.generate_tests import run_tests, arun_tests
 
 PROJECT_ROOT = os.path.dirname(__file__)
 
 
-def test_validation_callback(response, file_path="", test_file="", dest_lang=""):
-    response = extract_code(response, dest_lang.lower())
+def prepare_code(response, dest_lang):
+    code = extract_code(response, dest_lang.lower())
 
     # Before we Compile we may need to fix LLM errors - Thigns which LLM do not know yet
     # Replace #[no_mangle] with #[unsafe(no_mangle)]
-    response = response.replace('#[no_mangle]', '#[unsafe(no_mangle)]')
-    
-    with open(file_path, 'w+') as f:
-        f.write(response)
+    return code.replace('#[no_mangle]', '#[unsafe(no_mangle)]')
+
+
+def stitch_code(parts):
+    """
+    Join code fragments into a single file.
+
+    Imports and crate level attributes are moved to the top and deduplicated,
+    since every fragment may declare the ones it needs. Items repeated by a
+    later fragment, e.g. a shared type it redefined, keep their first
+    definition. Impl blocks are only dropped when repeated verbatim, a type
+    may have several of them.
+
+    Args:
+        parts ([str]): Code fragments in the output order
+
+    Returns:
+        str: Stitched code
+    """
+    header = []
+    bodies = []
+    seen = set()
+    for part in parts:
+        body = []
+        for line in part.splitlines():
+            if line.startswith(('use ', '#![')):
+                if line not in header:
+                    header.append(line)
+            else:
+                body.append(line)
+        body = "\n".join(body)
+        kept = []
+        position = 0
+        for item in get_rust_items(body):
+            text = body[item["start"]:item["end"]]
+            key = text.strip() if item["key"].startswith("impl") else item["key"]
+            if key in seen:
+                kept.append(body[position:item["start"]])
+                position = item["end"]
+            seen.add(key)
+        body = ("".join(kept) + body[position:]).strip()
+        if body:
+            bodies.append(body)
+    # Crate level attributes must precede any item
+    header.sort(key=lambda line: not line.startswith('#!['))
+    return "\n\n".join(["\n".join(header)] + bodies if header else bodies) + "\n"
+
+
+def compile_validation_callback(response, file_path="", dest_lang="", context=()):
+    """
+    Check that code fragment compiles together with already translated code.
+    Only the type check runs, the stitched file is built by verify().
+
+    Returns:
+        tuple: (0, fragment code) on success, (1, error) otherwise
+    """
+    code = prepare_code(response, dest_lang)
+
+    write_atomic(file_path, stitch_code(list(context) + [code]))
+
+    try:
+        compile_code(file_path, dest_lang, output_file=f"{file_path}.so", check_only=True)
+    except CompilationError as e:
+        return 1, e.get_message()
+    except Exception as e:
+        return 1, str(e)
+
+    return 0, code
+
+
+async def acompile_validation_callback(response, file_path="", dest_lang="", context=()):
+    code = prepare_code(response, dest_lang)
+
+    write_atomic(file_path, stitch_code(list(context) + [code]))
+
+    try:
+        await acompile_code(file_path, dest_lang, output_file=f"{file_path}.so", check_only=True)
+    except CompilationError as e:
+        return 1, e.get_message()
+    except Exception as e:
+        return 1, str(e)
+
+    return 0, code
+
+
+def test_validation_callback(response, file_path="", test_file="", dest_lang="", tests_ready=None):
+    """
+    Check that the code compiles and passes the tests.
+
+    Args:
+        tests_ready (concurrent.futures.Future): Resolves once test_file is
+            written, when the code is generated speculatively while tests
+            are still being generated. Compilation does not wait for it.
+
+    Returns:
+        tuple: (0, file_path) on success, (return code, error) otherwise
+    """
+    response = prepare_code(response, dest_lang)
+
+    write_atomic(file_path, response)
 
     try:
         output_file = f"{file_path}.so"
-        compile_code(file_path, dest_lang, output_file=output_file)
+        compile_code(file_path, dest_lang, output_file=output_file, check=True)
+    except CompilationError as e:
+        return 1, e.get_message()
     except Exception as e:
         return 1, str(e)
 
-    result = subprocess.run(
-        [
-            '/bin/bash', '-c',
-            f"""
-            time python {test_file} {output_file} {dest_lang}
-            """
-        ],
-        capture_output=True,
-        text=True,
-        check=False
-    )
+    if tests_ready is not None:
+        tests_ready.result()
+    result = run_tests(test_file, output_file, dest_lang)
     if result.returncode:
-        return result.returncode, result.stderr
+        return result.returncode, result.get_message()
+
+    return 0, file_path
+
+
+async def atest_validation_callback(response, file_path="", test_file="", dest_lang="", tests_ready=None):
+    response = prepare_code(response, dest_lang)
+
+    write_atomic(file_path, response)
+
+    try:
+        output_file = f"{file_path}.so"
+        await acompile_code(file_path, dest_lang, output_file=output_file, check=True)
+    except CompilationError as e:
+        return 1, e.get_message()
+    except Exception as e:
+        return 1, str(e)
+
+    if tests_ready is not None:
+        await asyncio.wrap_future(tests_ready)
+    result = await arun_tests(test_file, output_file, dest_lang)
+    if result.returncode:
+        return result.returncode, result.get_message()
 
     return 0, file_path
 
@@ -62,17 +181,17 @@ IMPORTANT_REQUIREMENTS = {
 }
 
 
-def get_translation_gen_stage(meta_file, dst_file, test_file, source_lang="C", dest_lang="Rust"):
-    with open(meta_file, 'r') as f:
-        ast = f.read()
+def get_translation_gen_stage(meta_file, dst_file, test_file, source_lang="C", dest_lang="Rust", ast_view="auto",
+                              policy=None, tests_ready=None):
+    view, ast = render_ast(load_ast(meta_file), view=ast_view)
 
     initial_query = f"""
     You are tasked with generating {dest_lang} code from a {source_lang} Abstract Syntax Tree (AST). The generated {dest_lang} code will be compiled as a shared object (.so) file, which requires specific considerations. Follow these instructions carefully:
 
-    1. You will be provided with an AST representing {source_lang} code. The AST will be enclosed in XML tags like this:
+    1. You will be provided with an AST representing {source_lang} code, written as {AST_VIEW_DESCRIPTIONS[view]}. The AST will be enclosed in XML tags like this:
 
     <AST>
-    {json.dumps(json.loads(ast))} 
+    {ast}
     </AST>
 
     2. Your goal is to generate equivalent {dest_lang} code based on this AST. Pay close attention to the structure and semantics of the {source_lang} code represented by the AST.
@@ -107,8 +226,225 @@ def get_translation_gen_stage(meta_file, dst_file, test_file, source_lang="C", d
             test_validation_callback,
             file_path=dst_file,
             test_file=test_file,
-            dest_lang=dest_lang
-        )
+            dest_lang=dest_lang,
+            tests_ready=tests_ready
+        ),
+        async_validation_callback=partial(
+            atest_validation_callback,
+            file_path=dst_file,
+            test_file=test_file,
+            dest_lang=dest_lang,
+            tests_ready=tests_ready
+        ),
+        name=os.path.basename(dst_file),
+        policy=policy
     )
 
     return stage
+
+
+def get_prelude_query(prelude_ast, source_lang, dest_lang, view="json"):
+    return f"""
+    You are tasked with generating {dest_lang} code from a {source_lang} Abstract Syntax Tree (AST) of shared declarations: types, constants, global variables and function prototypes. The AST is written as {AST_VIEW_DESCRIPTIONS[view]}.
+
+    <AST>
+    {prelude_ast}
+    </AST>
+
+    1. Translate every type, constant and global variable into {dest_lang}. They will be shared by functions translated separately, so keep the memory layout compatible with {source_lang} (e.g. #[repr(C)]).
+    2. Do not translate function prototypes, they are only provided for context.
+    3. Important requirements for the {dest_lang} code:
+    {IMPORTANT_REQUIREMENTS[dest_lang]}
+    4. Return {dest_lang} code only, DO NOT INCLUDE ANY EXPLANATIONS in your response.
+    """
+
+
+def get_unit_query(unit_ast, context_code, source_lang, dest_lang, view="json", external_decls=""):
+    external = f"""
+    {source_lang} functions defined in other files of the project which these functions call. They are translated separately, call them but DO NOT translate them:
+
+    <DECLARATIONS>
+    {external_decls}
+    </DECLARATIONS>
+""" if external_decls else ""
+    return f"""
+    You are tasked with generating {dest_lang} code for {source_lang} functions from their Abstract Syntax Tree (AST). The generated code is a part of a bigger {dest_lang} file which will be compiled as a shared object (.so) file.
+    The AST is written as {AST_VIEW_DESCRIPTIONS[view]}.
+
+    1. {source_lang} functions to translate:
+
+    <AST>
+    {unit_ast}
+    </AST>
+
+    2. {dest_lang} code which is already present in the file. Use it, but DO NOT repeat any of it in your response:
+
+    <CODE>
+    {context_code}
+    </CODE>
+{external}
+    3. Important requirements for the {dest_lang} code:
+    {IMPORTANT_REQUIREMENTS[dest_lang]}
+    4. Return only {dest_lang} code for the requested functions plus any imports they need. DO NOT INCLUDE ANY EXPLANATIONS in your response.
+    5. Maintain the same interface and behavior as the original {source_lang} code.
+    """
+
+
+def get_repair_query(code, error, source_lang, dest_lang):
+    return f"""
+    The following {dest_lang} code was translated from {source_lang} function by function and compiled as a shared object (.so) file, but it fails the functional tests.
+
+    <CODE>
+    {code}
+    </CODE>
+
+    Tests output:
+    {error}
+
+    Fix the code so the tests pass. Important requirements for the {dest_lang} code:
+    {IMPORTANT_REQUIREMENTS[dest_lang]}
+    Return the complete {dest_lang} file. DO NOT INCLUDE ANY EXPLANATIONS in your response.
+    """
+
+
+class ChunkedTranslation(object):
+    """
+    Translate AST function by function.
+
+    Shared declarations are translated first, then functions go level by
+    level of the call graph, so callees are translated before callers.
+    Independent functions of the same level are translated concurrently on
+    one event loop, each by its own Iteration validated by compilation.
+    Results are stitched into dst_file and verified by the tests.
+    """
+
+    def __init__(self, meta_file, dst_file, test_file, source_lang="C", dest_lang="Rust", max_workers=4,
+                 ast_view="auto", policy=None, tests_ready=None, symbol_index=None):
+        self.meta_file = meta_file
+        self.dst_file = dst_file
+        self.test_file = test_file
+        self.tests_ready = tests_ready
+        self.source_lang = source_lang
+        self.dest_lang = dest_lang
+        self.max_workers = max_workers
+        self.ast_view = ast_view
+        self.policy = policy
+        self.symbol_index = symbol_index
+        self.chunks_dir = f"{dst_file}.chunks"
+        self.extension = os.path.splitext(dst_file)[1]
+
+    def _chunk_path(self, name):
+        return os.path.join(self.chunks_dir, f"{name}{self.extension}")
+
+    def _compile_stage(self, query, name, context=()):
+        callback_args = dict(file_path=self._chunk_path(name), dest_lang=self.dest_lang, context=context)
+        return Iteration(
+            initial_query=query,
+            validation_callback=partial(compile_validation_callback, **callback_args),
+            async_validation_callback=partial(acompile_validation_callback, **callback_args),
+            name=f"{os.path.basename(self.dst_file)}:{name}",
+            policy=self.policy
+        )
+
+    async def translate_prelude(self, prelude, llm_client):
+        if not prelude:
+            return ""
+        view, prelude_ast = render_ast(prelude, view=self.ast_view)
+        stage = self._compile_stage(
+            get_prelude_query(prelude_ast, self.source_lang, self.dest_lang, view=view),
+            "prelude"
+        )
+        return await stage.arun(llm_client=llm_client)
+
+    def get_external_decls(self, unit, functions):
+        """
+        Declarations of functions the unit calls which are defined in other
+        files of the project, empty without a symbol index.
+        """
+        if not self.symbol_index:
+            return ""
+        called = set().union(*(get_called_functions(functions[function]) for function in unit)) - set(functions)
+        if not called:
+            return ""
+        with SymbolIndex(self.symbol_index) as index:
+            return format_symbols(index.get_external_functions(called, get_coord_file(functions[unit[0]])))
+
+    async def translate_unit(self, unit, functions, context, llm_client, limit):
+        view, unit_ast = render_ast([functions[function] for function in unit], view=self.ast_view)
+        stage = self._compile_stage(
+            get_unit_query(
+                unit_ast,
+                stitch_code(context),
+                self.source_lang,
+                self.dest_lang,
+                view=view,
+                external_decls=self.get_external_decls(unit, functions)
+            ),
+            "+".join(unit),
+            context=context
+        )
+        async with limit:
+            return await stage.arun(llm_client=llm_client)
+
+    def run(self, llm_client):
+        return asyncio.run(self.arun(llm_client))
+
+    async def arun(self, llm_client):
+        prelude, functions = split_units(load_ast(self.meta_file))
+        os.makedirs(self.chunks_dir, exist_ok=True)
+
+        prelude_code = await self.translate_prelude(prelude, llm_client)
+        order = list(functions)
+        translated = {}
+        limit = asyncio.Semaphore(self.max_workers)
+        for level in get_dependency_levels(get_call_graph(functions)):
+            logger.info(f"Translating functions: {', '.join('+'.join(unit) for unit in level)}")
+            context = [prelude_code] + [translated[name] for name in order if name in translated]
+            results = await asyncio.gather(*[
+                self.translate_unit(unit, functions, context, llm_client, limit)
+                for unit in level
+            ])
+            for unit, code in zip(level, results):
+                # Unit code is stored under its first function to keep source order
+                translated[min(unit, key=order.index)] = code
+
+        code = stitch_code([prelude_code] + [translated[name] for name in order if name in translated])
+        return await self.verify(code, llm_client)
+
+    async def verify(self, code, llm_client):
+        """
+        Write code into dst_file and test it, repair the whole file if the
+        tests fail.
+        """
+        callback_args = dict(file_path=self.dst_file, test_file=self.test_file, dest_lang=self.dest_lang,
+                             tests_ready=self.tests_ready)
+        return_code, return_message = await atest_validation_callback(code, **callback_args)
+        if not return_code:
+            return return_message
+
+        logger.info("Stitched code failed validation, repairing the whole file")
+        stage = Iteration(
+            initial_query=get_repair_query(code, return_message, self.source_lang, self.dest_lang),
+            validation_callback=partial(test_validation_callback, **callback_args),
+            async_validation_callback=partial(atest_validation_callback, **callback_args),
+            name=f"{os.path.basename(self.dst_file)}:repair",
+            policy=self.policy
+        )
+        return await stage.arun(llm_client=llm_client)
+
+
+def get_chunked_translation_gen_stage(meta_file, dst_file, test_file, source_lang="C", dest_lang="Rust",
+                                      max_workers=4, ast_view="auto", policy=None, tests_ready=None,
+                                      symbol_index=None):
+    return ChunkedTranslation(
+        meta_file=meta_file,
+        dst_file=dst_file,
+        test_file=test_file,
+        source_lang=source_lang,
+        dest_lang=dest_lang,
+        max_workers=max_workers,
+        ast_view=ast_view,
+        policy=policy,
+        tests_ready=tests_ready,
+        symbol_index=symbol_index
+    )
@@ -1,39 +1,102 @@
+import os
+import asyncio
 import subprocess
 from functools import partial
 from sorcestone.utils.code_utils import extract_code
+from sorcestone.utils.file_utils import write_atomic
+from sorcestone.utils.ast_pack import load_ast
+from sorcestone.utils.ast_render import render_ast, AST_VIEW_DESCRIPTIONS
+from sorcestone.utils.process_utils import run_process
+from sorcestone.utils.harness import TestResult, get_test_runner
 
 from sorcestone.main.iteration import Iteration, FakeIteration
 from sorcestone.utils.logger import logger
+from sorcestone.utils.metrics import timer
 
 
 def get_test_file_name(file_path, dst_language):
-    return "_".join([file_path.split(".")[0], dst_language, "test.py"])
+    # Only the file name is split, folders may contain dots
+    base_name = os.path.basename(file_path).split(".")[0]
+    return os.path.join(os.path.dirname(file_path), "_".join([base_name, dst_language, "test.py"]))
 
 
-def test_validation_callback(response, file_path="", src_language="C", dst_language="Rust"):
+def get_test_command(test_file, lib_path, language):
+    return [
+        '/bin/bash', '-c',
+        f"""
+        time python {test_file} {lib_path} {language}
+        """
+    ]
+
+
+def run_tests(test_file, lib_path, language):
+    """
+    Run generated test file against the library.
+
+    Runs are forked from the long living test server, which reports every
+    test separately. Falls back to a fresh interpreter if the server can not
+    be used.
+
+    Returns:
+        TestResult: Test run result
+    """
+    with timer("test_seconds", language=language):
+        try:
+            return get_test_runner().submit(test_file, [lib_path, language]).result()
+        except Exception as e:
+            logger.error(f"Test server failed, running tests in a new process: {e}")
+
+        result = subprocess.run(
+            get_test_command(test_file, lib_path, language),
+            capture_output=True,
+            text=True,
+            check=False
+        )
+        return TestResult(result.returncode, result.stdout, result.stderr)
+
+
+async def arun_tests(test_file, lib_path, language):
+    """
+    Same as run_tests, but does not block the event loop.
+    """
+    with timer("test_seconds", language=language):
+        try:
+            return await asyncio.wrap_future(get_test_runner().submit(test_file, [lib_path, language]))
+        except Exception as e:
+            logger.error(f"Test server failed, running tests in a new process: {e}")
+
+        result = await run_process(get_test_command(test_file, lib_path, language))
+        return TestResult(result.returncode, result.stdout, result.stderr)
+
+
+def write_test_file(response, file_path, src_language, dst_language):
     test_file = get_test_file_name(file_path, dst_language)
     response = extract_code(response, 'python')
 
-    with open(test_file, 'w+') as f:
-        f.write(response)
+    write_atomic(test_file, response)
     logger.info(f"Checking that {src_language} code passes tests and is compatible with {dst_language} interface")
-    
-    result = subprocess.run(
-        [
-            '/bin/bash', '-c',
-            f"""
-            time python {test_file} {file_path} {src_language}
-            """
-        ],
-        capture_output=True, 
-        text=True,
-        check=False
-    )
+    return test_file
+
+
+def test_validation_callback(response, file_path="", src_language="C", dst_language="Rust"):
+    test_file = write_test_file(response, file_path, src_language, dst_language)
+
+    result = run_tests(test_file, file_path, src_language)
     if result.returncode:
-        return result.returncode, result.stderr
+        return result.returncode, result.get_message()
     
     return 0, test_file
 
+
+async def atest_validation_callback(response, file_path="", src_language="C", dst_language="Rust"):
+    test_file = write_test_file(response, file_path, src_language, dst_language)
+
+    result = await arun_tests(test_file, file_path, src_language)
+    if result.returncode:
+        return result.returncode, result.get_message()
+
+    return 0, test_file
+
 IMPORTANT_REQUIREMENTS = {
     "C": """
         - For string handling in C-compatible languages:
@@ -50,18 +113,19 @@ IMPORTANT_REQUIREMENTS = {
      """
 }
 
-def get_test_gen_stage(meta_file, code_file, src_language="C", dst_language="Rust", skip=False):
+def get_test_gen_stage(meta_file, code_file, src_language="C", dst_language="Rust", skip=False, ast_view="auto",
+                       policy=None):
     
     if skip:
         return FakeIteration(fake_response=get_test_file_name(code_file, dst_language))
     
-    with open(meta_file, 'r') as f:
-        ast = f.read()
+    view, ast = render_ast(load_ast(meta_file), view=ast_view)
 
     initial_query = f"""
 Task: Generate Test script which will test every function described by the provided AST. Verify function signatures and output types.
 Notes:
     - AST describes {src_language} code that will be translated to {dst_language}
+    - AST is written as {AST_VIEW_DESCRIPTIONS[view]}
     - Functional test should be done in Python
     - To make me able to run script from the console add mandatory arguments parsing for:
       - lib_path: base name for the .so file
@@ -84,7 +148,15 @@ Knowledge base:
             file_path=code_file,
             src_language=src_language,
             dst_language=dst_language
-        )
+        ),
+        async_validation_callback=partial(
+            atest_validation_callback,
+            file_path=code_file,
+            src_language=src_language,
+            dst_language=dst_language
+        ),
+        name=os.path.basename(get_test_file_name(code_file, dst_language)),
+        policy=policy
     )
 
     return stage 
@@ -0,0 +1,190 @@
+import os
+import re
+import json
+import asyncio
+
+from sorcestone.utils.logger import logger
+from sorcestone.utils.cache import hash_key
+from sorcestone.utils.ast_pack import load_ast
+from sorcestone.utils.ast_render import compact, render_ast
+from sorcestone.utils.ast_utils import (
+    get_call_graph, get_decl_name, get_dependency_levels, get_dependents, split_units
+)
+from sorcestone.utils.code_utils import get_rust_items, splice_items
+from sorcestone.utils.file_utils import write_atomic
+from sorcestone.main.generate_code_from_ast import ChunkedTranslation, get_prelude_query
+
+
+def get_decls_file(dst_file):
+    """ Hashes of the declarations dst_file was translated from """
+    return f"{dst_file}.decls.json"
+
+
+def is_prototype(ext):
+    return ext['_nodetype'] == 'Decl' and (ext.get('type') or {}).get('_nodetype') == 'FuncDecl'
+
+
+def get_decls(ast):
+    """
+    Get translated top level declarations. Prototypes are skipped, they
+    are not translated. Anonymous declarations are named by their hash.
+
+    Returns:
+        dict: name to node
+    """
+    decls = {}
+    for ext in ast.get('ext') or []:
+        if is_prototype(ext):
+            continue
+        name = get_decl_name(ext)
+        if name is None:
+            name = f"#{hash_key(json.dumps(compact(ext), sort_keys=True))}"
+        decls[name] = ext
+    return decls
+
+
+def get_decl_hashes(ast):
+    """
+    Returns:
+        dict: declaration name to hash of its node without coords
+    """
+    return {
+        name: hash_key(json.dumps(compact(node), sort_keys=True))
+        for name, node in get_decls(ast).items()
+    }
+
+
+def save_decl_hashes(meta_file, dst_file):
+    write_atomic(get_decls_file(dst_file), json.dumps(get_decl_hashes(load_ast(meta_file)), indent=4))
+
+
+def load_decl_hashes(dst_file):
+    """
+    Returns:
+        dict: hashes saved by the last translation, None if there are none
+    """
+    path = get_decls_file(dst_file)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except ValueError:
+        logger.warning(f"Ignoring broken declaration hashes {path}")
+        return None
+
+
+def get_changes(old_hashes, new_hashes):
+    """
+    Returns:
+        tuple: (changed or added names, removed names)
+    """
+    changed = {name for name, digest in new_hashes.items() if old_hashes.get(name) != digest}
+    removed = set(old_hashes) - set(new_hashes)
+    return changed, removed
+
+
+def normalize_name(name):
+    """ Compare C and Rust names regardless of their conventions, e.g. point_t and Point """
+    return re.sub(r'_t$', '', name.split(" ")[-1]).replace("_", "").lower()
+
+
+def get_translated_items(decl_names, code):
+    """
+    Get items of the previous translation which came from the declarations,
+    e.g. 'struct point' -> Point and impl Point.
+
+    Returns:
+        set: keys of the items in code
+    """
+    names = {normalize_name(name) for name in decl_names}
+    return {item["key"] for item in get_rust_items(code) if normalize_name(item["key"]) in names}
+
+
+class IncrementalTranslation(ChunkedTranslation):
+    """
+    Retranslate only declarations which changed since the last translation.
+
+    Changed functions and types, and the declarations depending on them,
+    are translated like in ChunkedTranslation, with the rest of the
+    existing dst_file as context. The results replace the old items of
+    dst_file in place, then the whole file is tested.
+    """
+
+    def __init__(self, *args, previous_hashes=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.previous_hashes = previous_hashes or {}
+
+    async def arun(self, llm_client):
+        ast = load_ast(self.meta_file)
+        prelude, functions = split_units(ast)
+        decls = get_decls(ast)
+        changed, removed = get_changes(self.previous_hashes, get_decl_hashes(ast))
+        affected = changed | get_dependents(decls, changed | removed)
+        logger.info(
+            f"Incremental translation: {len(changed)} changed, {len(removed)} removed, "
+            f"{len(affected - changed)} dependent declarations of {len(decls)}"
+        )
+
+        changed_prelude = [node for node in prelude if not is_prototype(node) and get_decl_name(node) in affected]
+        if any(name.startswith("#") for name in changed | removed):
+            # Anonymous declarations can not be matched, translate the whole prelude
+            changed_prelude = [node for node in prelude if not is_prototype(node)]
+            affected |= {get_decl_name(node) for node in changed_prelude if get_decl_name(node)}
+
+        with open(self.dst_file) as f:
+            old_code = f.read()
+        dropped = get_translated_items(affected | removed, old_code)
+        # Code which stays as is, context for the new translations
+        base = splice_items(old_code, [], removed=dropped)
+        os.makedirs(self.chunks_dir, exist_ok=True)
+
+        fragments = []
+        if changed_prelude:
+            view, prelude_ast = render_ast(changed_prelude, view=self.ast_view)
+            stage = self._compile_stage(
+                get_prelude_query(prelude_ast, self.source_lang, self.dest_lang, view=view),
+                "prelude",
+                context=[base]
+            )
+            fragments.append(await stage.arun(llm_client=llm_client))
+
+        affected_functions = {name: node for name, node in functions.items() if name in affected}
+        limit = asyncio.Semaphore(self.max_workers)
+        for level in get_dependency_levels(get_call_graph(affected_functions)):
+            logger.info(f"Translating functions: {', '.join('+'.join(unit) for unit in level)}")
+            context = [base] + fragments
+            fragments.extend(await asyncio.gather(*[
+                self.translate_unit(unit, affected_functions, context, llm_client, limit)
+                for unit in level
+            ]))
+
+        code = splice_items(old_code, fragments, removed=dropped)
+        return await self.verify(code, llm_client)
+
+
+def get_incremental_translation_gen_stage(meta_file, dst_file, test_file, source_lang="C", dest_lang="Rust",
+                                          max_workers=4, ast_view="auto", policy=None, tests_ready=None,
+                                          symbol_index=None):
+    """
+    Returns:
+        IncrementalTranslation: None if there is no previous translation to
+            update, the file has to be translated from scratch then
+    """
+    previous_hashes = load_decl_hashes(dst_file)
+    if previous_hashes is None or not os.path.exists(dst_file):
+        logger.info(f"No previous translation of {os.path.basename(dst_file)}, translating the whole file")
+        return None
+    return IncrementalTranslation(
+        meta_file=meta_file,
+        dst_file=dst_file,
+        test_file=test_file,
+        source_lang=source_lang,
+        dest_lang=dest_lang,
+        max_workers=max_workers,
+        ast_view=ast_view,
+        policy=policy,
+        tests_ready=tests_ready,
+        symbol_index=symbol_index,
+        previous_hashes=previous_hashes
+    )
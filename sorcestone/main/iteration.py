@@ -1,57 +1,363 @@
+import os
+import json
+import time
+import asyncio
+import threading
+
 from sorcestone.utils.logger import logger
+from sorcestone.utils.file_utils import append_line
+from sorcestone.utils.metrics import record, timer
+from sorcestone.utils.transcripts import get_transcript_archive
+from sorcestone.utils.tokens import estimate_tokens
+from sorcestone.utils.llm_cache import round_context
+
+
+# Stages may run concurrently, only one of them can talk to the user at a time
+feedback_lock = threading.Lock()
+review_lock = threading.Lock()
+
+# Number of latest rounds sent back to the LLM, older errors are dropped
+DEFAULT_HISTORY_WINDOW = 3
+
+
+def supports_messages(llm_client):
+    """
+    Check if the client can continue a chat session.
+
+    Such clients declare supports_messages = True and provide
+    send_messages(messages) taking Anthropic style messages, optionally
+    asend_messages(messages) as well. Clients from telescope.get_client do
+    not declare it, so with them every round resends the initial query and
+    the history window as one flat query; only history_window takes effect
+    and the prompt caching prefix of get_messages is not used.
+    """
+    return getattr(llm_client, 'supports_messages', False) is True
+
+
+def get_messages_text(messages):
+    """
+    Join text of all messages, content is either a string or text blocks.
+    """
+    parts = []
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, str):
+            parts.append(content)
+        else:
+            parts.extend(block["text"] for block in content)
+    return "\n".join(parts)
+
+
+class IterationBudgetExceeded(Exception):
+    pass
+
+
+class IterationPolicy(object):
+    """
+    Rules for running Iteration rounds.
+
+    Interactive policy asks the user for feedback after every round. Without
+    it (autopilot) stages run unattended and are accepted as soon as the
+    validation succeeds. Budgets are per stage, None means unlimited.
+    Accepted and failed stages can be appended to a JSONL review queue, so a
+    human can look at them later without blocking the run.
+
+    Args:
+        interactive (bool): Ask the user for feedback
+        auto_accept (bool): Do not ask for feedback once the validation succeeds
+        max_rounds (int): Max LLM requests per stage
+        max_seconds (float): Max wall-clock time per stage
+        max_tokens (int): Max estimated request and response tokens per stage
+        review_queue (str): JSONL file to queue stage results for review
+    """
+
+    def __init__(self, interactive=True, auto_accept=False, max_rounds=None, max_seconds=None, max_tokens=None,
+                 review_queue=None):
+        self.interactive = interactive
+        self.auto_accept = auto_accept or not interactive
+        self.max_rounds = max_rounds
+        self.max_seconds = max_seconds
+        self.max_tokens = max_tokens
+        self.review_queue = review_queue
+
+    def should_ask(self, return_code):
+        if not self.interactive:
+            return False
+        return not (self.auto_accept and return_code == 0)
+
+    def get_exceeded_budget(self, rounds, seconds, tokens):
+        """
+        Returns:
+            str: Description of the exceeded budget, None if within budgets
+        """
+        if self.max_rounds is not None and rounds >= self.max_rounds:
+            return f"{rounds} rounds"
+        if self.max_seconds is not None and seconds >= self.max_seconds:
+            return f"{seconds:.0f} seconds"
+        if self.max_tokens is not None and tokens >= self.max_tokens:
+            return f"{tokens} tokens"
+        return None
+
+    def queue_review(self, record):
+        if not self.review_queue:
+            return
+        with review_lock:
+            append_line(self.review_queue, json.dumps(record))
+
+
+# Default policy keeps the historical behaviour: ask after every round
+INTERACTIVE_POLICY = IterationPolicy()
 
 
 class Iteration(object):
-    
-    def __init__(self, initial_query, validation_callback=None):
+
+    def __init__(self, initial_query, validation_callback=None, name=None, async_validation_callback=None,
+                 history_window=DEFAULT_HISTORY_WINDOW, policy=None):
         self.initial_query = initial_query
-        self.log = []
+        # (response, log entries) of the latest finished rounds, older ones
+        # are dropped once they fall out of history_window
+        self.rounds = []
+        self.round_count = 0
         self.validation_callback = validation_callback
+        self.async_validation_callback = async_validation_callback
+        self.name = name
+        self.history_window = history_window
+        self.policy = policy or INTERACTIVE_POLICY
+        self.started = None
+        self.tokens = 0
 
 
     def validate(self, result):
         if self.validation_callback:
             return_code, return_message = self.validation_callback(result)
-            return return_code, return_message 
-        
+            return return_code, return_message
+
         return 0, ""
-    
+
+    async def avalidate(self, result):
+        """
+        Async validation, prefers async_validation_callback and runs the
+        blocking callback in a thread otherwise.
+        """
+        if self.async_validation_callback:
+            return await self.async_validation_callback(result)
+        return await asyncio.to_thread(self.validate, result)
+
+    @property
+    def log(self):
+        """
+        Errors and feedback of the rounds kept in the history.
+        """
+        return [entry for _, entries in self.rounds for entry in entries]
+
+    def get_history(self):
+        """
+        Get rounds which are sent back to the LLM, limited by history_window.
+        """
+        return self.rounds
+
+    def get_query(self):
+        query = f"{self.initial_query}"
+        log = [entry for _, entries in self.get_history() for entry in entries]
+        if len(log):
+            query += "\n".join(log)
+        return query
+
+    def get_messages(self):
+        """
+        Get chat session for clients supporting messages.
+
+        The initial query is a stable prefix marked as a prompt caching
+        breakpoint, so vendors only process the new messages of each round.
+        Only used with clients passing supports_messages, see there.
+
+        Returns:
+            list: Anthropic style messages
+        """
+        messages = [{
+            "role": "user",
+            "content": [{"type": "text", "text": self.initial_query, "cache_control": {"type": "ephemeral"}}]
+        }]
+        for response, entries in self.get_history():
+            messages.append({"role": "assistant", "content": response})
+            messages.append({"role": "user", "content": "\n".join(entries) or "Validation failed, try again"})
+        return messages
+
+    def send(self, llm_client):
+        """
+        Returns:
+            tuple: (request, LLM response), request is either query or messages
+        """
+        with timer("llm_request_seconds"), round_context(self.round_count + 1):
+            if supports_messages(llm_client):
+                messages = self.get_messages()
+                return messages, llm_client.send_messages(messages)
+            query = self.get_query()
+            return query, llm_client.send_message(query)
+
+    async def asend(self, llm_client):
+        """
+        Same as send, prefers async client methods and runs the blocking ones
+        in a thread otherwise.
+        """
+        with timer("llm_request_seconds"), round_context(self.round_count + 1):
+            if supports_messages(llm_client):
+                messages = self.get_messages()
+                if hasattr(llm_client, 'asend_messages'):
+                    result = await llm_client.asend_messages(messages)
+                else:
+                    result = await asyncio.to_thread(llm_client.send_messages, messages)
+                return messages, result
+
+            query = self.get_query()
+            if hasattr(llm_client, 'asend_message'):
+                return query, await llm_client.asend_message(query)
+            return query, await asyncio.to_thread(llm_client.send_message, query)
+
+    def log_round(self, request, result, return_code, return_message):
+        """
+        Archive the full round transcript, console and log only get a summary,
+        unless a human is asked for feedback on the response.
+        """
+        round_number = self.round_count + 1
+        get_transcript_archive().write(
+            self.name, round_number, request, result, return_code=return_code, return_message=return_message
+        )
+        logger.info(
+            f"Stage {self.name or ''} round {round_number}: return code {return_code}, "
+            f"{len(result or '')} chars of response archived"
+        )
+        if self.policy.should_ask(return_code):
+            logger.info(f"LLM response: {result}")
+        logger.info(f"Return message: {return_message}")
+
+    def start_clock(self):
+        """
+        Start counting max_seconds before the first request, it is usually the longest one.
+        """
+        if self.started is None:
+            self.started = time.monotonic()
+
+    def start_round(self, request, result):
+        if isinstance(request, list):
+            request = get_messages_text(request)
+        prompt_tokens = estimate_tokens(request)
+        completion_tokens = estimate_tokens(result)
+        self.tokens += prompt_tokens + completion_tokens
+        record("llm_prompt_tokens", prompt_tokens)
+        record("llm_completion_tokens", completion_tokens)
+
+    def get_feedback(self, return_code):
+        if self.policy.should_ask(return_code):
+            return self.ask_feedback()
+        return ""
+
+    def finish_round(self, result, return_code, return_message, feedback):
+        """
+        Remember response, errors and feedback for the next query.
+
+        Returns:
+            bool: True if iteration is done
+
+        Raises:
+            IterationBudgetExceeded: If the stage is not done and ran out of
+                one of the policy budgets
+        """
+        entries = []
+        if return_message:
+            entries.append(f"Error: {return_message}")
+        if feedback:
+            entries.append(f"Recomendations: {feedback}")
+        self.rounds.append((result, entries))
+        self.round_count += 1
+        if self.history_window is not None:
+            # Long autopilot runs would keep every response otherwise
+            del self.rounds[:max(len(self.rounds) - self.history_window, 0)]
+
+        done = (return_code == 0) and (not feedback)
+        if done:
+            record("iteration_rounds", self.round_count)
+            self.queue_review("accepted", result, return_message)
+            return done
+
+        exceeded = self.policy.get_exceeded_budget(
+            self.round_count, time.monotonic() - self.started, self.tokens
+        )
+        if exceeded:
+            record("iteration_rounds", self.round_count)
+            record("iteration_budget_exceeded", 1)
+            self.queue_review("budget_exceeded", result, return_message)
+            raise IterationBudgetExceeded(
+                f"Stage {self.name or ''} exceeded its budget after {exceeded}: {return_message}"
+            )
+        return done
+
+    def queue_review(self, status, result, return_message):
+        self.policy.queue_review({
+            "stage": self.name,
+            "status": status,
+            "time": time.time(),
+            "rounds": self.round_count,
+            "seconds": round(time.monotonic() - self.started, 3),
+            "tokens": self.tokens,
+            "result": return_message,
+            "response": result,
+            "log": self.log,
+        })
+
     def run(self, llm_client):
         done = False
-        feedback = ""
         return_message = ""
+        self.start_clock()
         while not done:
-            query = f"{self.initial_query}"
-            if len(self.log):
-                query += "\n".join(self.log)
-            
-            result = llm_client.send_message(query)
+            request, result = self.send(llm_client)
+            self.start_round(request, result)
             return_code, return_message = self.validate(result)
-            logger.info("#"*50)
-            logger.info(f"LLM request: {query}")
-            logger.info(f"LLM response: {result}")
-            logger.info("#"*50)
-            logger.info(f"Return code: {return_code}")
-            logger.info(f"Return message: {return_message}")
-            feedback = self.ask_feedback()
-            if return_message:
-                self.log.append(f"Error: {return_message}")
-            if feedback:    
-                self.log.append(f"Recomendations: {feedback}")
-
-            done = (return_code == 0) and (not feedback)
-        
+            self.log_round(request, result, return_code, return_message)
+            feedback = self.get_feedback(return_code)
+            done = self.finish_round(result, return_code, return_message, feedback)
+
+        return return_message
+
+    async def arun(self, llm_client):
+        """
+        Same as run, but LLM requests, validation and feedback do not block
+        the event loop, so one loop can drive many stages at once.
+        Uses async client methods when the client provides them.
+        """
+        done = False
+        return_message = ""
+        self.start_clock()
+        while not done:
+            request, result = await self.asend(llm_client)
+            self.start_round(request, result)
+            return_code, return_message = await self.avalidate(result)
+            self.log_round(request, result, return_code, return_message)
+            feedback = await asyncio.to_thread(self.get_feedback, return_code)
+            done = self.finish_round(result, return_code, return_message, feedback)
+
         return return_message
 
 
     def ask_feedback(self):
-        return input("What would You think about this iteration: ")
+        prompt = "What would You think about this iteration: "
+        if self.name:
+            prompt = f"[{self.name}] {prompt}"
+        with feedback_lock:
+            try:
+                return input(prompt)
+            except EOFError:
+                # No terminal attached, e.g. batch worker process
+                return ""
 
 
 class FakeIteration(object):
 
     def __init__(self, fake_response):
         self.fake_response = fake_response
-    
+
     def run(self, *args, **kwargs):
         return self.fake_response
+
+    async def arun(self, *args, **kwargs):
+        return self.fake_response
@@ -0,0 +1,157 @@
+import os
+import re
+import json
+import time
+import threading
+from functools import lru_cache
+
+from sorcestone.utils.logger import logger
+from sorcestone.utils.cache import hash_key, hash_file
+from sorcestone.utils.file_utils import write_atomic
+from sorcestone.utils.metrics import record, timer
+
+
+MANIFEST_VERSION = 1
+
+PIPELINE_STAGES = ['generate_ast', 'compile', 'generate_tests', 'generate_dst_code', 'fuzz', 'benchmark']
+
+RE_LOCAL_INCLUDE = re.compile(r'^\s*#\s*include\s*"([^"]+)"', re.MULTILINE)
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def get_source_inputs(file_path):
+    """
+    Hash the source file and local headers it includes, recursively.
+
+    Only quoted includes found next to the including file are followed,
+    system headers are covered by the tool versions.
+
+    Returns:
+        dict: path to content hash
+    """
+    hashes = {}
+    stack = [os.path.abspath(file_path)]
+    while stack:
+        path = stack.pop()
+        if path in hashes or not os.path.isfile(path):
+            continue
+        hashes[path] = hash_file(path)
+        with open(path, errors='replace') as f:
+            includes = RE_LOCAL_INCLUDE.findall(f.read())
+        stack.extend(os.path.normpath(os.path.join(os.path.dirname(path), include)) for include in includes)
+    return hashes
+
+
+@lru_cache(maxsize=None)
+def get_tool_version(path):
+    """
+    Hash of a tool folder or module, e.g. language tools or a stage module
+    holding the prompts. Hidden folders (virtual envs) and caches are skipped.
+    """
+    path = os.path.normpath(path)
+    if os.path.isfile(path):
+        return hash_file(path)
+
+    parts = []
+    for root, dirs, file_names in os.walk(path):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.') and d != '__pycache__')
+        for file_name in sorted(file_names):
+            file_path = os.path.join(root, file_name)
+            parts += [os.path.relpath(file_path, path), hash_file(file_path)]
+    return hash_key(*parts)
+
+
+def get_stage_module_version(name):
+    return get_tool_version(os.path.join(PROJECT_ROOT, f"{name}.py"))
+
+
+def get_language_tools_version(language):
+    return get_tool_version(os.path.join(PROJECT_ROOT, f"../language_tools/{language}"))
+
+
+class Manifest(object):
+    """
+    Per file record of the pipeline stages, like make for the translation.
+
+    For every stage the manifest keeps hashes of its inputs (sources,
+    upstream artifacts, options and tool versions) and of the files it
+    produced. A stage is up to date when its inputs did not change and its
+    outputs are still there, unchanged.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.stages = {}
+        # Pipeline stages of the file record concurrently
+        self.lock = threading.RLock()
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+                if data.get("version") == MANIFEST_VERSION:
+                    self.stages = data.get("stages", {})
+            except ValueError:
+                logger.warning(f"Ignoring broken manifest {path}")
+
+    def save(self):
+        with self.lock:
+            write_atomic(self.path, json.dumps({"version": MANIFEST_VERSION, "stages": self.stages}, indent=4))
+
+    def is_up_to_date(self, stage, inputs):
+        record = self.stages.get(stage)
+        if not record or record["inputs"] != inputs:
+            return False
+        for path, digest in record["outputs"].items():
+            if not os.path.exists(path) or hash_file(path) != digest:
+                return False
+        return True
+
+    def record(self, stage, inputs, outputs):
+        """
+        Remember that stage produced outputs out of inputs.
+
+        Args:
+            stage (str): Stage name
+            inputs (dict): JSON serializable stage inputs
+            outputs ([str]): Files produced by the stage
+        """
+        entry = {
+            "inputs": inputs,
+            "outputs": {os.path.abspath(path): hash_file(path) for path in outputs},
+            "time": time.time(),
+        }
+        with self.lock:
+            self.stages[stage] = entry
+            self.save()
+
+    def output_hash(self, stage, path):
+        """
+        Get recorded hash of the stage output, used as downstream input.
+        """
+        return self.stages.get(stage, {}).get("outputs", {}).get(os.path.abspath(path))
+
+    def run_stage(self, stage, inputs, outputs, func, force=False):
+        """
+        Run stage unless it is up to date.
+
+        Args:
+            stage (str): Stage name
+            inputs (dict): JSON serializable stage inputs
+            outputs ([str]): Files produced by the stage
+            func (callable): Runs the stage
+            force (bool): Run even if up to date
+
+        Returns:
+            bool: True if the stage was run
+        """
+        # Round trip through JSON, so tuples and lists compare equal to the stored inputs
+        inputs = json.loads(json.dumps(inputs))
+        if not force and self.is_up_to_date(stage, inputs):
+            logger.info(f"Stage {stage} is up to date, skipping")
+            record("stage_skipped", 1, stage=stage)
+            return False
+        with timer("stage_seconds", stage=stage):
+            func()
+        self.record(stage, inputs, outputs)
+        return True
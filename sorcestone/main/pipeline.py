@@ -0,0 +1,98 @@
+import time
+import threading
+import contextvars
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from sorcestone.utils.logger import logger
+
+
+class Pipeline(object):
+    """
+    Stages of a file as a dependency graph.
+
+    Every stage runs in its own thread as soon as the stages it depends on
+    succeeded, so independent stages overlap, e.g. compiling the source
+    library while it is parsed. If a stage fails, stages depending on it
+    fail with the same exception without running, others still finish.
+    """
+
+    def __init__(self):
+        # name -> (func, dependency names), in insertion order
+        self.stages = {}
+        self.futures = {}
+
+    def add_stage(self, name, func, deps=()):
+        """
+        Args:
+            name (str): Stage name
+            func (callable): Runs the stage, its result is the stage result
+            deps ([str]): Stages which must succeed first, added before
+
+        Returns:
+            concurrent.futures.Future: Stage result, stages may wait on
+                results of other stages they do not strictly depend on
+        """
+        for dep in deps:
+            if dep not in self.stages:
+                raise ValueError(f"Stage {name} depends on unknown stage {dep}")
+        self.stages[name] = (func, tuple(deps))
+        self.futures[name] = Future()
+        return self.futures[name]
+
+    def _run_stage(self, name):
+        func, _ = self.stages[name]
+        future = self.futures[name]
+        if not future.set_running_or_notify_cancel():
+            return
+        started = time.monotonic()
+        logger.info(f"Stage {name} started")
+        try:
+            result = func()
+        except BaseException as e:
+            logger.error(f"Stage {name} failed after {time.monotonic() - started:.1f}s: {e}")
+            future.set_exception(e)
+        else:
+            logger.info(f"Stage {name} finished in {time.monotonic() - started:.1f}s")
+            future.set_result(result)
+
+    def _submit_when_ready(self, executor, name, context):
+        deps = [self.futures[dep] for dep in self.stages[name][1]]
+        remaining = [len(deps)]
+        lock = threading.Lock()
+
+        def on_dep_done(_):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            failed = next((dep for dep in deps if dep.exception() is not None), None)
+            if failed is not None:
+                self.futures[name].set_exception(failed.exception())
+                return
+            executor.submit(context.run, self._run_stage, name)
+
+        if not deps:
+            executor.submit(context.run, self._run_stage, name)
+        for dep in deps:
+            dep.add_done_callback(on_dep_done)
+
+    def run(self):
+        """
+        Run all stages and wait for them.
+
+        Returns:
+            dict: stage name to its result
+
+        Raises:
+            Exception: Exception of the first failed stage, in stage order
+        """
+        executor = ThreadPoolExecutor(max_workers=max(len(self.stages), 1), thread_name_prefix="stage")
+        try:
+            for name in self.stages:
+                # Stages see context variables of the caller, e.g. the current file for metrics
+                self._submit_when_ready(executor, name, contextvars.copy_context())
+            for future in self.futures.values():
+                future.exception()
+        finally:
+            executor.shutdown(wait=True)
+        return {name: future.result() for name, future in self.futures.items()}
@@ -0,0 +1,199 @@
+import os
+import copy
+import json
+import multiprocessing
+from functools import partial
+
+from sorcestone.utils.logger import logger
+from sorcestone.utils.file_utils import write_atomic
+from sorcestone.utils.ast_pack import load_ast
+from sorcestone.main.iteration import Iteration, IterationPolicy, IterationBudgetExceeded
+from sorcestone.main.generate_code_from_ast import test_validation_callback
+
+
+def isolated_worker(connection, target, args):
+    """ Entry point of the process started by run_isolated """
+    try:
+        connection.send(target(*args))
+    except Exception as e:
+        connection.send(e)
+    connection.close()
+
+
+def run_isolated(target, args, timeout, name):
+    """
+    Run target(*args) in a separate process, so a crash or a hang in a
+    library loaded by it does not affect the pipeline.
+
+    Args:
+        target (callable): Module level function, its result is sent back
+        timeout (float): Seconds to wait for the result
+        name (str): Used in error messages, e.g. "Benchmark"
+
+    Returns:
+        result of target
+
+    Raises:
+        Exception: If target raises, or the process crashes or times out
+    """
+    context = multiprocessing.get_context('spawn')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=isolated_worker, args=(sender, target, args), daemon=True)
+    process.start()
+    sender.close()
+    try:
+        if not receiver.poll(timeout):
+            raise Exception(f"{name} timed out after {timeout} seconds")
+        result = receiver.recv()
+    except EOFError:
+        raise Exception(f"{name} process crashed")
+    finally:
+        receiver.close()
+        if process.is_alive():
+            process.kill()
+        process.join()
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+class RepairStage(object):
+    """
+    Check the translated library against the source one and ask the LLM to
+    fix it when the check fails.
+
+    Subclasses define the check: measure() runs it on a library and
+    get_failures() picks the results which need a fix. Results are written
+    next to dst_file as the report. Candidates are validated by the tests
+    and the same check, they are built next to dst_file and replace it only
+    once they pass.
+    """
+
+    # Stage name, used for candidate file names and Iteration names
+    name = None
+    # Name of the check in logs, e.g. "Benchmark"
+    title = None
+    report_extension = None
+    max_rounds = 3
+
+    def __init__(self, meta_file, src_lib, dst_file, test_file, source_lang="C", dest_lang="Rust", policy=None):
+        self.meta_file = meta_file
+        self.src_lib = src_lib
+        self.dst_file = dst_file
+        self.test_file = test_file
+        self.source_lang = source_lang
+        self.dest_lang = dest_lang
+        self.policy = policy
+        base, extension = os.path.splitext(dst_file)
+        self.candidate_file = f"{base}_{self.name}{extension}"
+        self.report_file = f"{base}{self.report_extension}"
+
+    def get_policy(self):
+        """ Repairs stop after max_rounds unless the policy is stricter """
+        policy = copy.copy(self.policy) if self.policy else IterationPolicy()
+        policy.max_rounds = min(policy.max_rounds or self.max_rounds, self.max_rounds)
+        return policy
+
+    def get_signatures(self, ast):
+        raise NotImplementedError()
+
+    def measure(self, dst_lib, signatures):
+        """
+        Returns:
+            list: Per function results of the check of dst_lib
+
+        Raises:
+            Exception: If the check could not be run
+        """
+        raise NotImplementedError()
+
+    def get_failures(self, results):
+        raise NotImplementedError()
+
+    def format_results(self, results):
+        raise NotImplementedError()
+
+    def get_query(self, code, failures, signatures):
+        raise NotImplementedError()
+
+    def get_failure_message(self, failures, signatures):
+        raise NotImplementedError()
+
+    def on_measure_error(self, error, signatures):
+        """
+        Called when the check of dst_file fails to run.
+
+        Returns:
+            list: Results to report instead
+        """
+        raise error
+
+    def on_budget_exceeded(self, error, results):
+        """
+        Called when the LLM could not fix the failures within the budget.
+
+        Returns:
+            list: Results of the stage
+        """
+        raise error
+
+    def report(self, signatures):
+        """
+        Check dst_file and write the report.
+        """
+        try:
+            results = self.measure(f"{self.dst_file}.so", signatures)
+        except Exception as e:
+            results = self.on_measure_error(e, signatures)
+        write_atomic(self.report_file, json.dumps(results, indent=4))
+        return results
+
+    def validate(self, response, signatures=()):
+        """
+        Check that the candidate passes the tests and the check.
+        """
+        return_code, return_message = test_validation_callback(
+            response, file_path=self.candidate_file, test_file=self.test_file, dest_lang=self.dest_lang
+        )
+        if return_code:
+            return return_code, return_message
+
+        try:
+            results = self.measure(f"{self.candidate_file}.so", signatures)
+        except Exception as e:
+            return 1, str(e)
+        logger.info(f"{self.title} results:\n{self.format_results(results)}")
+        failures = self.get_failures(results)
+        if failures:
+            return 1, self.get_failure_message(failures, signatures)
+        return 0, self.candidate_file
+
+    def run(self, llm_client):
+        """
+        Returns:
+            list: Results of the final code
+        """
+        signatures = self.get_signatures(load_ast(self.meta_file))
+        results = self.report(signatures)
+        logger.info(f"{self.title} results:\n{self.format_results(results)}")
+
+        failures = self.get_failures(results)
+        if not failures:
+            return results
+
+        with open(self.dst_file) as f:
+            code = f.read()
+        stage = Iteration(
+            initial_query=self.get_query(code, failures, signatures),
+            validation_callback=partial(self.validate, signatures=signatures),
+            name=f"{os.path.basename(self.dst_file)}:{self.name}",
+            policy=self.get_policy()
+        )
+        try:
+            stage.run(llm_client=llm_client)
+        except IterationBudgetExceeded as e:
+            return self.on_budget_exceeded(e, results)
+
+        os.replace(self.candidate_file, self.dst_file)
+        os.replace(f"{self.candidate_file}.so", f"{self.dst_file}.so")
+        return self.report(signatures)
@@ -1,13 +1,31 @@
 import os
 import sys
+import json
+import time
 import argparse
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
 from telescope import get_client
 
 from sorcestone.utils.logger import logger
-from sorcestone.main.compile import compile_code
-from sorcestone.main.generate_ast import generate_ast
-from sorcestone.main.generate_tests import get_test_gen_stage
-from sorcestone.main.generate_code_from_ast import get_translation_gen_stage
+from sorcestone.utils.file_utils import write_atomic
+from sorcestone.utils.llm_cache import CachedClient
+from sorcestone.utils.metrics import (
+    configure_metrics, file_context, get_file_metrics, get_run_id, merge_metrics, record, timer, to_openmetrics
+)
+from sorcestone.utils.ast_render import AST_VIEWS
+from sorcestone.main.iteration import IterationPolicy, INTERACTIVE_POLICY
+from sorcestone.main.compile import compile_code, get_toolchain_version
+from sorcestone.main.manifest import (
+    Manifest, PIPELINE_STAGES, get_source_inputs, get_stage_module_version, get_language_tools_version
+)
+from sorcestone.main.generate_ast import generate_ast, index_sources
+from sorcestone.main.generate_tests import get_test_gen_stage, get_test_file_name, run_tests
+from sorcestone.main.generate_code_from_ast import get_translation_gen_stage, get_chunked_translation_gen_stage
+from sorcestone.main.benchmark import get_perf_stage
+from sorcestone.main.fuzz import get_fuzz_stage
+from sorcestone.main.pipeline import Pipeline
+from sorcestone.main.incremental import get_incremental_translation_gen_stage, save_decl_hashes
 
 
 def get_language_extensions():
@@ -25,6 +43,10 @@ def get_language_extensions():
     }
 
 
+# Files which are only translated as a part of files including them
+HEADER_EXTENSIONS = ['.h', '.cpy']
+
+
 def get_language_categories():
     """
     Categorize language folders based on available tools.
@@ -55,79 +77,438 @@ def get_language_categories():
     return source_languages, destination_languages
 
 
-def get_ai_client():
-    return get_client(
-        vendor='anthropic', model='claude-3-5-sonnet-latest'
-        # vendor='anthropic', model='claude-3-7-sonnet-latest'
-        # vendor='google', model='gemini-2.0-flash
-        # vendor='google', model='gemini-2.5-pro-exp-03-25
-        )
+def get_ai_client(use_cache=True):
+    vendor, model = 'anthropic', 'claude-3-5-sonnet-latest'
+    # vendor, model = 'anthropic', 'claude-3-7-sonnet-latest'
+    # vendor, model = 'google', 'gemini-2.0-flash'
+    # vendor, model = 'google', 'gemini-2.5-pro-exp-03-25'
+    # telescope clients only provide send_message, iterations fall back to
+    # the flat query, see iteration.supports_messages
+    client = get_client(vendor=vendor, model=model)
+    if use_cache:
+        client = CachedClient(client, vendor=vendor, model=model)
+    return client
 
 
-def process_file(file_path, from_language, to_language, cpp_args=None):
+def process_file(file_path, from_language, to_language, cpp_args=None, ast_format="json", chunked=False,
+                 workspace=None, llm_cache=True, ast_view="auto", policy=None, perf_threshold=None, force=(),
+                 incremental=False, symbol_index=None, fuzz_cases=None, fuzz_seed=0):
     """
     Process a single file to generate its meta model
 
     Args:
         file_path (str): Path to the file to process
+        ast_format (str): On-disk AST format, "json" or compact binary "pack"
+        chunked (bool): Translate function by function with concurrent LLM requests
+        workspace (str): Folder for all generated artifacts. Defaults to the
+            folder of the source file.
+        llm_cache (bool): Replay stored LLM responses for identical prompts
+        ast_view (str): AST rendering in prompts: "json", "sexp", "c" or "auto"
+            for the one with the least tokens
+        policy (IterationPolicy): Feedback and budget rules for LLM stages,
+            interactive by default
+        perf_threshold (float): Benchmark translated functions against the
+            source ones and ask for optimization when they are more than
+            this many times slower. Disabled if None.
+        force ([str]): Stages to run even if the manifest says they are up to date
+        incremental (bool): When the source changed, retranslate only changed
+            declarations and their dependents, keep the existing tests if
+            they still pass against the changed library
+        symbol_index (str): Project symbol index, the file's declarations are
+            added to it and chunked translation gets declarations of
+            functions it calls from other files
+        fuzz_cases (int): Call translated functions with this many random
+            inputs besides boundary values and compare the results with the
+            source library, counterexamples are given to the LLM to fix the
+            code. Disabled if None.
+        fuzz_seed (int): Seed of the fuzzing inputs
     """
-    # Check_List makes us able to mark specific stages as accomplished during the previous run
-    check_list = {
-        "generate_ast": False,
-        "compile": False,
-        "generate_tests": False,
-        "generate_dst_code": False
-    }
-    check_list.update({
-        # "generate_ast": True,
-        # "compile": True,
-        # "generate_tests": True,
-    })
+    force = set(force or ())
+    if workspace:
+        os.makedirs(workspace, exist_ok=True)
+        artifact_path = os.path.join(workspace, os.path.basename(file_path))
+    else:
+        artifact_path = file_path
+
+    # Manifest makes us able to skip stages which are up to date since the previous run
+    manifest = Manifest(f"{os.path.splitext(artifact_path)[0]}.manifest.json")
+    sources = get_source_inputs(file_path)
+
+    pipeline = Pipeline()
 
-    # Generate AST first
+    # Parsing and compiling the source do not depend on each other
     logger.info(f"Generating {from_language} AST")
-    ast_file_path = f"{os.path.splitext(file_path)[0]}.ast"
-    _ = generate_ast(
-        file_path=file_path,
-        language=from_language,
-        output_file=ast_file_path,
-        cpp_args=cpp_args,
-        skip=check_list['generate_ast']
-    )
+    ast_file_path = f"{os.path.splitext(artifact_path)[0]}.ast"
+    ast_inputs = {
+        "sources": sources,
+        "cpp_args": cpp_args or "",
+        "ast_format": ast_format,
+        "tools": get_language_tools_version(from_language),
+    }
+    if symbol_index:
+        # Parse again when the index changes, so the file gets indexed
+        ast_inputs["symbol_index"] = symbol_index
+    pipeline.add_stage("generate_ast", lambda: manifest.run_stage(
+        "generate_ast",
+        inputs=ast_inputs,
+        outputs=[ast_file_path],
+        func=lambda: generate_ast(
+            file_path=file_path,
+            language=from_language,
+            output_file=ast_file_path,
+            cpp_args=cpp_args,
+            ast_format=ast_format,
+            index_db=symbol_index
+        ),
+        force="generate_ast" in force
+    ))
 
-    # Then compile the code
     logger.info(f"Compiling {from_language} code")
-    src_so_file_path = f"{file_path}.so"
-    _ = compile_code(
-        file_path=file_path,
-        language=from_language,
-        output_file=src_so_file_path,
-        skip=check_list['compile']
-    )
-    
-    client = get_ai_client()
-    
+    src_so_file_path = f"{artifact_path}.so"
+    pipeline.add_stage("compile", lambda: manifest.run_stage(
+        "compile",
+        inputs={
+            "sources": sources,
+            "toolchain": get_toolchain_version(from_language),
+            "tools": get_language_tools_version(from_language),
+        },
+        outputs=[src_so_file_path],
+        func=lambda: compile_code(
+            file_path=file_path,
+            language=from_language,
+            output_file=src_so_file_path
+        ),
+        force="compile" in force
+    ))
+
+    client = get_ai_client(use_cache=llm_cache)
+
+    def get_llm_inputs():
+        return {
+            "languages": [from_language, to_language],
+            "ast": manifest.output_hash("generate_ast", ast_file_path),
+            "ast_view": ast_view,
+            "model": getattr(client, 'model', None),
+        }
+
     # Then Generate functional tests
-    logger.info(f"Generate and run tests for {from_language}->{to_language} translation")
-    tests_generation_stage = get_test_gen_stage(
-        meta_file=ast_file_path,
-        code_file=src_so_file_path,
-        src_language=from_language,
-        dst_language=to_language,
-        skip=check_list['generate_tests']
-    )
-    test_file_path = tests_generation_stage.run(llm_client=client)
+    test_file_path = get_test_file_name(src_so_file_path, to_language)
+    # Resolves to True once test generation actually starts, False if it is up to date
+    tests_started = Future()
+
+    def run_tests_generation():
+        logger.info(f"Generate and run tests for {from_language}->{to_language} translation")
+        try:
+            tests_generation_stage = get_test_gen_stage(
+                meta_file=ast_file_path,
+                code_file=src_so_file_path,
+                src_language=from_language,
+                dst_language=to_language,
+                ast_view=ast_view,
+                policy=policy
+            )
+
+            def run_stage():
+                if incremental and os.path.exists(test_file_path):
+                    if not run_tests(test_file_path, src_so_file_path, from_language).returncode:
+                        logger.info(f"Existing tests pass against the changed {from_language} library, keeping them")
+                        return
+                tests_started.set_result(True)
+                tests_generation_stage.run(llm_client=client)
+
+            manifest.run_stage(
+                "generate_tests",
+                inputs=dict(
+                    get_llm_inputs(),
+                    library=manifest.output_hash("compile", src_so_file_path),
+                    prompts=get_stage_module_version("generate_tests")
+                ),
+                outputs=[test_file_path],
+                func=run_stage,
+                force="generate_tests" in force
+            )
+        finally:
+            if not tests_started.done():
+                tests_started.set_result(False)
+
+    tests_done = pipeline.add_stage("generate_tests", run_tests_generation, deps=["generate_ast", "compile"])
 
     # Then Generate code in destinatio language and verify with tests
-    logger.info(f"Generate {to_language} code and verify with tests")
     language_extensions = get_language_extensions()
-    generated_code_path =  f"{os.path.splitext(file_path)[0]}{language_extensions[to_language][0]}"
-    dst_generation_stage = get_translation_gen_stage(meta_file=ast_file_path, dst_file=generated_code_path, test_file=test_file_path,
-                                                     source_lang=from_language, dest_lang=to_language)
-    _ = dst_generation_stage.run(llm_client=client)
+    generated_code_path =  f"{os.path.splitext(artifact_path)[0]}{language_extensions[to_language][0]}"
+    dst_outputs = [generated_code_path, f"{generated_code_path}.so"]
+
+    def get_dst_inputs():
+        return dict(
+            get_llm_inputs(),
+            tests=manifest.output_hash("generate_tests", test_file_path),
+            chunked=chunked,
+            prompts=get_stage_module_version("generate_code_from_ast"),
+            tools=get_language_tools_version(to_language)
+        )
+
+    def translate(**kwargs):
+        stage_args = dict(meta_file=ast_file_path, dst_file=generated_code_path, test_file=test_file_path,
+                          source_lang=from_language, dest_lang=to_language, ast_view=ast_view, policy=policy,
+                          **kwargs)
+        stage = None
+        if incremental:
+            stage = get_incremental_translation_gen_stage(symbol_index=symbol_index, **stage_args)
+        if stage is None and chunked:
+            stage = get_chunked_translation_gen_stage(symbol_index=symbol_index, **stage_args)
+        if stage is None:
+            stage = get_translation_gen_stage(**stage_args)
+        stage.run(llm_client=client)
+        # Baseline for the next incremental translation
+        save_decl_hashes(ast_file_path, generated_code_path)
+
+    def run_translation():
+        logger.info(f"Generate {to_language} code and verify with tests")
+
+        # Translation prompts do not depend on the tests. While new tests are
+        # being generated, translate speculatively and wait for the tests only
+        # when validating. Interactive runs stay sequential, so the user is
+        # not asked about two stages at once.
+        wait([tests_started, tests_done], return_when=FIRST_COMPLETED)
+        speculative = (
+            not (policy or INTERACTIVE_POLICY).interactive and tests_started.done() and tests_started.result()
+        )
+        if not speculative:
+            tests_done.result()
+            manifest.run_stage(
+                "generate_dst_code",
+                inputs=get_dst_inputs(),
+                outputs=dst_outputs,
+                func=translate,
+                force="generate_dst_code" in force
+            )
+            return
+
+        logger.info(f"Translating to {to_language} while tests are being generated")
+        with timer("stage_seconds", stage="generate_dst_code"):
+            translate(tests_ready=tests_done)
+        # Tests changed, so the translation would not have been up to date anyway
+        manifest.record("generate_dst_code", get_dst_inputs(), dst_outputs)
+
+    pipeline.add_stage("generate_dst_code", run_translation, deps=["generate_ast"])
+
+    if fuzz_cases:
+        def run_fuzz():
+            logger.info(f"Fuzz {to_language} code against {from_language}")
+            fuzz_stage = get_fuzz_stage(meta_file=ast_file_path, src_lib=src_so_file_path,
+                                        dst_file=generated_code_path, test_file=test_file_path,
+                                        source_lang=from_language, dest_lang=to_language,
+                                        cases=fuzz_cases, seed=fuzz_seed, policy=policy)
+            dst_inputs = get_dst_inputs()
+
+            def run_fuzz_stage():
+                fuzz_stage.run(llm_client=client)
+                # Fixed code is the new product of the translation stage
+                manifest.record("generate_dst_code", dst_inputs, dst_outputs)
+
+            manifest.run_stage(
+                "fuzz",
+                inputs={
+                    "translation": dst_inputs,
+                    "library": manifest.output_hash("compile", src_so_file_path),
+                    "cases": fuzz_cases,
+                    "seed": fuzz_seed,
+                    "prompts": get_stage_module_version("fuzz"),
+                },
+                outputs=[fuzz_stage.report_file],
+                func=run_fuzz_stage,
+                force="fuzz" in force
+            )
+
+        pipeline.add_stage("fuzz", run_fuzz, deps=["compile", "generate_tests", "generate_dst_code"])
+
+    if perf_threshold:
+        def run_benchmark():
+            logger.info(f"Benchmark {to_language} code against {from_language}")
+            perf_stage = get_perf_stage(meta_file=ast_file_path, src_lib=src_so_file_path,
+                                        dst_file=generated_code_path, test_file=test_file_path,
+                                        source_lang=from_language, dest_lang=to_language,
+                                        threshold=perf_threshold, policy=policy)
+            dst_inputs = get_dst_inputs()
+
+            def run_perf_stage():
+                perf_stage.run(llm_client=client)
+                # Optimized code is the new product of the translation stage
+                manifest.record("generate_dst_code", dst_inputs, dst_outputs)
+
+            manifest.run_stage(
+                "benchmark",
+                inputs={
+                    "translation": dst_inputs,
+                    "library": manifest.output_hash("compile", src_so_file_path),
+                    "threshold": perf_threshold,
+                    "prompts": get_stage_module_version("benchmark"),
+                },
+                outputs=[perf_stage.report_file],
+                func=run_perf_stage,
+                force="benchmark" in force
+            )
+
+        # Only correct code is worth optimizing
+        deps = ["compile", "generate_tests", "generate_dst_code"] + (["fuzz"] if fuzz_cases else [])
+        pipeline.add_stage("benchmark", run_benchmark, deps=deps)
+
+    pipeline.run()
     return generated_code_path
 
 
+def collect_source_files(paths, language, exclude_dir=None):
+    """
+    Expand files and folders into the list of source files to translate.
+
+    Args:
+        paths ([str]): Files and folders
+        language (str): Source language name
+        exclude_dir (str, optional): Folder to skip, e.g. batch output folder
+
+    Returns:
+        list: Absolute paths of source files
+    """
+    extensions = [
+        ext for ext in get_language_extensions().get(language, [])
+        if ext not in HEADER_EXTENSIONS
+    ]
+    exclude_dir = os.path.abspath(exclude_dir) if exclude_dir else None
+    files = []
+    for path in paths:
+        path = os.path.abspath(path)
+        if not os.path.isdir(path):
+            files.append(path)
+            continue
+        for root, dirs, file_names in os.walk(path):
+            dirs[:] = sorted(d for d in dirs if os.path.join(root, d) != exclude_dir)
+            for file_name in sorted(file_names):
+                if os.path.splitext(file_name)[1].lower() in extensions:
+                    files.append(os.path.join(root, file_name))
+    return files
+
+
+def process_job(file_path, workspace, from_language, to_language, options):
+    """
+    Process a single file of the batch, never raises.
+
+    Returns:
+        dict: Job summary
+    """
+    started = time.time()
+    summary = {"file": file_path, "workspace": workspace}
+    with file_context(file_path):
+        try:
+            summary["output"] = process_file(
+                file_path=file_path,
+                from_language=from_language,
+                to_language=to_language,
+                workspace=workspace,
+                **options
+            )
+            summary["status"] = "done"
+        except Exception as e:
+            logger.error(f"Error processing file {file_path}: {e}")
+            summary["status"] = "failed"
+            summary["error"] = str(e)
+        summary["duration"] = round(time.time() - started, 3)
+        record("file_seconds", time.time() - started, status=summary["status"])
+    summary["metrics"] = get_file_metrics(file_path)
+    return summary
+
+
+def get_failed_summary(file_path, workspace, error):
+    """ Summary of a job whose worker did not report back """
+    logger.error(f"Error processing file {file_path}: {error}")
+    return {"file": file_path, "workspace": workspace, "status": "failed", "error": error, "duration": None,
+            "metrics": []}
+
+
+def run_jobs(jobs, workers):
+    """
+    Run process_job for every (file_path, workspace, from_language,
+    to_language, options) tuple in a pool of worker processes.
+
+    Returns:
+        list: Job summaries, None for jobs lost because a worker process died
+    """
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(process_job, *job) for job in jobs]
+        results = []
+        for job, future in zip(jobs, futures):
+            try:
+                results.append(future.result())
+            except BrokenProcessPool:
+                results.append(None)
+            except Exception as e:
+                results.append(get_failed_summary(job[0], job[1], str(e)))
+    return results
+
+
+def process_batch(file_paths, from_language, to_language, output_dir, jobs=None, **options):
+    """
+    Process many files concurrently in a bounded pool of worker processes.
+
+    Every file gets its own workspace folder in output_dir mirroring the
+    source tree, so jobs never overwrite each other's artifacts.
+
+    A worker process dying, e.g. on a crash in a loaded library, takes the
+    other jobs of the pool down with it. Those jobs run again each in a
+    pool of its own, so only the file which kills its worker fails.
+
+    Args:
+        file_paths ([str]): Source files to process
+        output_dir (str): Folder for workspaces and the summary
+        jobs (int, optional): Number of worker processes. Defaults to CPU count.
+        **options: Extra process_file arguments
+
+    Returns:
+        list: Job summaries, in file_paths order
+    """
+    root = os.path.commonpath([os.path.dirname(path) for path in file_paths])
+    started = time.time()
+    batch = [
+        (file_path, os.path.join(output_dir, os.path.splitext(os.path.relpath(file_path, root))[0]),
+         from_language, to_language, options)
+        for file_path in file_paths
+    ]
+    results = run_jobs(batch, jobs)
+
+    lost = [position for position, result in enumerate(results) if result is None]
+    if lost:
+        logger.warning(f"A worker process died, running {len(lost)} files again one per worker")
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            retries = list(executor.map(lambda position: run_jobs([batch[position]], 1)[0], lost))
+        for position, result in zip(lost, retries):
+            results[position] = result or get_failed_summary(
+                batch[position][0], batch[position][1], "Worker process died"
+            )
+
+    failed = [result for result in results if result["status"] != "done"]
+    for result in results:
+        logger.info(f"{result['status'].upper():6} {result['file']} ({result['duration']}s)")
+    logger.info(
+        f"Batch finished in {time.time() - started:.1f}s: "
+        f"{len(results) - len(failed)} done, {len(failed)} failed"
+    )
+    write_atomic(os.path.join(output_dir, "summary.json"), json.dumps(results, indent=4))
+
+    # Batch totals for tracking throughput across runs and releases
+    metrics = merge_metrics(result["metrics"] for result in results)
+    write_atomic(os.path.join(output_dir, "metrics.prom"), to_openmetrics(metrics, run_id=get_run_id()))
+    log_metrics(metrics)
+    return results
+
+
+def log_metrics(metrics):
+    for item in metrics:
+        labels = ", ".join(f"{name}={value}" for name, value in sorted(item["labels"].items()))
+        logger.info(
+            f"Metric {item['metric']}{f' ({labels})' if labels else ''}: "
+            f"count={item['count']} sum={item['sum']:.3f} max={item['max']:.3f}"
+        )
+
+
 def parse_arguments() -> argparse.Namespace:
     """
     Parse command-line arguments.
@@ -145,7 +526,9 @@ def parse_arguments() -> argparse.Namespace:
     parser.add_argument(
         'file_path',
         type=str,
-        help='Path to the source file to be translated (mandatory)'
+        nargs='+',
+        help='Path to the source file to be translated (mandatory). '
+             'Several files or folders start the batch mode'
     )
 
     parser.add_argument(
@@ -168,9 +551,253 @@ def parse_arguments() -> argparse.Namespace:
         default="",
         help="build args to be provided during the meta model generation. Space separated list of flags expected"
     )
+
+    parser.add_argument(
+        '--ast_format',
+        type=str,
+        choices=["json", "pack"],
+        default="json",
+        help="On-disk AST format: pretty printed json or compact binary pack"
+    )
+
+    parser.add_argument(
+        '--chunked',
+        action='store_true',
+        help="Translate function by function, ordered by the call graph, with concurrent LLM requests"
+    )
+
+    parser.add_argument(
+        '--jobs',
+        type=int,
+        default=None,
+        help="Batch mode: number of files processed concurrently. Defaults to CPU count"
+    )
+
+    parser.add_argument(
+        '--output_dir',
+        type=str,
+        default="sorcestone_output",
+        help="Batch mode: folder for per file workspaces and summary.json"
+    )
+
+    parser.add_argument(
+        '--no_llm_cache',
+        action='store_true',
+        help="Always send prompts to the LLM vendor, do not replay stored responses"
+    )
+
+    parser.add_argument(
+        '--ast_view',
+        type=str,
+        choices=["auto"] + AST_VIEWS,
+        default="auto",
+        help="AST rendering in prompts: json, terse sexp or regenerated c. "
+             "auto picks the one with the least tokens which round-trips"
+    )
+
+    parser.add_argument(
+        '--perf_threshold',
+        type=float,
+        default=None,
+        help="Benchmark translated functions against the source library and ask for optimization "
+             "when they are more than this many times slower, e.g. 1.5"
+    )
+
+    parser.add_argument(
+        '--fuzz_cases',
+        type=int,
+        default=None,
+        help="Differential fuzzing: call translated functions with this many random inputs besides "
+             "boundary values, compare with the source library and fix mismatches, e.g. 100000"
+    )
+
+    parser.add_argument(
+        '--fuzz_seed',
+        type=int,
+        default=0,
+        help="Seed of the fuzzing inputs, the same seed reproduces the same inputs"
+    )
+
+    parser.add_argument(
+        '--force',
+        type=str,
+        nargs='*',
+        choices=PIPELINE_STAGES,
+        default=None,
+        help="Rerun stages even if they are up to date. Without stage names all stages are rerun"
+    )
+
+    parser.add_argument(
+        '--autopilot',
+        action='store_true',
+        help="Do not ask for feedback, accept stages once validation succeeds. Always on in batch mode"
+    )
+
+    parser.add_argument(
+        '--max_rounds',
+        type=int,
+        default=None,
+        help="Max LLM requests per stage, the file fails once exceeded"
+    )
+
+    parser.add_argument(
+        '--max_seconds',
+        type=float,
+        default=None,
+        help="Max wall-clock seconds per stage"
+    )
+
+    parser.add_argument(
+        '--max_tokens',
+        type=int,
+        default=None,
+        help="Max estimated LLM tokens (requests and responses) per stage"
+    )
+
+    parser.add_argument(
+        '--review_queue',
+        type=str,
+        default=None,
+        help="JSONL file collecting stage results for later human review. "
+             "Defaults to review.jsonl in the output folder in batch mode"
+    )
+
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help="When the source changed since the last run, retranslate only changed functions and types "
+             "and their dependents, splicing them into the existing translation"
+    )
+
+    parser.add_argument(
+        '--symbol_index',
+        type=str,
+        default=None,
+        help="SQLite symbol index of the whole project. Parsed files are added to it and chunked translation "
+             "gets declarations of functions called from other files. In batch mode all files are indexed first"
+    )
+
+    parser.add_argument(
+        '--metrics_file',
+        type=str,
+        default=None,
+        help="JSONL file receiving metric events: stage, LLM, compile and test timings and token counts. "
+             "Defaults to metrics.jsonl in the output folder in batch mode"
+    )
+
+    parser.add_argument(
+        '--metrics_textfile',
+        type=str,
+        default=None,
+        help="OpenMetrics textfile with aggregated metrics of the run. "
+             "Batch mode always writes metrics.prom in the output folder"
+    )
     return parser.parse_args()
 
 
+def validate_source_file(file_path, language):
+    """
+    Check that the file exists and its extension matches the source language.
+
+    Returns:
+        str: Error message, None if the file is valid
+    """
+    # Ensure the file exists
+    if not os.path.isfile(file_path):
+        return f"File not found: {file_path}"
+
+    # Check if file extension matches source language
+    file_ext = os.path.splitext(file_path)[1].lower()
+    language_extensions = get_language_extensions()
+    valid_extensions = [ext.lower() for ext in language_extensions.get(language, [])]
+
+    if not valid_extensions:
+        return f"No known file extensions for language '{language}'"
+
+    if file_ext not in valid_extensions:
+        return f"File extension '{file_ext}' is not valid for {language}. Expected: {', '.join(valid_extensions)}"
+
+    return None
+
+
+def get_iteration_policy(args, batch=False):
+    """
+    Build LLM stage policy from the command line arguments.
+
+    Batch workers have no terminal, so batch mode always runs on autopilot
+    and queues results for review in the output folder.
+    """
+    review_queue = args.review_queue
+    if batch and review_queue is None:
+        review_queue = os.path.join(os.path.abspath(args.output_dir), "review.jsonl")
+    return IterationPolicy(
+        interactive=not (args.autopilot or batch),
+        max_rounds=args.max_rounds,
+        max_seconds=args.max_seconds,
+        max_tokens=args.max_tokens,
+        review_queue=os.path.abspath(review_queue) if review_queue else None
+    )
+
+
+def get_forced_stages(args):
+    if args.force is None:
+        return []
+    return args.force or PIPELINE_STAGES
+
+
+def main_batch(args):
+    """
+    Process all files and folders given in the arguments concurrently.
+    """
+    file_paths = collect_source_files(args.file_path, args.src_language, exclude_dir=args.output_dir)
+    for file_path in file_paths:
+        error = validate_source_file(file_path, args.src_language)
+        if error:
+            logger.error(error)
+            sys.exit(1)
+    if not file_paths:
+        logger.error(f"No {args.src_language} files found in {', '.join(args.file_path)}")
+        sys.exit(1)
+
+    output_dir = os.path.abspath(args.output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    configure_metrics(args.metrics_file or os.path.join(output_dir, "metrics.jsonl"))
+    # Workers archive LLM transcripts next to the workspaces
+    os.environ.setdefault('SORCESTONE_TRANSCRIPT_DIR', os.path.join(output_dir, "transcripts"))
+
+    symbol_index = os.path.abspath(args.symbol_index) if args.symbol_index else None
+    if symbol_index:
+        # Every file has to be in the index before any of them is translated
+        index_sources(file_paths, args.src_language, symbol_index, cpp_args=args.build_args)
+
+    logger.info(f"========Processing {len(file_paths)} files  ===========")
+    results = process_batch(
+        file_paths=file_paths,
+        from_language=args.src_language,
+        to_language=args.dst_language,
+        output_dir=output_dir,
+        jobs=args.jobs,
+        cpp_args=args.build_args,
+        ast_format=args.ast_format,
+        chunked=args.chunked,
+        llm_cache=not args.no_llm_cache,
+        ast_view=args.ast_view,
+        policy=get_iteration_policy(args, batch=True),
+        perf_threshold=args.perf_threshold,
+        force=get_forced_stages(args),
+        incremental=args.incremental,
+        symbol_index=symbol_index,
+        fuzz_cases=args.fuzz_cases,
+        fuzz_seed=args.fuzz_seed
+    )
+    if args.metrics_textfile:
+        metrics = merge_metrics(result["metrics"] for result in results)
+        write_atomic(args.metrics_textfile, to_openmetrics(metrics, run_id=get_run_id()))
+    if any(result["status"] != "done" for result in results):
+        sys.exit(1)
+    return results
+
+
 def main():
     """
     Main function to process a single file.
@@ -178,43 +805,52 @@ def main():
     # Parse arguments
     args = parse_arguments()
 
+    if len(args.file_path) > 1 or os.path.isdir(args.file_path[0]):
+        return main_batch(args)
+    file_path = args.file_path[0]
+
     try:
-        # Ensure the file exists
-        if not os.path.isfile(args.file_path):
-            logger.error(f"File not found: {args.file_path}")
-            sys.exit(1)
-            
-        # Check if file extension matches source language
-        file_ext = os.path.splitext(args.file_path)[1].lower()
-        language_extensions = get_language_extensions()
-        valid_extensions = [ext.lower() for ext in language_extensions.get(args.src_language, [])]
-        
-        if not valid_extensions:
-            logger.error(f"No known file extensions for language '{args.src_language}'")
-            sys.exit(1)
-            
-        if file_ext not in valid_extensions:
-            logger.error(f"File extension '{file_ext}' is not valid for {args.src_language}. Expected: {', '.join(valid_extensions)}")
+        error = validate_source_file(file_path, args.src_language)
+        if error:
+            logger.error(error)
             sys.exit(1)
             
         # Log the processing of the file
-        logger.info(f"========Processing {args.file_path}  ===========")
-        
+        logger.info(f"========Processing {file_path}  ===========")
+        configure_metrics(args.metrics_file)
+
         # Process the file
-        rust_file = process_file(
-            file_path=os.path.abspath(args.file_path), 
-            from_language=args.src_language,
-            to_language=args.dst_language,
-            cpp_args=args.build_args)
+        with file_context(file_path):
+            rust_file = process_file(
+                file_path=os.path.abspath(file_path),
+                from_language=args.src_language,
+                to_language=args.dst_language,
+                cpp_args=args.build_args,
+                ast_format=args.ast_format,
+                chunked=args.chunked,
+                llm_cache=not args.no_llm_cache,
+                ast_view=args.ast_view,
+                policy=get_iteration_policy(args),
+                perf_threshold=args.perf_threshold,
+                force=get_forced_stages(args),
+                incremental=args.incremental,
+                symbol_index=os.path.abspath(args.symbol_index) if args.symbol_index else None,
+                fuzz_cases=args.fuzz_cases,
+                fuzz_seed=args.fuzz_seed)
+
+        metrics = get_file_metrics(file_path)
+        log_metrics(metrics)
+        if args.metrics_textfile:
+            write_atomic(args.metrics_textfile, to_openmetrics(metrics, run_id=get_run_id(), file=file_path))
 
         # Log completion
-        logger.info(f"========Done processing {args.file_path}  ===========")
+        logger.info(f"========Done processing {file_path}  ===========")
 
         # Return the path of the generated Rust file
         return rust_file
 
     except Exception as e:
-        logger.error(f"Error processing file {args.file_path}: {e}")
+        logger.error(f"Error processing file {file_path}: {e}")
         sys.exit(1)
 
 
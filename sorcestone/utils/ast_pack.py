@@ -0,0 +1,160 @@
+import json
+import mmap
+import struct
+
+
+# Binary layout is described in language_tools/C/toolbox/ast_pack.py (writer)
+MAGIC = b'SSASTPK2'
+HEADER = struct.Struct('<8sIIQQ')
+INDEX_ENTRY = struct.Struct('<IQQ')
+
+TAG_NULL, TAG_STR, TAG_LIST, TAG_NODE, TAG_TRUE, TAG_FALSE, TAG_INT = range(7)
+
+
+def is_ast_pack(file_path: str) -> bool:
+    """
+    Check if the file is stored in the compact binary AST format.
+    """
+    with open(file_path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class AstPack(object):
+    """
+    Reader of the compact binary AST.
+
+    File is memory mapped and strings are decoded on first use. Decoded
+    nodes have the same dict shape as the JSON AST.
+    """
+
+    def __init__(self, file_path):
+        self._file = open(file_path, 'rb')
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n_strings, n_entries, strings_offset, index_offset = HEADER.unpack_from(self._data, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{file_path} is not a binary AST file")
+
+        self._string_offsets = struct.unpack_from(f'<{n_strings + 1}I', self._data, strings_offset)
+        self._strings_blob = strings_offset + 4 * (n_strings + 1)
+        self._strings = {}
+        self._index = [
+            INDEX_ENTRY.unpack_from(self._data, index_offset + i * INDEX_ENTRY.size)
+            for i in range(n_entries)
+        ]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self._index)
+
+    def close(self):
+        self._data.close()
+        self._file.close()
+
+    def string(self, sid):
+        value = self._strings.get(sid)
+        if value is None:
+            start = self._strings_blob + self._string_offsets[sid]
+            end = self._strings_blob + self._string_offsets[sid + 1]
+            value = self._strings[sid] = self._data[start:end].decode()
+        return value
+
+    def to_dict(self):
+        """
+        Decode the whole translation unit.
+        """
+        return {
+            '_nodetype': 'FileAST',
+            'coord': None,
+            'ext': [self._decode(offset) for _, offset, _ in self._index] or None
+        }
+
+    def _read_varint(self, offset):
+        data = self._data
+        result = 0
+        shift = 0
+        while True:
+            byte = data[offset]
+            offset += 1
+            result |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return result, offset
+            shift += 7
+
+    def _decode(self, offset):
+        """ Decode single value without recursion """
+        read_varint = self._read_varint
+        data = self._data
+        root = []
+        # Each frame is [container, remaining items, is_object]
+        stack = [[root, 1, False]]
+        while stack:
+            frame = stack[-1]
+            container, remaining, is_object = frame
+            if not remaining:
+                stack.pop()
+                continue
+            frame[1] -= 1
+
+            if is_object:
+                key_sid, offset = read_varint(offset)
+                key = self.string(key_sid)
+
+            tag = data[offset]
+            offset += 1
+            child_frame = None
+            if tag == TAG_NULL:
+                value = None
+            elif tag == TAG_STR:
+                sid, offset = read_varint(offset)
+                value = self.string(sid)
+            elif tag == TAG_LIST:
+                count, offset = read_varint(offset)
+                value = []
+                child_frame = [value, count, False]
+            elif tag == TAG_NODE:
+                type_sid, offset = read_varint(offset)
+                file_id, offset = read_varint(offset)
+                line, offset = read_varint(offset)
+                column, offset = read_varint(offset)
+                count, offset = read_varint(offset)
+                coord = None
+                if file_id:
+                    coord = f"{self.string(file_id - 1)}:{line}"
+                    if column:
+                        coord += f":{column}"
+                value = {'_nodetype': self.string(type_sid), 'coord': coord}
+                child_frame = [value, count, True]
+            elif tag == TAG_TRUE:
+                value = True
+            elif tag == TAG_FALSE:
+                value = False
+            elif tag == TAG_INT:
+                raw, offset = read_varint(offset)
+                value = (raw >> 1) ^ -(raw & 1)
+            else:
+                raise ValueError(f"Unknown tag {tag} at offset {offset - 1}")
+
+            if is_object:
+                container[key] = value
+            else:
+                container.append(value)
+            if child_frame:
+                stack.append(child_frame)
+
+        return root[0]
+
+
+def load_ast(file_path: str) -> dict:
+    """
+    Load AST in dict representation from JSON or binary AST file.
+    """
+    if is_ast_pack(file_path):
+        with AstPack(file_path) as pack:
+            return pack.to_dict()
+    with open(file_path, 'r') as f:
+        return json.load(f)
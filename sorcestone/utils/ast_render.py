@@ -0,0 +1,324 @@
+import re
+import json
+from functools import partial
+
+from sorcestone.utils.logger import logger
+from sorcestone.utils.tokens import estimate_tokens
+
+try:
+    from pycparser import c_ast, c_generator, c_parser
+except ImportError:
+    # pycparser comes with cffi, without it the C view is not available
+    c_ast = None
+
+
+AST_VIEWS = ['json', 'sexp', 'c']
+
+AST_VIEW_DESCRIPTIONS = {
+    'json': "JSON, node type is stored in the _nodetype key",
+    'sexp': "S-expressions: (NodeType field=value ...), lists are enclosed in square brackets",
+    'c': "C source code regenerated from the AST",
+}
+
+# Child lists which are written as null when empty, but must be lists for
+# the C generator. Struct.decls is not here, None means forward declaration.
+LIST_FIELDS = {
+    ('FileAST', 'ext'),
+    ('Case', 'stmts'),
+    ('Default', 'stmts'),
+    ('ExprList', 'exprs'),
+    ('InitList', 'exprs'),
+    ('DeclList', 'decls'),
+    ('EnumeratorList', 'enumerators'),
+    ('ParamList', 'params'),
+}
+
+C_BASIC_TYPES = {
+    'void', 'char', 'short', 'int', 'long', 'float', 'double',
+    'signed', 'unsigned', '_Bool', '_Complex',
+}
+
+RE_BARE = re.compile(r'^[A-Za-z_]\w*$')
+RE_SEXP_TOKEN = re.compile(r'"(?:[^"\\]|\\.)*"|[()\[\]]|\w+=|[^\s()\[\]"]+')
+
+
+def get_top_level_nodes(ast):
+    """
+    Args:
+        ast (dict | list): FileAST node or list of top level nodes
+
+    Returns:
+        list: top level nodes
+    """
+    if isinstance(ast, dict):
+        return ast.get('ext') or []
+    return list(ast)
+
+
+def compact(value):
+    """
+    Copy of AST (dict representation) without coords, nulls and empty lists.
+    """
+    result = []
+    stack = [(value, result.append)]
+    while stack:
+        value, store = stack.pop()
+        if isinstance(value, dict):
+            item = {}
+            store(item)
+            for key, child in value.items():
+                if key == 'coord' or child is None or child == []:
+                    continue
+                stack.append((child, partial(item.__setitem__, key)))
+        elif isinstance(value, list):
+            items = [None] * len(value)
+            store(items)
+            for position, child in enumerate(value):
+                stack.append((child, partial(items.__setitem__, position)))
+        else:
+            store(value)
+    return result[0]
+
+
+def render_json(nodes):
+    return json.dumps(compact(nodes), separators=(',', ':'))
+
+
+def load_json(text):
+    return json.loads(text)
+
+
+def _sexp_atom(value):
+    if isinstance(value, str) and RE_BARE.match(value) and value not in ('true', 'false', 'null'):
+        return value
+    return json.dumps(value)
+
+
+def render_sexp(nodes):
+    """
+    Render AST as S-expressions, e.g. (ID name=x). Fields with null or
+    empty values are omitted.
+    """
+    parts = []
+    # Stack holds values to write and closing brackets
+    stack = [compact(nodes)]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, tuple):
+            parts.append(item[0])
+        elif isinstance(item, dict):
+            parts.append(f"({item['_nodetype']}")
+            stack.append((")",))
+            for key in reversed([key for key in item if key != '_nodetype']):
+                stack.append(item[key])
+                stack.append((f" {key}=",))
+        elif isinstance(item, list):
+            parts.append("[")
+            stack.append(("]",))
+            for position in reversed(range(len(item))):
+                stack.append(item[position])
+                if position:
+                    stack.append((" ",))
+        else:
+            parts.append(_sexp_atom(item))
+    return "".join(parts)
+
+
+def load_sexp(text):
+    """
+    Parse render_sexp output back into the compact dict representation.
+    """
+    result = []
+    # Each frame is [container, pending field name]
+    stack = [[result, None]]
+    for token in RE_SEXP_TOKEN.findall(text):
+        frame = stack[-1]
+        container, key = frame
+        if token in (')', ']'):
+            stack.pop()
+            continue
+        if token.endswith('=') and not token.startswith('"'):
+            frame[1] = token[:-1]
+            continue
+        if isinstance(container, dict) and '_nodetype' not in container:
+            # Node type directly follows the opening bracket
+            container['_nodetype'] = token
+            continue
+
+        child_frame = None
+        if token == '(':
+            value = {}
+            child_frame = [value, None]
+        elif token == '[':
+            value = []
+            child_frame = [value, None]
+        elif RE_BARE.match(token) and token not in ('true', 'false', 'null'):
+            value = token
+        else:
+            value = json.loads(token)
+
+        if isinstance(container, dict):
+            container[key] = value
+            frame[1] = None
+        else:
+            container.append(value)
+        if child_frame:
+            stack.append(child_frame)
+    return result[0]
+
+
+def to_pycparser(value):
+    """
+    Convert AST dict representation into pycparser nodes, coords are dropped.
+    """
+    result = []
+    stack = [(value, result.append)]
+    while stack:
+        value, store = stack.pop()
+        if isinstance(value, dict):
+            klass = getattr(c_ast, value['_nodetype'])
+            node = klass.__new__(klass)
+            node.coord = None
+            store(node)
+            for key in klass.__slots__:
+                if key in ('coord', '__weakref__'):
+                    continue
+                child = value.get(key)
+                if child is None and (value['_nodetype'], key) in LIST_FIELDS:
+                    child = []
+                stack.append((child, partial(setattr, node, key)))
+        elif isinstance(value, list):
+            items = [None] * len(value)
+            store(items)
+            for position, child in enumerate(value):
+                stack.append((child, partial(items.__setitem__, position)))
+        else:
+            store(value)
+    return result[0]
+
+
+def from_pycparser(node):
+    """
+    Convert pycparser nodes into AST dict representation without coords.
+    """
+    result = []
+    stack = [(node, result.append)]
+    while stack:
+        value, store = stack.pop()
+        if isinstance(value, c_ast.Node):
+            item = {'_nodetype': value.__class__.__name__}
+            store(item)
+            for key in value.__slots__:
+                if key in ('coord', '__weakref__'):
+                    continue
+                stack.append((getattr(value, key), partial(item.__setitem__, key)))
+        elif isinstance(value, list):
+            items = [None] * len(value)
+            store(items)
+            for position, child in enumerate(value):
+                stack.append((child, partial(items.__setitem__, position)))
+        else:
+            store(value)
+    return result[0]
+
+
+def get_undefined_type_names(nodes):
+    """
+    Get typedef names used by the nodes but defined elsewhere, e.g. in the
+    shared declarations of a chunked translation.
+    """
+    used = set()
+    defined = set()
+    stack = list(nodes)
+    while stack:
+        item = stack.pop()
+        if isinstance(item, dict):
+            if item.get('_nodetype') == 'IdentifierType':
+                used.update(name for name in item.get('names') or [] if name not in C_BASIC_TYPES)
+            elif item.get('_nodetype') == 'Typedef':
+                defined.add(item['name'])
+            stack.extend(item.values())
+        elif isinstance(item, list):
+            stack.extend(item)
+    return sorted(used - defined)
+
+
+def render_c(nodes):
+    return c_generator.CGenerator().visit(c_ast.FileAST(to_pycparser(nodes)))
+
+
+def load_c(text, type_names=()):
+    """
+    Parse regenerated C back into the dict representation. Typedef names
+    defined elsewhere are declared as int, so the parser accepts them.
+    """
+    stubs = "".join(f"typedef int {name};\n" for name in type_names)
+    ast = c_parser.CParser().parse(stubs + text)
+    return from_pycparser(ast.ext[len(type_names):])
+
+
+def render_view(nodes, view):
+    """
+    Render top level nodes in the given view.
+
+    Returns:
+        dict: view name, text, token count and whether the text parses back
+            into the same AST (coords aside). Text is None if the view could
+            not be rendered.
+    """
+    if view == 'json':
+        render, load = render_json, load_json
+    elif view == 'sexp':
+        render, load = render_sexp, load_sexp
+    elif view == 'c':
+        render, load = render_c, partial(load_c, type_names=get_undefined_type_names(nodes))
+    else:
+        raise ValueError(f"Unknown AST view {view}")
+
+    report = {"view": view, "text": None, "tokens": None, "round_trips": False}
+    if view == 'c' and c_ast is None:
+        return report
+    try:
+        text = render(nodes)
+    except Exception as e:
+        logger.warning(f"AST {view} view failed: {e}")
+        return report
+    report["text"] = text
+    report["tokens"] = estimate_tokens(text)
+
+    try:
+        report["round_trips"] = compact(load(text)) == compact(nodes)
+    except Exception as e:
+        logger.info(f"AST {view} view does not parse back: {e}")
+    return report
+
+
+def render_ast(ast, view="auto"):
+    """
+    Render AST for an LLM prompt.
+
+    Args:
+        ast (dict | list): FileAST node or list of top level nodes
+        view (str): 'json', 'sexp', 'c' or 'auto' to pick the view with the
+            least tokens among the ones which round-trip
+
+    Returns:
+        tuple: (view name, text)
+    """
+    nodes = get_top_level_nodes(ast)
+    views = AST_VIEWS if view == "auto" else [view]
+    reports = [render_view(nodes, name) for name in views]
+    logger.info("AST views (tokens): " + ", ".join(
+        f"{report['view']}={report['tokens']}{'' if report['round_trips'] else ' (lossy)'}"
+        for report in reports if report["text"] is not None
+    ))
+
+    if view != "auto":
+        if reports[0]["text"] is not None:
+            return view, reports[0]["text"]
+        logger.warning(f"AST {view} view is not available, falling back to json")
+        return 'json', render_json(nodes)
+
+    candidates = [report for report in reports if report["text"] is not None and report["round_trips"]]
+    best = min(candidates, key=lambda report: report["tokens"])
+    return best["view"], best["text"]
@@ -0,0 +1,237 @@
+import re
+
+
+RE_COORD = re.compile(r'^(.*?):\d+(?::\d+)?$')
+
+
+def iter_nodes(node):
+    """
+    Iterate over AST node (dict representation) and all of its descendants
+    without recursion.
+
+    Args:
+        node (dict): AST node with '_nodetype' key
+
+    Yields:
+        dict: nodes in depth first order
+    """
+    stack = [node]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, dict):
+            if '_nodetype' in item:
+                yield item
+            stack.extend(reversed(list(item.values())))
+        elif isinstance(item, list):
+            stack.extend(reversed(item))
+
+
+def get_decl_name(ext):
+    """
+    Get name of a top level declaration.
+
+    Args:
+        ext (dict): Top level AST node (FuncDef, Decl, Typedef, ...)
+
+    Returns:
+        str: Declaration name, None for anonymous declarations
+    """
+    if ext['_nodetype'] == 'FuncDef':
+        return ext['decl']['name']
+    name = ext.get('name')
+    if name is None and ext['_nodetype'] == 'Decl':
+        decl_type = ext.get('type') or {}
+        if decl_type.get('_nodetype') in ('Struct', 'Union', 'Enum') and decl_type.get('name'):
+            name = f"{decl_type['_nodetype'].lower()} {decl_type['name']}"
+    return name
+
+
+def get_coord_file(node):
+    """
+    Get source file name of the node, e.g. 'src/a.c' for coord 'src/a.c:12:5'.
+    """
+    match = RE_COORD.match(node.get('coord') or "")
+    return match.group(1) if match else None
+
+
+def get_called_functions(node):
+    """
+    Get names of functions called directly from the node.
+    """
+    names = set()
+    for item in iter_nodes(node):
+        if item['_nodetype'] == 'FuncCall' and (item.get('name') or {}).get('_nodetype') == 'ID':
+            names.add(item['name']['name'])
+    return names
+
+
+def split_units(ast):
+    """
+    Split translation unit into shared declarations and function definitions.
+
+    Args:
+        ast (dict): FileAST node
+
+    Returns:
+        tuple: (prelude, functions)
+        - prelude: list of top level nodes which are not function definitions
+          (types, globals, prototypes)
+        - functions: dict of function name to FuncDef node, in source order
+    """
+    prelude = []
+    functions = {}
+    for ext in ast.get('ext') or []:
+        if ext['_nodetype'] == 'FuncDef':
+            functions[get_decl_name(ext)] = ext
+        else:
+            prelude.append(ext)
+    return prelude, functions
+
+
+def get_call_graph(functions):
+    """
+    Get call graph between the given functions.
+
+    Args:
+        functions (dict): function name to FuncDef node
+
+    Returns:
+        dict: function name to set of called function names, limited to
+            functions from the same dict
+    """
+    return {
+        name: (get_called_functions(func) & functions.keys()) - {name}
+        for name, func in functions.items()
+    }
+
+
+def get_strong_components(graph):
+    """
+    Get strongly connected components of a directed graph (Kosaraju).
+
+    Args:
+        graph (dict): node to set of successor nodes
+
+    Returns:
+        list: components, each is a list of nodes
+    """
+    order = []
+    visited = set()
+    for start in graph:
+        if start in visited:
+            continue
+        visited.add(start)
+        stack = [(start, iter(graph[start]))]
+        while stack:
+            node, successors = stack[-1]
+            for successor in successors:
+                if successor not in visited:
+                    visited.add(successor)
+                    stack.append((successor, iter(graph[successor])))
+                    break
+            else:
+                stack.pop()
+                order.append(node)
+
+    reverse = {node: set() for node in graph}
+    for node, successors in graph.items():
+        for successor in successors:
+            reverse[successor].add(node)
+
+    components = []
+    assigned = set()
+    for start in reversed(order):
+        if start in assigned:
+            continue
+        component = []
+        assigned.add(start)
+        stack = [start]
+        while stack:
+            node = stack.pop()
+            component.append(node)
+            for predecessor in reverse[node]:
+                if predecessor not in assigned:
+                    assigned.add(predecessor)
+                    stack.append(predecessor)
+        components.append(component)
+    return components
+
+
+def get_dependency_levels(call_graph):
+    """
+    Order functions so that callees come before callers.
+
+    Args:
+        call_graph (dict): function name to set of callee names
+
+    Returns:
+        list: levels, each level is a list of units and each unit is a list of
+            function names. Units of the same level do not depend on each
+            other. Mutually recursive functions end up in a single unit.
+    """
+    unit_of = {}
+    units = get_strong_components(call_graph)
+    for position, unit in enumerate(units):
+        for name in unit:
+            unit_of[name] = position
+
+    remaining = {
+        position: set(unit_of[callee] for name in unit for callee in call_graph[name]) - {position}
+        for position, unit in enumerate(units)
+    }
+    levels = []
+    while remaining:
+        ready = sorted(position for position, deps in remaining.items() if not deps)
+        levels.append([units[position] for position in ready])
+        for position in ready:
+            del remaining[position]
+        for deps in remaining.values():
+            deps.difference_update(ready)
+    return levels
+
+
+def get_referenced_names(node):
+    """
+    Get names of top level declarations the node may refer to: called
+    functions, identifiers, typedef names and struct, union or enum tags
+    (named like get_decl_name does, e.g. 'struct point').
+    """
+    names = set()
+    for item in iter_nodes(node):
+        nodetype = item['_nodetype']
+        if nodetype == 'ID':
+            names.add(item['name'])
+        elif nodetype == 'IdentifierType':
+            names.update(item.get('names') or [])
+        elif nodetype in ('Struct', 'Union', 'Enum') and item.get('name'):
+            names.add(f"{nodetype.lower()} {item['name']}")
+    return names
+
+
+def get_dependents(decls, changed):
+    """
+    Get declarations which depend on the changed ones, directly or through
+    other declarations, e.g. callers of a changed function or functions
+    using a changed type.
+
+    Args:
+        decls (dict): declaration name to top level node
+        changed (set): changed declaration names, may include removed ones
+
+    Returns:
+        set: dependent declaration names, without the changed ones
+    """
+    users = {}
+    for name, node in decls.items():
+        for referenced in get_referenced_names(node) - {name}:
+            users.setdefault(referenced, set()).add(name)
+
+    dependents = set()
+    stack = list(changed)
+    while stack:
+        name = stack.pop()
+        for user in users.get(name, ()):
+            if user not in dependents and user not in changed:
+                dependents.add(user)
+                stack.append(user)
+    return dependents
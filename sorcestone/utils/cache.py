@@ -0,0 +1,133 @@
+import os
+import hashlib
+import threading
+
+from sorcestone.utils.file_utils import copy_atomic
+
+
+DEFAULT_MAX_SIZE = 2 * 1024 ** 3
+
+
+def get_cache_dir(name: str) -> str:
+    """
+    Get the folder for a named cache.
+
+    Args:
+        name (str): Cache name, e.g. 'artifacts'
+
+    Returns:
+        str: Path to the cache folder. Base folder can be overridden with
+            SORCESTONE_CACHE_DIR environment variable.
+    """
+    base_dir = os.environ.get(
+        'SORCESTONE_CACHE_DIR',
+        os.path.join(os.path.dirname(__file__), '../../.cache')
+    )
+    cache_dir = os.path.normpath(os.path.join(base_dir, name))
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def hash_key(*parts) -> str:
+    """
+    Build a content address out of several key parts.
+
+    Args:
+        *parts: str or bytes values, order matters
+
+    Returns:
+        str: sha256 hex digest
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode()
+        # Length prefix keeps ('ab', 'c') and ('a', 'bc') apart
+        digest.update(str(len(part)).encode() + b':')
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def hash_file(file_path: str) -> str:
+    """
+    Get sha256 hex digest of the file content.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FileCache(object):
+    """
+    Content addressed on-disk store of files.
+
+    Entries are sharded by the first two characters of the key. Every hit
+    refreshes entry mtime, so eviction drops least recently used entries
+    first once the total size goes above max_size.
+    """
+
+    def __init__(self, name, max_size=DEFAULT_MAX_SIZE):
+        self.cache_dir = get_cache_dir(name)
+        self.max_size = max_size
+        self._lock = threading.Lock()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def contains(self, key):
+        return os.path.exists(self._entry_path(key))
+
+    def get(self, key, dst_path):
+        """
+        Copy cached entry to dst_path.
+
+        Returns:
+            bool: True on cache hit, False otherwise
+        """
+        entry_path = self._entry_path(key)
+        try:
+            os.utime(entry_path)
+            copy_atomic(entry_path, dst_path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def put(self, key, src_path):
+        """
+        Store a copy of src_path under the key and evict old entries if needed.
+        """
+        entry_path = self._entry_path(key)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        copy_atomic(src_path, entry_path)
+        self.evict()
+
+    def evict(self):
+        """
+        Remove least recently used entries until cache fits into max_size.
+        """
+        with self._lock:
+            entries = []
+            total_size = 0
+            for root, _, files in os.walk(self.cache_dir):
+                for file_name in files:
+                    if file_name.startswith('.tmp-'):
+                        continue
+                    path = os.path.join(root, file_name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+                    total_size += stat.st_size
+
+            entries.sort()
+            for _, size, path in entries:
+                if total_size <= self.max_size:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total_size -= size
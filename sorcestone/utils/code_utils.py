@@ -1,3 +1,24 @@
+import re
+
+
+RE_RUST_ITEM_START = re.compile(
+    r'(?:pub(?:\([^)]*\))?\s+)?(?:(?:const|async|unsafe|extern\s+"[^"]*")\s+)*'
+    r'(?:(?P<kind>fn|struct|enum|union|type|const|static|trait|mod)\s+(?:mut\s+)?(?P<name>\w+)|(?P<impl>impl)\b)'
+)
+RE_RUST_CHAR = re.compile(r"'(?:\\[^']{1,10}|[^\\'])'")
+RE_RUST_RAW_STRING = re.compile(r'b?r(#*)"')
+
+
+def get_impl_key(code, match):
+    """
+    Get "impl <Type>" of an impl block matched by RE_RUST_ITEM_START.
+    """
+    # impl [<T>] [Trait for] Type [<T>] [where ...] {
+    header = re.split(r'\bwhere\b', code[match.end():code.find('{', match.end())])[0]
+    names = re.findall(r'\w+', re.sub(r'<[^<>]*>', '', header))
+    return f"impl {names[-1]}" if names else "impl"
+
+
 def extract_code(text: str, language: str) -> str:
     """
     Extract code from a text that may contain markdown-style code blocks.
@@ -23,3 +44,175 @@ def extract_code(text: str, language: str) -> str:
     
     # If no code block markers found, return original text
     return text
+
+
+def get_code_events(code):
+    """
+    Find braces and semicolons of Rust code outside comments, strings and
+    char literals.
+
+    Returns:
+        list: (position, character) tuples
+    """
+    events = []
+    position = 0
+    length = len(code)
+    while position < length:
+        char = code[position]
+        if code.startswith('//', position):
+            position = code.find('\n', position)
+            if position < 0:
+                break
+        elif code.startswith('/*', position):
+            end = code.find('*/', position + 2)
+            position = length if end < 0 else end + 2
+        elif char == '"':
+            position += 1
+            while position < length and code[position] != '"':
+                position += 2 if code[position] == '\\' else 1
+            position += 1
+        elif char in 'br' and not (position and (code[position - 1].isalnum() or code[position - 1] == '_')) \
+                and RE_RUST_RAW_STRING.match(code, position):
+            match = RE_RUST_RAW_STRING.match(code, position)
+            end = code.find('"' + match.group(1), match.end())
+            position = length if end < 0 else end + 1 + len(match.group(1))
+        elif char == "'":
+            # Char literal, otherwise a lifetime
+            match = RE_RUST_CHAR.match(code, position)
+            position = match.end() if match else position + 1
+        else:
+            if char in '{};':
+                events.append((position, char))
+            position += 1
+    return events
+
+
+def get_rust_items(code):
+    """
+    Find top level items of Rust code with their attributes and doc comments.
+
+    Returns:
+        list: dicts with key ('impl Name' for impl blocks, item name
+            otherwise), start and end offsets in code
+    """
+    events = get_code_events(code)
+    # Brace depth at every line start tells which lines are top level
+    line_starts = [0] + [match.end() for match in re.finditer('\n', code)]
+    depth = 0
+    event_index = 0
+    top_level = []
+    for line_start in line_starts:
+        while event_index < len(events) and events[event_index][0] < line_start:
+            char = events[event_index][1]
+            depth += {'{': 1, '}': -1}.get(char, 0)
+            event_index += 1
+        if depth == 0:
+            top_level.append(line_start)
+
+    items = []
+    covered = 0
+    for line_number, line_start in enumerate(top_level):
+        if line_start < covered:
+            continue
+        match = RE_RUST_ITEM_START.match(code, line_start)
+        if not match:
+            continue
+        end = _get_item_end(code, events, match.end())
+        if match.group('impl'):
+            key = get_impl_key(code, match)
+        else:
+            key = match.group('name')
+
+        # Attributes and doc comments right above belong to the item
+        start = line_start
+        previous = line_number - 1
+        while previous >= 0 and top_level[previous] >= covered:
+            line = code[top_level[previous]:start].strip()
+            if not line.startswith(('#[', '///')) or '\n' in line:
+                break
+            start = top_level[previous]
+            previous -= 1
+        items.append({"key": key, "start": start, "end": end})
+        covered = end
+    return items
+
+
+def _get_item_end(code, events, position):
+    depth = 0
+    for event_position, char in events:
+        if event_position < position:
+            continue
+        if char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                position = event_position + 1
+                break
+        elif depth == 0:
+            position = event_position + 1
+            break
+    else:
+        position = len(code)
+    line_end = code.find('\n', position)
+    return len(code) if line_end < 0 else line_end + 1
+
+
+def splice_items(code, fragments, removed=()):
+    """
+    Put items of the fragments into the code in place of the items with the
+    same name. New items are appended, removed ones are dropped. Imports
+    and crate attributes of the fragments are added to the top.
+
+    Args:
+        code (str): Rust code
+        fragments ([str]): Rust code fragments
+        removed ([str]): Names of items to remove, unless a fragment
+            provides a new version
+
+    Returns:
+        str: spliced code
+    """
+    replacements = {}
+    header = []
+    for fragment in fragments:
+        for line in fragment.splitlines():
+            if line.startswith(('use ', '#![')) and line not in code.splitlines() and line not in header:
+                header.append(line)
+        for item in get_rust_items(fragment):
+            replacements[item["key"]] = fragment[item["start"]:item["end"]].rstrip() + "\n"
+
+    parts = []
+    position = 0
+    spliced = set()
+    for item in get_rust_items(code):
+        parts.append(code[position:item["start"]])
+        position = item["end"]
+        if item["key"] in replacements:
+            if item["key"] not in spliced:
+                parts.append(replacements[item["key"]])
+                spliced.add(item["key"])
+        elif item["key"] not in removed:
+            parts.append(code[item["start"]:item["end"]])
+    parts.append(code[position:])
+    result = "".join(parts).rstrip() + "\n"
+
+    for key, text in replacements.items():
+        if key not in spliced:
+            result += "\n" + text
+    if header:
+        result = stitch_header(header, result)
+    # Collapse blank lines left by removed items
+    return re.sub(r'\n{3,}', '\n\n', result)
+
+
+def stitch_header(header, code):
+    crate_attributes = [line for line in header if line.startswith('#![')]
+    imports = [line for line in header if not line.startswith('#![')]
+    lines = code.splitlines(keepends=True)
+    # Crate attributes go before everything else, imports after them
+    insert_at = 0
+    while insert_at < len(lines) and lines[insert_at].startswith('#!['):
+        insert_at += 1
+    lines[insert_at:insert_at] = [line + "\n" for line in imports]
+    return "".join([line + "\n" for line in crate_attributes] + lines)
@@ -0,0 +1,252 @@
+import re
+import json
+
+from sorcestone.utils.code_utils import RE_RUST_ITEM_START, get_impl_key
+
+
+# Only this many diagnostics or test failures go into the next prompt
+MAX_DIAGNOSTICS = 10
+
+MAX_MESSAGE_CHARS = 300
+
+# Raw output is only fed back when it could not be parsed, and only its end
+OUTPUT_TAIL_LINES = 30
+
+RE_GCC_DIAGNOSTIC = re.compile(
+    r'^(?P<file>[^:\n]+):(?P<line>\d+):(?P<column>\d+): (?P<level>fatal error|error|warning): (?P<message>.*)$',
+    re.MULTILINE
+)
+
+RE_LINE_INDENT = re.compile(r'^[ \t]*', re.MULTILINE)
+
+RE_TRACEBACK_FRAME = re.compile(r'^\s*File "[^"]+", line (?P<line>\d+), in (?P<name>\S+)\n(?P<code>[^\n]*)',
+                                re.MULTILINE)
+
+
+def trim(text, limit=MAX_MESSAGE_CHARS):
+    text = text.strip()
+    if len(text) > limit:
+        return text[:limit - 3] + "..."
+    return text
+
+
+def get_output_tail(output, lines=OUTPUT_TAIL_LINES):
+    output_lines = output.strip().splitlines()
+    if len(output_lines) > lines:
+        return "\n".join(["..."] + output_lines[-lines:])
+    return "\n".join(output_lines)
+
+
+def get_items(source):
+    """
+    Find top level and impl items of Rust source.
+
+    Returns:
+        list: (line, item description) tuples sorted by line, lines start at 1
+    """
+    items = []
+    source = source or ""
+    for indent in RE_LINE_INDENT.finditer(source):
+        match = RE_RUST_ITEM_START.match(source, indent.end())
+        if not match:
+            continue
+        line = source.count("\n", 0, match.start()) + 1
+        if match.group('impl'):
+            items.append((line, get_impl_key(source, match)))
+        else:
+            items.append((line, f"{match.group('kind')} {match.group('name')}"))
+    return items
+
+
+def find_item(items, line):
+    """
+    Get the item declared closest above the line, None if there is none.
+    """
+    found = None
+    for item_line, item in items:
+        if item_line > line:
+            break
+        found = item
+    return found
+
+
+def parse_cargo_messages(output, source=None):
+    """
+    Parse errors out of cargo --message-format=json output.
+
+    Args:
+        output (str): cargo stdout, other lines are ignored
+        source (str): Compiled source, used to map errors to items
+
+    Returns:
+        list: diagnostic dicts with level, code, message, line, column,
+            item, snippet, label and notes
+    """
+    items = get_items(source)
+    diagnostics = []
+    for line in output.splitlines():
+        if not line.startswith("{"):
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError:
+            continue
+        message = data.get("message")
+        if data.get("reason") != "compiler-message" or not message or message.get("level") != "error":
+            continue
+        spans = message.get("spans") or []
+        primary = next((span for span in spans if span.get("is_primary")), None)
+        if primary is None:
+            # Summaries like "aborting due to 3 previous errors"
+            continue
+
+        notes = []
+        for child in message.get("children") or []:
+            replacements = [span["suggested_replacement"] for span in child.get("spans") or []
+                            if span.get("suggested_replacement") is not None]
+            note = f"{child['level']}: {child['message']}"
+            if replacements:
+                note += f" ({', '.join(repr(text) for text in replacements)})"
+            notes.append(trim(note))
+
+        text = primary.get("text") or []
+        diagnostics.append({
+            "level": "error",
+            "code": (message.get("code") or {}).get("code"),
+            "message": trim(message["message"]),
+            "line": primary["line_start"],
+            "column": primary["column_start"],
+            "item": find_item(items, primary["line_start"]),
+            "snippet": trim(text[0]["text"]) if text else None,
+            "label": primary.get("label"),
+            "notes": notes,
+        })
+    return diagnostics
+
+
+def parse_gcc_messages(output, source=None):
+    """
+    Parse errors of gcc like compilers, file:line:column: error: message.
+
+    Returns:
+        list: diagnostic dicts, same as parse_cargo_messages
+    """
+    source_lines = (source or "").splitlines()
+    diagnostics = []
+    for match in RE_GCC_DIAGNOSTIC.finditer(output):
+        if match.group('level') == "warning":
+            continue
+        line = int(match.group('line'))
+        diagnostics.append({
+            "level": "error",
+            "code": None,
+            "message": trim(match.group('message')),
+            "line": line,
+            "column": int(match.group('column')),
+            "item": None,
+            "snippet": trim(source_lines[line - 1]) if 0 < line <= len(source_lines) else None,
+            "label": None,
+            "notes": [],
+        })
+    return diagnostics
+
+
+def dedupe_diagnostics(diagnostics):
+    """
+    Drop repeated errors, e.g. the same missing name used on one line twice.
+    """
+    seen = set()
+    result = []
+    for diagnostic in diagnostics:
+        key = (diagnostic["code"], diagnostic["message"], diagnostic["line"])
+        if key not in seen:
+            seen.add(key)
+            result.append(diagnostic)
+    return result
+
+
+def parse_compiler_output(stdout, stderr, source=None):
+    """
+    Get deduplicated errors of compile.sh output, cargo JSON messages if
+    there are any, gcc style messages otherwise.
+    """
+    diagnostics = parse_cargo_messages(stdout or "", source)
+    if not diagnostics:
+        diagnostics = parse_gcc_messages(stderr or "", source)
+    return dedupe_diagnostics(diagnostics)
+
+
+def format_diagnostics(diagnostics, max_diagnostics=MAX_DIAGNOSTICS):
+    """
+    Compact description of compiler errors for the LLM.
+    """
+    lines = []
+    for diagnostic in diagnostics[:max_diagnostics]:
+        code = f"[{diagnostic['code']}]" if diagnostic["code"] else ""
+        location = f"line {diagnostic['line']}:{diagnostic['column']}"
+        if diagnostic["item"]:
+            location = f"{diagnostic['item']}, {location}"
+        lines.append(f"{diagnostic['level']}{code} in {location}: {diagnostic['message']}")
+        if diagnostic["snippet"]:
+            snippet = f"    {diagnostic['snippet']}"
+            if diagnostic["label"]:
+                snippet += f"  <- {diagnostic['label']}"
+            lines.append(snippet)
+        lines += [f"    {note}" for note in diagnostic["notes"]]
+    if len(diagnostics) > max_diagnostics:
+        lines.append(f"... and {len(diagnostics) - max_diagnostics} more errors")
+    return "\n".join(lines)
+
+
+def strip_json_messages(output):
+    """
+    Drop cargo JSON messages from the output, keeping it readable in logs.
+    """
+    return "\n".join(line for line in output.splitlines() if not line.startswith("{"))
+
+
+def get_failure_location(traceback_text, function_name=None):
+    """
+    Get the innermost traceback frame of the test function, or the
+    innermost frame if the function does not appear.
+
+    Returns:
+        str: e.g. 'test_add line 12: self.assertEqual(lib.add(1, 2), 3)'
+    """
+    frames = list(RE_TRACEBACK_FRAME.finditer(traceback_text or ""))
+    if function_name:
+        frames = [frame for frame in frames if frame.group('name') == function_name] or frames
+    if not frames:
+        return None
+    frame = frames[-1]
+    return f"{frame.group('name')} line {frame.group('line')}: {frame.group('code').strip()}"
+
+
+def summarize_test_failures(tests, max_failures=MAX_DIAGNOSTICS):
+    """
+    Compact description of failed tests for the LLM. Tests failing with the
+    same error are reported together, with the failing line of the first one.
+
+    Args:
+        tests (list): Per-test dicts of TestResult
+
+    Returns:
+        list: lines
+    """
+    groups = {}
+    for test in tests:
+        if test["status"] == "passed":
+            continue
+        error = trim(test.get("error") or test["status"])
+        groups.setdefault(error, []).append(test)
+
+    lines = []
+    for error, failed in list(groups.items())[:max_failures]:
+        names = ", ".join(test["name"] for test in failed)
+        lines.append(f"FAILED {names}: {error}")
+        location = get_failure_location(failed[0].get("traceback"), failed[0]["name"].split(".")[-1])
+        if location:
+            lines.append(f"    at {trim(location)}")
+    if len(groups) > max_failures:
+        lines.append(f"... and {len(groups) - max_failures} more distinct failures")
+    return lines
@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+
+
+def get_temp_path(dst_path):
+    """
+    Create an empty temporary file next to dst_path, so it can be renamed
+    into dst_path atomically.
+
+    Returns:
+        str: Path to the temporary file
+    """
+    dst_dir = os.path.dirname(os.path.abspath(dst_path))
+    fd, tmp_path = tempfile.mkstemp(dir=dst_dir, prefix='.tmp-')
+    os.close(fd)
+    return tmp_path
+
+
+def _replace(tmp_path, dst_path):
+    try:
+        os.replace(tmp_path, dst_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def write_atomic(dst_path, content):
+    """
+    Write text file so that readers of dst_path never see a partially written file.
+
+    Args:
+        dst_path (str): Path to the file to write
+        content (str): File content
+    """
+    tmp_path = get_temp_path(dst_path)
+    try:
+        with open(tmp_path, 'w') as f:
+            f.write(content)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    _replace(tmp_path, dst_path)
+
+
+def append_line(path, text):
+    """
+    Append a line to a text file with a single write, so processes
+    appending to the same file do not mix their lines.
+
+    Args:
+        path (str): File to append to, created if missing
+        text (str): Line without the trailing newline
+    """
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, (text + "\n").encode())
+    finally:
+        os.close(fd)
+
+
+def copy_atomic(src_path, dst_path):
+    """
+    Copy file so that readers of dst_path never see a partially written file.
+    """
+    tmp_path = get_temp_path(dst_path)
+    try:
+        shutil.copyfile(src_path, tmp_path)
+        shutil.copymode(src_path, tmp_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    _replace(tmp_path, dst_path)
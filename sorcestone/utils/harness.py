@@ -0,0 +1,122 @@
+import os
+import sys
+import atexit
+import threading
+
+from sorcestone.utils.diagnostics import get_output_tail, summarize_test_failures
+from sorcestone.utils.process_utils import JsonLinesClient
+
+
+TEST_SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'harness_server.py')
+
+# Generated tests may loop forever, runs are killed after this many seconds
+DEFAULT_TEST_TIMEOUT = 600
+
+
+class TestResult(object):
+    """
+    Result of a single test file run.
+
+    Args:
+        returncode (int): Test process return code
+        stdout (str): Test output
+        stderr (str): Test errors
+        duration (float): Run time in seconds, None if unknown
+        tests (list): Per-test dicts with name, status ("passed" or
+            "failed"), duration, error and traceback. Empty if the tests
+            were not traced.
+    """
+
+    def __init__(self, returncode, stdout="", stderr="", duration=None, tests=None):
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.duration = duration
+        self.tests = tests or []
+
+    def failed_tests(self):
+        return [test for test in self.tests if test["status"] != "passed"]
+
+    def get_message(self):
+        """
+        Get failure description for the LLM: failed tests grouped by their
+        exceptions with the failing lines. If no traced test explains the
+        failure, e.g. a crash or a script printing mismatches and exiting
+        with an error, the exit code and the end of the test output and
+        errors are added.
+        """
+        lines = []
+        failed = self.failed_tests()
+        if self.tests:
+            lines.append(f"Tests: {len(self.tests) - len(failed)} passed, {len(failed)} failed")
+            lines += summarize_test_failures(self.tests)
+        if not failed:
+            if self.returncode:
+                lines.append(f"Test script exited with code {self.returncode}")
+                if self.stdout.strip():
+                    lines.append(f"Test output:\n{get_output_tail(self.stdout)}")
+            if self.stderr:
+                lines.append(get_output_tail(self.stderr))
+        return "\n".join(lines)
+
+
+class TestRunner(JsonLinesClient):
+    """
+    Client of the long living test server (harness_server.py).
+    """
+
+    name = "Test server"
+
+    def __init__(self):
+        super().__init__([sys.executable, TEST_SERVER_SCRIPT])
+
+    def make_result(self, response):
+        return TestResult(
+            returncode=response['returncode'],
+            stdout=response['stdout'],
+            stderr=response['stderr'],
+            duration=response.get('duration'),
+            tests=response.get('tests')
+        )
+
+    def submit(self, test_file, args=(), timeout=DEFAULT_TEST_TIMEOUT):
+        """
+        Send test run to the server.
+
+        Args:
+            test_file (str): Python test file
+            args ([str]): Test command line arguments
+            timeout (float): Seconds before the run is killed, None to wait forever
+
+        Returns:
+            concurrent.futures.Future: resolves to TestResult
+        """
+        return self.send({
+            'test_file': os.path.abspath(test_file),
+            'args': [str(arg) for arg in args],
+            'timeout': timeout
+        })
+
+
+_test_runner = None
+_test_runner_pid = None
+_test_runner_lock = threading.Lock()
+
+
+def get_test_runner():
+    """
+    Get running test server of this process, batch workers start their own.
+    """
+    global _test_runner, _test_runner_pid
+    with _test_runner_lock:
+        if _test_runner is None or _test_runner_pid != os.getpid() or not _test_runner.is_alive():
+            _test_runner = TestRunner()
+            _test_runner_pid = os.getpid()
+    return _test_runner
+
+
+@atexit.register
+def close_test_runner():
+    with _test_runner_lock:
+        if _test_runner is not None and _test_runner_pid == os.getpid():
+            _test_runner.close()
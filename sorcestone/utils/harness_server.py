@@ -0,0 +1,286 @@
+#------------------------------------------------------------------------------
+# Long living test runner server
+#
+# Keeps an interpreter with ctypes/cffi imported and forks a child for every
+# test run, so the inner repair loop does not pay for bash, interpreter
+# startup and imports. Every run loads the .so in its own child, so a crash
+# or a leaked global in the library never affects the next run.
+#
+# Test functions (names starting with "test") defined in the test file are
+# traced to report per-test status, duration and exception.
+#
+# Protocol: one JSON object per line.
+# Request on stdin:
+#     {"id": 1, "test_file": "...", "args": ["lib.so", "C"], "timeout": 600}
+# Response on stdout:
+#     {"id": 1, "returncode": 0, "stdout": "...", "stderr": "...",
+#      "duration": 0.1, "tests": [{"name": "test_add", "status": "passed",
+#      "duration": 0.01, "error": null, "traceback": null}]}
+# Server exits when stdin is closed.
+#
+# Only the standard library is used here, the server is started as a script.
+#------------------------------------------------------------------------------
+
+import os
+import sys
+import json
+import time
+import runpy
+import signal
+import tempfile
+import importlib
+import selectors
+import traceback
+
+
+# Modules generated tests are expected to use
+PRELOADED_MODULES = [
+    'ctypes', 'ctypes.util', 'cffi', 'argparse', 'unittest',
+    'math', 'random', 'struct', 'subprocess',
+]
+
+# Return code of timed out runs, same as the timeout utility
+TIMEOUT_RETURN_CODE = 124
+
+
+def warm_up():
+    for name in PRELOADED_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            pass
+    try:
+        import cffi
+        # Loads the compiled backend and builds the cdef parser, children
+        # inherit both
+        cffi.FFI().cdef("int sorcestone_warm_up(int);")
+    except Exception:
+        pass
+
+
+class TestTracer(object):
+    """
+    Trace calls of test functions defined in the test file.
+
+    Only frames of test functions get a local tracer, so code under test
+    runs with the global 'call' check only.
+    """
+
+    def __init__(self, test_file):
+        self.test_file = test_file
+        self.tests = []
+
+    def trace_call(self, frame, event, arg):
+        code = frame.f_code
+        if code.co_filename != self.test_file or not code.co_name.startswith('test'):
+            return None
+
+        record = {
+            "name": getattr(code, 'co_qualname', code.co_name),
+            "status": "passed",
+            "duration": None,
+            "error": None,
+            "traceback": None,
+        }
+        self.tests.append(record)
+        started = time.perf_counter()
+        # Exception raised in the frame and not handled yet
+        pending = []
+
+        def trace_frame(frame, event, arg):
+            if event == 'exception':
+                pending[:] = [arg]
+            elif event == 'line':
+                # Execution continues in the frame, exception was handled
+                pending.clear()
+            elif event == 'return':
+                record["duration"] = round(time.perf_counter() - started, 6)
+                if pending:
+                    exc_type, exc, tb = pending[0]
+                    record["status"] = "failed"
+                    record["error"] = "".join(traceback.format_exception_only(exc_type, exc)).strip()
+                    record["traceback"] = "".join(traceback.format_exception(exc_type, exc, tb))
+            return trace_frame
+
+        return trace_frame
+
+
+def get_exit_code(exit):
+    """ Convert SystemExit into the process return code like the interpreter does """
+    if exit.code is None:
+        return 0
+    if isinstance(exit.code, int):
+        return exit.code
+    print(exit.code, file=sys.stderr)
+    return 1
+
+
+def run_test_file(test_file, args, result_fd):
+    """ Run test file inside the forked child and write the result """
+    sys.argv = [test_file] + list(args)
+    sys.path[0] = os.path.dirname(test_file)
+    tracer = TestTracer(test_file)
+    returncode = 0
+    started = time.perf_counter()
+    sys.settrace(tracer.trace_call)
+    try:
+        runpy.run_path(test_file, run_name='__main__')
+    except SystemExit as e:
+        returncode = get_exit_code(e)
+    except BaseException:
+        traceback.print_exc()
+        returncode = 1
+    finally:
+        sys.settrace(None)
+    duration = time.perf_counter() - started
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    result = json.dumps({"returncode": returncode, "duration": round(duration, 6), "tests": tracer.tests})
+    with os.fdopen(result_fd, 'w') as f:
+        f.write(result)
+
+
+class TestRun(object):
+    """ Test run forked from the server """
+
+    def __init__(self, job):
+        self.job = job
+        self.stdout = tempfile.TemporaryFile()
+        self.stderr = tempfile.TemporaryFile()
+        self.output = b""
+        self.timed_out = False
+        self.finished = False
+        timeout = job.get('timeout')
+        self.deadline = time.monotonic() + timeout if timeout else None
+
+        result_read, result_write = os.pipe()
+        self.pid = os.fork()
+        if self.pid == 0:
+            # Anything escaping run_test_file means the result was not written
+            exit_code = 1
+            try:
+                os.close(result_read)
+                null = os.open(os.devnull, os.O_RDONLY)
+                os.dup2(null, 0)
+                os.dup2(self.stdout.fileno(), 1)
+                os.dup2(self.stderr.fileno(), 2)
+                run_test_file(os.path.abspath(job['test_file']), job.get('args', []), result_write)
+                exit_code = 0
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                os._exit(exit_code)
+
+        os.close(result_write)
+        self.fd = result_read
+
+    def kill(self):
+        self.timed_out = True
+        try:
+            os.kill(self.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def finish(self):
+        """
+        Collect the child, called once its result pipe is closed.
+
+        Returns:
+            dict: Response for the client
+        """
+        os.close(self.fd)
+        _, status = os.waitpid(self.pid, 0)
+        self.finished = True
+        response = {"returncode": 1, "duration": None, "tests": []}
+        messages = []
+        try:
+            response.update(json.loads(self.output))
+        except ValueError:
+            # Child exited without reporting, e.g. os._exit() in the test,
+            # the run failed even if the exit status says otherwise
+            if os.WIFEXITED(status):
+                response["returncode"] = os.WEXITSTATUS(status) or 1
+                messages.append("Test process exited without reporting its result")
+        if self.timed_out:
+            response["returncode"] = TIMEOUT_RETURN_CODE
+            messages.append(f"Test run timed out after {self.job.get('timeout')} seconds")
+        elif os.WIFSIGNALED(status):
+            # E.g. segmentation fault in the library under test
+            signum = os.WTERMSIG(status)
+            response["returncode"] = -signum
+            messages.append(f"Test process killed by signal {signal.Signals(signum).name}")
+
+        response["id"] = self.job['id']
+        response["stdout"] = self._read(self.stdout)
+        response["stderr"] = "\n".join([self._read(self.stderr)] + messages).strip()
+        return response
+
+    def _read(self, f):
+        f.seek(0)
+        text = f.read().decode(errors='replace')
+        f.close()
+        return text
+
+
+def serve():
+    # Responses go to a private copy of stdout, anything else printed to
+    # stdout ends up in stderr.
+    responses = os.fdopen(os.dup(sys.stdout.fileno()), 'w')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    warm_up()
+
+    def respond(response):
+        responses.write(json.dumps(response) + "\n")
+        responses.flush()
+
+    def start(line):
+        job = json.loads(line)
+        try:
+            run = TestRun(job)
+        except Exception:
+            respond({"id": job['id'], "returncode": 1, "stdout": "", "stderr": traceback.format_exc(),
+                     "duration": None, "tests": []})
+            return
+        selector.register(run.fd, selectors.EVENT_READ, run)
+
+    # Single threaded event loop, so forking never races with other threads
+    selector = selectors.DefaultSelector()
+    stdin_fd = sys.stdin.fileno()
+    selector.register(stdin_fd, selectors.EVENT_READ, None)
+    stdin_open = True
+    buffer = b""
+    while stdin_open or len(selector.get_map()):
+        runs = [key.data for key in selector.get_map().values() if key.data]
+        deadlines = [run.deadline for run in runs if run.deadline and not run.timed_out]
+        timeout = max(0, min(deadlines) - time.monotonic()) if deadlines else None
+
+        for key, _ in selector.select(timeout):
+            if key.data is None:
+                data = os.read(stdin_fd, 65536)
+                if not data:
+                    selector.unregister(stdin_fd)
+                    stdin_open = False
+                    continue
+                buffer += data
+                *lines, buffer = buffer.split(b"\n")
+                for line in lines:
+                    if line.strip():
+                        start(line)
+            else:
+                run = key.data
+                data = os.read(run.fd, 65536)
+                if data:
+                    run.output += data
+                else:
+                    selector.unregister(run.fd)
+                    respond(run.finish())
+
+        now = time.monotonic()
+        for run in runs:
+            if run.deadline and not run.finished and not run.timed_out and now >= run.deadline:
+                run.kill()
+
+
+if __name__ == "__main__":
+    serve()
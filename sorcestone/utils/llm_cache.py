@@ -0,0 +1,180 @@
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from sorcestone.utils.cache import get_cache_dir, hash_key
+from sorcestone.utils.logger import logger
+from sorcestone.utils.metrics import record
+
+
+DEFAULT_MAX_SIZE = 1024 ** 3
+DEFAULT_TTL = 30 * 24 * 60 * 60
+
+# Iteration round of the request. With a bounded history two failed rounds
+# may send the same prompt, the round tells them apart in the cache.
+current_round = ContextVar('current_round', default=None)
+
+
+@contextmanager
+def round_context(round_number):
+    """
+    Key LLM requests sent inside the block by the Iteration round as well.
+    """
+    token = current_round.set(round_number)
+    try:
+        yield
+    finally:
+        current_round.reset(token)
+
+
+class ResponseStore(object):
+    """
+    SQLite store of LLM responses with size limit and time to live.
+
+    Safe to use from several threads and processes. Connection is opened
+    lazily per process, so the store survives forking into batch workers.
+    """
+
+    def __init__(self, db_path=None, max_size=DEFAULT_MAX_SIZE, ttl=DEFAULT_TTL):
+        self.db_path = db_path or os.path.join(get_cache_dir('llm'), 'responses.sqlite')
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+
+    def _connect(self):
+        if self._connection is None or self._pid != os.getpid():
+            connection = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY,"
+                " response TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)")
+            connection.commit()
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+    def get(self, key):
+        """
+        Returns:
+            str: Stored response, None if missing or expired
+        """
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute(
+                "SELECT response FROM responses WHERE key = ? AND created_at > ?",
+                (key, now - self.ttl)
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            connection.commit()
+        return row[0]
+
+    def put(self, key, response):
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, response, len(response.encode()), now, now)
+            )
+            connection.commit()
+            self._evict(connection, now)
+
+    def _evict(self, connection, now):
+        connection.execute("DELETE FROM responses WHERE created_at <= ?", (now - self.ttl,))
+        total_size = connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total_size > self.max_size:
+            # Drop least recently used responses above the limit
+            rows = connection.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall()
+            for key, size in rows:
+                if total_size <= self.max_size:
+                    break
+                connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                total_size -= size
+        connection.commit()
+
+
+class CachedClient(object):
+    """
+    LLM client wrapper replaying stored responses for identical requests.
+
+    Requests are keyed by vendor, model, sampling params, the full prompt
+    and the Iteration round, so rerunning a pipeline with unchanged inputs
+    makes no network calls, while a round repeating the prompt of a failed
+    one still gets a fresh response. Everything besides sending messages is delegated to the client.
+    """
+
+    def __init__(self, client, vendor, model, params=None, store=None):
+        self.client = client
+        self.vendor = vendor
+        self.model = model
+        self.params = params or {}
+        self.store = store or ResponseStore()
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    @property
+    def supports_messages(self):
+        return getattr(self.client, 'supports_messages', False) is True
+
+    def get_key(self, query):
+        parts = [self.vendor, self.model, json.dumps(self.params, sort_keys=True), json.dumps(query, sort_keys=True)]
+        round_number = current_round.get()
+        if round_number is not None:
+            parts.append(f"round {round_number}")
+        return hash_key(*parts)
+
+    def _send(self, method, request):
+        key = self.get_key(request)
+        response = self.store.get(key)
+        if response is not None:
+            logger.info(f"LLM response replayed from cache {key}")
+            record("llm_cache_hits", 1)
+            return response
+
+        response = getattr(self.client, method)(request)
+        self.store.put(key, response)
+        return response
+
+    async def _asend(self, method, request):
+        key = self.get_key(request)
+        response = await asyncio.to_thread(self.store.get, key)
+        if response is not None:
+            logger.info(f"LLM response replayed from cache {key}")
+            record("llm_cache_hits", 1)
+            return response
+
+        if hasattr(self.client, f"a{method}"):
+            response = await getattr(self.client, f"a{method}")(request)
+        else:
+            response = await asyncio.to_thread(getattr(self.client, method), request)
+        await asyncio.to_thread(self.store.put, key, response)
+        return response
+
+    def send_message(self, query):
+        return self._send('send_message', query)
+
+    async def asend_message(self, query):
+        return await self._asend('send_message', query)
+
+    def send_messages(self, messages):
+        return self._send('send_messages', messages)
+
+    async def asend_messages(self, messages):
+        return await self._asend('send_messages', messages)
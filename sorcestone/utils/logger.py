@@ -1,8 +1,16 @@
 import os
+import queue
+import atexit
 import logging
+import logging.handlers
+import multiprocessing.util
 from datetime import datetime
 
 
+LOG_MAX_BYTES = int(os.environ.get('SORCESTONE_LOG_MAX_BYTES', 10 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.environ.get('SORCESTONE_LOG_BACKUP_COUNT', 5))
+
+
 def get_log_path(log_file_name: str) -> str:
     """
     Generate a log file path based on the source file name.
@@ -16,8 +24,8 @@ def get_log_path(log_file_name: str) -> str:
     # Get current date
     today = datetime.now().strftime("%Y-%m-%d")
     
-    # Create logs base directory
-    logs_base_dir = os.path.join(os.path.dirname(__file__), '../../.logs')
+    # Create logs base directory, SORCESTONE_LOG_DIR or .logs in the project
+    logs_base_dir = os.environ.get('SORCESTONE_LOG_DIR') or os.path.join(os.path.dirname(__file__), '../../.logs')
     
     # Create date-specific subdirectory
     logs_date_dir = os.path.join(logs_base_dir, today)
@@ -35,7 +43,14 @@ def get_log_path(log_file_name: str) -> str:
 def setup_logger(log_level=logging.INFO) -> logging.Logger:
     """
     Set up a logger for a specific source file.
-    
+
+    Records are put on a queue and written to the console and the rotating
+    log file by a listener thread, so logging never blocks on I/O.
+    Multiprocessing workers (batch workers, isolated stages) log into a file
+    of their own, convertor_<pid>.log, as rotation can not be shared between
+    processes. Other forks (fuzz batches, test runs) are short lived and exit
+    with os._exit, they start no listener and log to the console directly.
+
     Args:
         log_level (int, optional): Logging level. Defaults to logging.INFO.
     
@@ -44,30 +59,66 @@ def setup_logger(log_level=logging.INFO) -> logging.Logger:
     """
     
     source_file = "convertor"
-    # Get log file path
-    log_path = get_log_path(source_file)
     
     # Create logger
     logger = logging.getLogger(os.path.basename(source_file))
     logger.setLevel(log_level)
     
-    # Create file handler
-    file_handler = logging.FileHandler(log_path)
-    file_handler.setLevel(log_level)
-    
     # Create console handler
     console_handler = logging.StreamHandler()
     console_handler.setLevel(log_level)
     
     # Create formatter
     formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    file_handler.setFormatter(formatter)
     console_handler.setFormatter(formatter)
     
-    # Add handlers to logger
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
+    # Handlers are driven by the listener thread
+    queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+
+    listeners = []
+
+    def start_listener(log_file_name):
+        # Create file handler, rotated by size
+        file_handler = logging.handlers.RotatingFileHandler(
+            get_log_path(log_file_name), maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, delay=True
+        )
+        file_handler.setLevel(log_level)
+        file_handler.setFormatter(formatter)
+
+        queue_handler.queue = queue.SimpleQueue()
+        listeners[:] = [logging.handlers.QueueListener(
+            queue_handler.queue, file_handler, console_handler, respect_handler_level=True
+        )]
+        listeners[0].start()
+        logger.handlers[:] = [queue_handler]
+
+    def stop_listener():
+        # Writes out pending records
+        while listeners:
+            listener = listeners.pop()
+            listener.stop()
+            listener.handlers[0].close()
+
+    def log_directly():
+        # Listener thread does not survive fork
+        listeners.clear()
+        logger.handlers[:] = [console_handler]
+
+    def start_worker_listener():
+        start_listener(f"{source_file}_{os.getpid()}")
+        # Multiprocessing workers skip atexit, but run finalizers on exit
+        multiprocessing.util.Finalize(None, stop_listener, exitpriority=-100)
+
+    if multiprocessing.current_process().name == 'MainProcess':
+        start_listener(source_file)
+    else:
+        # Spawned worker, it imports this module on its own
+        start_worker_listener()
+    atexit.register(stop_listener)
+    os.register_at_fork(after_in_child=log_directly)
+    # Forked multiprocessing workers, runs after the hook above
+    multiprocessing.util.register_after_fork(queue_handler, lambda _: start_worker_listener())
     return logger
 
 
-logger = setup_logger()
\ No newline at end of file
+logger = setup_logger()
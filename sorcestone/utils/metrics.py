@@ -0,0 +1,185 @@
+import os
+import json
+import time
+import uuid
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from sorcestone.utils.file_utils import append_line
+
+
+# Source file the current code works on, follows asyncio tasks and to_thread
+current_file = ContextVar('current_file', default=None)
+
+_lock = threading.Lock()
+_events_path = os.environ.get('SORCESTONE_METRICS_FILE')
+# file -> (metric, labels) -> [count, sum, min, max]
+_totals = {}
+
+
+def get_run_id():
+    """
+    Get id of the current run. Set once per run and passed to worker
+    processes through SORCESTONE_RUN_ID, may be set by the caller as well.
+    """
+    run_id = os.environ.get('SORCESTONE_RUN_ID')
+    if not run_id:
+        run_id = os.environ['SORCESTONE_RUN_ID'] = uuid.uuid4().hex[:12]
+    return run_id
+
+
+def configure_metrics(events_path=None):
+    """
+    Set JSON lines file receiving every metric event, None to keep metrics
+    in memory only. Worker processes inherit it through SORCESTONE_METRICS_FILE.
+    """
+    global _events_path
+    _events_path = os.path.abspath(events_path) if events_path else None
+    if _events_path:
+        os.environ['SORCESTONE_METRICS_FILE'] = _events_path
+    else:
+        os.environ.pop('SORCESTONE_METRICS_FILE', None)
+    get_run_id()
+
+
+def record(metric, value, **labels):
+    """
+    Record a metric value, e.g. record('compile_seconds', 1.2, language='Rust').
+
+    Values are aggregated per source file in memory and appended to the
+    events file, if configured.
+    """
+    file_path = current_file.get()
+    key = (metric, tuple(sorted(labels.items())))
+    with _lock:
+        totals = _totals.setdefault(file_path, {})
+        total = totals.get(key)
+        if total is None:
+            totals[key] = [1, value, value, value]
+        else:
+            total[0] += 1
+            total[1] += value
+            total[2] = min(total[2], value)
+            total[3] = max(total[3], value)
+
+    if not _events_path:
+        return
+    event = {
+        "time": time.time(),
+        "run_id": get_run_id(),
+        "file": file_path,
+        "metric": metric,
+        "value": value,
+        "labels": labels,
+    }
+    with _lock:
+        append_line(_events_path, json.dumps(event))
+
+
+@contextmanager
+def timer(metric, **labels):
+    """
+    Record wall time of the block in seconds, also when it raises.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(metric, time.perf_counter() - started, **labels)
+
+
+@contextmanager
+def file_context(file_path):
+    """
+    Attribute metrics recorded inside the block to the source file.
+    """
+    token = current_file.set(file_path)
+    try:
+        yield
+    finally:
+        current_file.reset(token)
+
+
+def get_file_metrics(file_path):
+    """
+    Get aggregated metrics of a source file.
+
+    Returns:
+        list: dicts with metric, labels, count, sum, min and max
+    """
+    with _lock:
+        totals = dict(_totals.get(file_path, {}))
+    return [
+        {"metric": metric, "labels": dict(labels), "count": count, "sum": total, "min": low, "max": high}
+        for (metric, labels), (count, total, low, high) in sorted(totals.items())
+    ]
+
+
+def merge_metrics(metrics_lists):
+    """
+    Aggregate metrics of many files, e.g. of a batch run.
+
+    Args:
+        metrics_lists ([list]): get_file_metrics results
+
+    Returns:
+        list: merged metrics in the same format
+    """
+    merged = {}
+    for metrics in metrics_lists:
+        for item in metrics:
+            key = (item["metric"], tuple(sorted(item["labels"].items())))
+            total = merged.get(key)
+            if total is None:
+                merged[key] = dict(item)
+            else:
+                total["count"] += item["count"]
+                total["sum"] += item["sum"]
+                total["min"] = min(total["min"], item["min"])
+                total["max"] = max(total["max"], item["max"])
+    return [merged[key] for key in sorted(merged)]
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = {
+        name: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        for name, value in labels.items()
+    }
+    return "{" + ",".join(f'{name}="{value}"' for name, value in sorted(escaped.items())) + "}"
+
+
+def to_openmetrics(metrics, **labels):
+    """
+    Render aggregated metrics as OpenMetrics text, e.g. for node exporter
+    textfile collector. Every metric is a summary with count and sum, min
+    and max are exported as separate gauges.
+
+    Args:
+        metrics (list): get_file_metrics or merge_metrics result
+        **labels: Labels added to every sample, e.g. run_id
+
+    Returns:
+        str: OpenMetrics text
+    """
+    by_name = {}
+    for item in metrics:
+        by_name.setdefault(item["metric"], []).append(item)
+
+    lines = []
+    for metric, items in sorted(by_name.items()):
+        name = f"sorcestone_{metric}"
+        lines.append(f"# TYPE {name} summary")
+        for item in items:
+            sample_labels = format_labels(dict(item["labels"], **labels))
+            lines.append(f"{name}_count{sample_labels} {item['count']}")
+            lines.append(f"{name}_sum{sample_labels} {item['sum']}")
+        for suffix in ("min", "max"):
+            lines.append(f"# TYPE {name}_{suffix} gauge")
+            for item in items:
+                sample_labels = format_labels(dict(item["labels"], **labels))
+                lines.append(f"{name}_{suffix}{sample_labels} {item[suffix]}")
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
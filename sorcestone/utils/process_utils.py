@@ -0,0 +1,134 @@
+import json
+import asyncio
+import itertools
+import threading
+import subprocess
+from concurrent.futures import Future
+
+from sorcestone.utils.logger import logger
+
+
+async def run_process(args, cwd=None):
+    """
+    Run a command without blocking the event loop.
+
+    Args:
+        args ([str]): Command and its arguments
+        cwd (str, optional): Working directory
+
+    Returns:
+        subprocess.CompletedProcess: Result with text stdout and stderr
+    """
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        cwd=cwd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    stdout, stderr = await process.communicate()
+    return subprocess.CompletedProcess(
+        args=args,
+        returncode=process.returncode,
+        stdout=stdout.decode(errors='replace'),
+        stderr=stderr.decode(errors='replace')
+    )
+
+
+class JsonLinesClient(object):
+    """
+    Client of a long living server taking JSON line requests on stdin and
+    answering with JSON line responses on stdout, e.g. the parser and the
+    test servers.
+
+    Every request gets an "id" which the server copies to its response,
+    responses are read by a background thread and resolve the futures
+    returned by send(). Subclasses convert responses with make_result().
+
+    Args:
+        command ([str]): Server command
+    """
+
+    # Used in error messages, e.g. "Parser server"
+    name = "Server"
+
+    def __init__(self, command):
+        self.process = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            bufsize=1
+        )
+        self._ids = itertools.count()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._reader = threading.Thread(target=self._read_responses, daemon=True)
+        self._reader.start()
+
+    def make_result(self, response):
+        """
+        Returns:
+            Result of the request the response answers
+        """
+        raise NotImplementedError()
+
+    def _read_responses(self):
+        for line in self.process.stdout:
+            try:
+                response = json.loads(line)
+            except ValueError:
+                logger.error(f"Malformed {self.name.lower()} response: {line}")
+                continue
+            with self._lock:
+                future = self._pending.pop(response.get('id'), None)
+            if future:
+                future.set_result(self.make_result(response))
+            elif response.get('returncode'):
+                logger.error(f"{self.name} error: {response.get('stderr')}")
+
+        # Server is gone, nobody is going to answer pending jobs
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_exception(Exception(f"{self.name} exited unexpectedly"))
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def send(self, request):
+        """
+        Send request to the server.
+
+        Args:
+            request (dict): Request without the "id"
+
+        Returns:
+            concurrent.futures.Future: resolves to make_result() of the response
+        """
+        future = Future()
+        request_id = next(self._ids)
+        with self._lock:
+            if not self.is_alive():
+                raise Exception(f"{self.name} is not running")
+            self._pending[request_id] = future
+            self.process.stdin.write(json.dumps({'id': request_id, **request}) + "\n")
+            self.process.stdin.flush()
+        return future
+
+    def forget(self, future):
+        """
+        Stop waiting for the response of a request, e.g. after a timeout. A
+        late response is then only logged if it is an error.
+
+        Args:
+            future (concurrent.futures.Future): Future returned by send()
+        """
+        with self._lock:
+            for request_id, pending in list(self._pending.items()):
+                if pending is future:
+                    del self._pending[request_id]
+
+    def close(self):
+        if self.process.stdin and not self.process.stdin.closed:
+            self.process.stdin.close()
+        self.process.wait()
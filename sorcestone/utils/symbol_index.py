@@ -0,0 +1,141 @@
+import os
+import sqlite3
+import threading
+
+
+# Schema is described in language_tools/C/toolbox/symbol_index.py (writer)
+SCHEMA_VERSION = "1"
+
+SYMBOL_COLUMNS = (
+    "symbols.id, symbols.name, symbols.kind, files.path, symbols.line, symbols.is_definition, "
+    "symbols.storage, symbols.declaration"
+)
+
+
+class SymbolIndex(object):
+    """
+    Read-only lookups in the project symbol index written by the parser.
+
+    Symbols are dicts with name, kind ('function', 'struct', 'union',
+    'enum', 'typedef' or 'variable'), file, line, is_definition, storage
+    and declaration rendered in the source language.
+    """
+
+    def __init__(self, db_path):
+        if not os.path.exists(db_path):
+            raise FileNotFoundError(f"Symbol index {db_path} does not exist")
+        self.db_path = db_path
+        self._connection = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=30,
+                                           check_same_thread=False)
+        self._lock = threading.Lock()
+        version = self._query("SELECT value FROM meta WHERE key = 'schema_version'")
+        if not version or version[0][0] != SCHEMA_VERSION:
+            self.close()
+            raise ValueError(f"Symbol index {db_path} has unsupported schema version")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._connection.close()
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._connection.execute(sql, params).fetchall()
+
+    def _symbols(self, where, params=()):
+        rows = self._query(
+            f"SELECT {SYMBOL_COLUMNS} FROM symbols JOIN files ON files.id = symbols.file_id "
+            f"WHERE {where} ORDER BY files.path, symbols.line",
+            params
+        )
+        return [
+            {
+                "id": row[0],
+                "name": row[1],
+                "kind": row[2],
+                "file": row[3],
+                "line": row[4],
+                "is_definition": bool(row[5]),
+                "storage": row[6],
+                "declaration": row[7],
+            }
+            for row in rows
+        ]
+
+    def find(self, name, kind=None, definitions_only=False):
+        """
+        Get declarations of the name, e.g. 'parse_header' or 'struct point'.
+        """
+        where = "symbols.name = ?"
+        params = [name]
+        if kind:
+            where += " AND symbols.kind = ?"
+            params.append(kind)
+        if definitions_only:
+            where += " AND symbols.is_definition = 1"
+        return self._symbols(where, params)
+
+    def get_callers(self, name):
+        """
+        Get function definitions calling the function.
+        """
+        return self._symbols("symbols.id IN (SELECT caller FROM calls WHERE callee = ?)", (name,))
+
+    def get_callees(self, name):
+        """
+        Get names of functions called by definitions of the function.
+        """
+        rows = self._query(
+            "SELECT DISTINCT callee FROM calls JOIN symbols ON symbols.id = calls.caller "
+            "WHERE symbols.name = ? AND symbols.kind = 'function' ORDER BY callee",
+            (name,)
+        )
+        return [row[0] for row in rows]
+
+    def get_type_users(self, type_name):
+        """
+        Get declarations referring to the typedef or tag, e.g. 'point_t'.
+        """
+        return self._symbols("symbols.id IN (SELECT symbol FROM type_refs WHERE type = ?)", (type_name,))
+
+    def get_external_functions(self, names, unit_path=None):
+        """
+        Get definitions of the functions living outside of the translation
+        unit, static functions of other files are left out.
+
+        Args:
+            names ([str]): Function names, e.g. callees missing in the unit
+            unit_path (str): Source file of the translation unit
+
+        Returns:
+            list: symbols, one per name at most
+        """
+        unit_files = set()
+        if unit_path:
+            unit_files = {row[0] for row in self._query(
+                "SELECT files.path FROM unit_files JOIN files ON files.id = unit_files.file_id WHERE unit = ?",
+                (unit_path,)
+            )}
+        found = []
+        for name in sorted(set(names)):
+            definitions = [
+                symbol for symbol in self.find(name, kind='function', definitions_only=True)
+                if symbol["file"] not in unit_files and "static" not in (symbol["storage"] or "")
+            ]
+            if definitions:
+                found.append(definitions[0])
+        return found
+
+
+def format_symbols(symbols):
+    """
+    Render declarations with their location as prompt context.
+    """
+    return "\n".join(
+        f"{symbol['declaration']} /* {os.path.basename(symbol['file'])}:{symbol['line']} */"
+        for symbol in symbols
+    )
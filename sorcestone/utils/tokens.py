@@ -0,0 +1,22 @@
+import re
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _encoding = None
+
+
+RE_WORD = re.compile(r'\w+|[^\w\s]')
+
+
+def estimate_tokens(text):
+    """
+    Estimate number of LLM tokens in the text.
+
+    Uses tiktoken when it is installed, otherwise counts words and
+    punctuation, which is close enough to compare prompts and budgets.
+    """
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(RE_WORD.findall(text))
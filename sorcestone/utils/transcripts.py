@@ -0,0 +1,174 @@
+import os
+import gzip
+import json
+import time
+import queue
+import atexit
+import threading
+import multiprocessing.util
+
+from sorcestone.utils.logger import logger, get_log_path
+from sorcestone.utils.file_utils import append_line
+from sorcestone.utils.metrics import current_file, get_run_id
+
+
+INDEX_FILE = "index.jsonl"
+
+# Archive is synced to disk after this many records, or when the writer is idle
+FLUSH_RECORDS = 20
+
+
+def get_transcript_dir():
+    """
+    Folder of LLM transcript archives, SORCESTONE_TRANSCRIPT_DIR or the
+    transcripts folder next to today's log.
+    """
+    return os.environ.get('SORCESTONE_TRANSCRIPT_DIR') or os.path.join(
+        os.path.dirname(get_log_path("transcripts")), "transcripts"
+    )
+
+
+class TranscriptArchive(object):
+    """
+    Append-only gzip archive of LLM prompts and responses.
+
+    Every process writes its own archive file from a background thread, so
+    callers only put records on a queue. Records are JSON lines, the shared
+    index.jsonl maps file, stage and round to the archive and the offset of
+    the record in its uncompressed stream.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        # Offsets in the index count from the start of the file, never append to an old one
+        name = f"{get_run_id()}-{os.getpid()}"
+        self.archive_name = f"{name}.jsonl.gz"
+        number = 0
+        while os.path.exists(os.path.join(directory, self.archive_name)):
+            number += 1
+            self.archive_name = f"{name}-{number}.jsonl.gz"
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self._write_records, daemon=True)
+        self.thread.start()
+
+    def write(self, stage, round_number, request, response, **fields):
+        """
+        Queue transcript of a single LLM round.
+
+        Args:
+            stage (str): Stage name
+            round_number (int): Round within the stage, starting at 1
+            request (str | list): Query or chat messages
+            response (str): LLM response
+            **fields: Extra JSON serializable fields, e.g. validation result
+        """
+        self.queue.put({
+            "time": time.time(),
+            "file": current_file.get(),
+            "stage": stage,
+            "round": round_number,
+            "request": request,
+            "response": response,
+            **fields,
+        })
+
+    def _write_records(self):
+        path = os.path.join(self.directory, self.archive_name)
+        index_path = os.path.join(self.directory, INDEX_FILE)
+        offset = 0
+        pending = 0
+        with gzip.open(path, 'wb') as archive:
+            while True:
+                try:
+                    item = self.queue.get(timeout=1 if pending else None)
+                except queue.Empty:
+                    archive.flush()
+                    pending = 0
+                    continue
+                if item is None:
+                    break
+
+                try:
+                    data = (json.dumps(item) + "\n").encode()
+                    archive.write(data)
+                    entry = {
+                        "run_id": get_run_id(),
+                        "file": item["file"],
+                        "stage": item["stage"],
+                        "round": item["round"],
+                        "time": item["time"],
+                        "archive": self.archive_name,
+                        "offset": offset,
+                        "size": len(data),
+                    }
+                    offset += len(data)
+                    append_line(index_path, json.dumps(entry))
+                except Exception as e:
+                    logger.error(f"Failed to archive LLM transcript: {e}")
+
+                pending += 1
+                if pending >= FLUSH_RECORDS:
+                    archive.flush()
+                    pending = 0
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+
+def read_transcripts(directory=None, file_path=None, stage=None):
+    """
+    Read archived transcripts, optionally only of a source file or stage.
+
+    Yields:
+        dict: Transcript record
+    """
+    directory = directory or get_transcript_dir()
+    index_path = os.path.join(directory, INDEX_FILE)
+    if not os.path.exists(index_path):
+        return
+
+    entries = {}
+    with open(index_path) as f:
+        for line in f:
+            entry = json.loads(line)
+            if file_path is not None and entry["file"] != file_path:
+                continue
+            if stage is not None and entry["stage"] != stage:
+                continue
+            entries.setdefault(entry["archive"], []).append(entry)
+
+    for archive_name, archive_entries in entries.items():
+        with gzip.open(os.path.join(directory, archive_name), 'rb') as archive:
+            for entry in sorted(archive_entries, key=lambda entry: entry["offset"]):
+                archive.seek(entry["offset"])
+                yield json.loads(archive.read(entry["size"]))
+
+
+_archive = None
+_archive_pid = None
+_archive_lock = threading.Lock()
+
+
+def get_transcript_archive():
+    """
+    Get transcript archive of this process, batch workers start their own.
+    """
+    global _archive, _archive_pid
+    with _archive_lock:
+        if _archive is None or _archive_pid != os.getpid():
+            _archive = TranscriptArchive(get_transcript_dir())
+            _archive_pid = os.getpid()
+            if multiprocessing.parent_process() is not None:
+                # Multiprocessing workers skip atexit, but run finalizers on exit
+                multiprocessing.util.Finalize(None, close_transcript_archive, exitpriority=0)
+    return _archive
+
+
+@atexit.register
+def close_transcript_archive():
+    with _archive_lock:
+        if _archive is not None and _archive_pid == os.getpid():
+            _archive.close()
@@ -0,0 +1,9 @@
+import os
+import atexit
+import shutil
+import tempfile
+
+# Logs and LLM transcripts of test runs go to a temporary folder instead of .logs
+if not os.environ.get('SORCESTONE_LOG_DIR'):
+    os.environ['SORCESTONE_LOG_DIR'] = tempfile.mkdtemp(prefix='sorcestone-test-logs-')
+    atexit.register(shutil.rmtree, os.environ['SORCESTONE_LOG_DIR'], ignore_errors=True)
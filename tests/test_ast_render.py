@@ -0,0 +1,51 @@
+import unittest
+
+from pycparser import c_parser
+
+from sorcestone.utils.ast_render import from_pycparser, render_ast, render_view
+from sorcestone.utils.ast_utils import split_units
+
+
+SOURCE = """
+typedef struct point { int x; int y; } point_t;
+int scale(point_t p, int k) {
+    switch (k) { case 0: case 1: return p.x; default: return p.x * k + p.y; }
+}
+"""
+
+
+class TestAstRender(unittest.TestCase):
+    def setUp(self):
+        """
+        Set up AST in the dict representation
+        """
+        self.ast = from_pycparser(c_parser.CParser().parse(SOURCE, filename='point.c'))
+
+    def test_views_round_trip(self):
+        """
+        Test that every view parses back into the same AST
+        """
+        for view in ['json', 'sexp', 'c']:
+            report = render_view(self.ast['ext'], view)
+            self.assertTrue(report['round_trips'], view)
+
+    def test_function_without_its_typedef(self):
+        """
+        Test that C view of a single function round trips without the prelude
+        """
+        _, functions = split_units(self.ast)
+
+        self.assertTrue(render_view([functions['scale']], 'c')['round_trips'])
+
+    def test_auto_picks_least_tokens(self):
+        """
+        Test that auto view picks the cheapest view
+        """
+        view, text = render_ast(self.ast)
+
+        self.assertEqual(view, 'c')
+        self.assertIn('int scale(point_t p, int k)', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import os
+import json
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from sorcestone import run
+
+
+def fake_process_file(file_path, from_language, to_language, workspace, **options):
+    """ Per-file job stub, the file name tells how it ends """
+    name = os.path.basename(file_path)
+    if name == "crash.c":
+        # Like a segfault in a loaded library, the worker process dies
+        os._exit(1)
+    if name == "error.c":
+        raise ValueError("translation failed")
+    return os.path.join(workspace, "out.rs")
+
+
+class TestBatch(unittest.TestCase):
+    @patch("sorcestone.run.process_file", fake_process_file)
+    def test_failures_are_per_file(self):
+        """
+        Test that a failing job and a dying worker fail only their own file
+        and the summary lists every input
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_paths = [os.path.join(tmp_dir, "src", name) for name in ["a.c", "crash.c", "error.c", "b.c"]]
+            output_dir = os.path.join(tmp_dir, "out")
+            os.makedirs(output_dir)
+
+            results = run.process_batch(file_paths, "C", "Rust", output_dir, jobs=2)
+            with open(os.path.join(output_dir, "summary.json")) as f:
+                summary = json.load(f)
+
+        self.assertEqual([result["file"] for result in summary], file_paths)
+        self.assertEqual([result["status"] for result in results], ["done", "failed", "failed", "done"])
+        self.assertEqual(results[0]["output"], os.path.join(output_dir, "a", "out.rs"))
+        self.assertEqual(results[1]["error"], "Worker process died")
+        self.assertEqual(results[2]["error"], "translation failed")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+import unittest
+import subprocess
+from unittest.mock import Mock, patch
+
+from pycparser import c_parser
+
+from sorcestone.utils.ast_render import from_pycparser
+from sorcestone.main.benchmark import PerfStage, get_signatures, get_regressions, run_benchmark
+
+
+SOURCE = """
+typedef unsigned long counter_t;
+counter_t spin(counter_t n) { volatile counter_t s = 0; for (counter_t i = 0; i < n * %d; i++) s += i; return s; }
+static int hidden(int v) { return v; }
+long total(const int *values, int n) { return n; }
+"""
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_signatures(self):
+        """
+        Test that only exported functions with scalar types are benchmarked
+        """
+        ast = from_pycparser(c_parser.CParser().parse(SOURCE % 1))
+
+        self.assertEqual(get_signatures(ast), [
+            {"name": "spin", "restype": "c_ulong", "argtypes": ["c_ulong"]},
+            {"name": "total", "skipped": "non scalar arguments or return type"},
+        ])
+
+    @unittest.skipUnless(shutil.which('gcc'), "gcc is not available")
+    def test_regression_detected(self):
+        """
+        Test that a slower library is reported as a regression
+        """
+        ast = from_pycparser(c_parser.CParser().parse(SOURCE % 1))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            libs = []
+            for name, factor in [("fast", 1), ("slow", 20)]:
+                source = os.path.join(tmp_dir, f"{name}.c")
+                with open(source, 'w') as f:
+                    f.write(SOURCE % factor)
+                libs.append(os.path.join(tmp_dir, f"{name}.so"))
+                subprocess.run(['gcc', '-O1', '-shared', '-fPIC', source, '-o', libs[-1]], check=True)
+
+            results = run_benchmark(libs[0], libs[1], get_signatures(ast))
+
+        self.assertEqual([result["name"] for result in get_regressions(results, 2)], ["spin"])
+        self.assertGreater(results[0]["ci"][0], 2)
+
+    def test_failed_benchmark_keeps_translation(self):
+        """
+        Test that a crashing benchmark is reported and does not fail the stage
+        """
+        ast = from_pycparser(c_parser.CParser().parse(SOURCE % 1))
+        llm_client = Mock()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            stage = PerfStage('a.ast', 'a.c.so', os.path.join(tmp_dir, 'a.rs'), 'test.py')
+            with patch("sorcestone.main.repair_stage.load_ast", return_value=ast), \
+                    patch('sorcestone.main.benchmark.run_benchmark', side_effect=Exception("crashed")):
+                results = stage.run(llm_client)
+            self.assertTrue(os.path.exists(stage.report_file))
+
+        self.assertEqual(results, [
+            {"name": "spin", "error": "crashed"},
+            {"name": "total", "skipped": "non scalar arguments or return type"},
+        ])
+        llm_client.send_message.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
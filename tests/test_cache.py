@@ -0,0 +1,111 @@
+import os
+import shutil
+import tempfile
+import unittest
+import subprocess
+from unittest.mock import patch
+
+from sorcestone.utils.cache import FileCache, hash_key
+from sorcestone.main.compile import CompilationError, compile_code, get_artifact_key
+
+
+class TestFileCache(unittest.TestCase):
+    def setUp(self):
+        """
+        Set up a cache in a temporary folder
+        """
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.env = patch.dict(os.environ, {'SORCESTONE_CACHE_DIR': self.tmp_dir.name})
+        self.env.start()
+        self.cache = FileCache('artifacts', max_size=10)
+
+    def tearDown(self):
+        self.env.stop()
+        self.tmp_dir.cleanup()
+
+    def _write(self, name, content):
+        path = os.path.join(self.tmp_dir.name, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_hash_key_parts_are_separated(self):
+        """
+        Test that key parts can not be shifted into each other
+        """
+        self.assertNotEqual(hash_key('ab', 'c'), hash_key('a', 'bc'))
+        self.assertEqual(hash_key('a', b'b'), hash_key(b'a', 'b'))
+
+    def test_put_and_get(self):
+        """
+        Test that stored file is handed back on hit
+        """
+        src = self._write('lib.so', 'binary')
+        dst = os.path.join(self.tmp_dir.name, 'copy.so')
+
+        self.assertFalse(self.cache.get('abcd', dst))
+        self.cache.put('abcd', src)
+
+        self.assertTrue(self.cache.get('abcd', dst))
+        with open(dst) as f:
+            self.assertEqual(f.read(), 'binary')
+
+    def test_evict_least_recently_used(self):
+        """
+        Test that eviction drops the oldest entries above max_size
+        """
+        self.cache.put('aa01', self._write('one', '123456'))
+        os.utime(self.cache._entry_path('aa01'), (1, 1))
+        self.cache.put('bb02', self._write('two', '123456'))
+
+        self.assertFalse(self.cache.contains('aa01'))
+        self.assertTrue(self.cache.contains('bb02'))
+
+    def test_artifact_key_covers_headers(self):
+        """
+        Test that editing an included local header changes the artifact key
+        """
+        source = self._write('v.c', '#include "v.h"\nint val(void) { return VAL; }\n')
+        self._write('v.h', '#define VAL 1\n')
+        key = get_artifact_key(source, 'C')
+        self.assertEqual(get_artifact_key(source, 'C'), key)
+
+        self._write('v.h', '#define VAL 2\n')
+        self.assertNotEqual(get_artifact_key(source, 'C'), key)
+
+    @unittest.skipUnless(shutil.which('cargo'), "cargo is not available")
+    def test_check_fails_before_build(self):
+        """
+        Test that code with type errors fails the check and is never built,
+        and that check only mode never builds
+        """
+        source = self._write('lib.rs', '#[unsafe(no_mangle)]\npub extern "C" fn val() -> i32 { "one" }\n')
+        commands = []
+        run_command = subprocess.run
+
+        def run(command, **kwargs):
+            commands.append(os.path.basename(command[1]))
+            return run_command(command, **kwargs)
+
+        with patch.dict(os.environ, {'SORCESTONE_CARGO_POOL': os.path.join(self.tmp_dir.name, 'pool')}), \
+                patch("sorcestone.main.compile.subprocess.run", side_effect=run):
+            with self.assertRaises(CompilationError) as error:
+                compile_code(source, 'Rust', use_cache=False, check=True)
+
+        self.assertEqual(commands, ['check.sh'])
+        self.assertEqual(error.exception.diagnostics[0]["code"], "E0308")
+        self.assertFalse(os.path.exists(os.path.join(self.tmp_dir.name, 'lib.so')))
+
+        # Valid code is type checked only
+        self._write('lib.rs', '#[unsafe(no_mangle)]\npub extern "C" fn val() -> i32 { 1 }\n')
+        commands.clear()
+        with patch.dict(os.environ, {'SORCESTONE_CARGO_POOL': os.path.join(self.tmp_dir.name, 'pool')}), \
+                patch("sorcestone.main.compile.subprocess.run", side_effect=run):
+            self.assertEqual(compile_code(source, 'Rust', use_cache=False, check_only=True).returncode, 0)
+
+        self.assertEqual(commands, ['check.sh'])
+        self.assertFalse(os.path.exists(os.path.join(self.tmp_dir.name, 'lib.so')))
+
+
+if __name__ == '__main__':
+    unittest.main()
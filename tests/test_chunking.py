@@ -0,0 +1,104 @@
+import json
+import asyncio
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from pycparser import c_parser
+
+from sorcestone.utils.ast_render import from_pycparser
+from sorcestone.utils.ast_utils import split_units, get_call_graph, get_dependency_levels, get_strong_components
+from sorcestone.main.generate_code_from_ast import ChunkedTranslation, stitch_code
+
+
+SOURCE = """
+typedef struct point { int x; int y; } point_t;
+int is_odd(int n);
+int is_even(int n) { return n == 0 ? 1 : is_odd(n - 1); }
+int is_odd(int n) { return n == 0 ? 0 : is_even(n - 1); }
+int square(int x) { return x * x; }
+int norm(point_t p) { return square(p.x) + square(p.y); }
+int parity_norm(point_t p) { return is_even(norm(p)); }
+"""
+
+
+class TestChunking(unittest.TestCase):
+    def setUp(self):
+        self.ast = from_pycparser(c_parser.CParser().parse(SOURCE))
+
+    def test_cycle_is_one_unit(self):
+        """
+        Test that mutually recursive functions end up in a single unit
+        """
+        _, functions = split_units(self.ast)
+        components = get_strong_components(get_call_graph(functions))
+
+        self.assertIn(["is_even", "is_odd"], [sorted(component) for component in components])
+        self.assertEqual(len(components), 4)
+
+    def test_levels(self):
+        """
+        Test that callees come in earlier levels than their callers
+        """
+        _, functions = split_units(self.ast)
+        levels = get_dependency_levels(get_call_graph(functions))
+
+        self.assertEqual(
+            [sorted(sorted(unit) for unit in level) for level in levels],
+            [[["is_even", "is_odd"], ["square"]], [["norm"]], [["parity_norm"]]]
+        )
+
+    def test_translation_order(self):
+        """
+        Test that units are translated level by level with the code of their
+        callees in the context and stitched in source order
+        """
+        async def translate_unit(translation, unit, functions, context, llm_client, limit):
+            calls.append((unit, stitch_code(context)))
+            return "\n".join(f"fn {name}() {{}}" for name in unit)
+
+        async def translate_prelude(translation, prelude, llm_client):
+            return "struct Point { x: i32, y: i32 }"
+
+        async def verify(translation, code, llm_client):
+            return code
+
+        calls = []
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            meta_file = f"{tmp_dir}/a.ast"
+            with open(meta_file, 'w') as f:
+                json.dump(self.ast, f)
+            with patch.object(ChunkedTranslation, "translate_unit", translate_unit), \
+                    patch.object(ChunkedTranslation, "translate_prelude", translate_prelude), \
+                    patch.object(ChunkedTranslation, "verify", verify):
+                code = asyncio.run(ChunkedTranslation(meta_file, f"{tmp_dir}/a.rs", None).arun(None))
+
+        by_unit = {"+".join(sorted(unit)): context for unit, context in calls}
+        self.assertEqual(set(by_unit), {"is_even+is_odd", "square", "norm", "parity_norm"})
+        self.assertIn("fn square()", by_unit["norm"])
+        self.assertIn("fn is_even()", by_unit["parity_norm"])
+        self.assertIn("fn norm()", by_unit["parity_norm"])
+        self.assertEqual(
+            [line.split("(")[0] for line in code.splitlines() if line.startswith("fn ")],
+            ["fn is_even", "fn is_odd", "fn square", "fn norm", "fn parity_norm"]
+        )
+
+    def test_stitch_code(self):
+        """
+        Test that imports are merged to the top and repeated items are dropped
+        """
+        code = stitch_code([
+            "use std::ffi::c_int;\n#[repr(C)]\npub struct Point { x: i32 }\n\nimpl Point {\n    fn x(&self) {}\n}",
+            "use std::ffi::c_int;\nuse std::ptr;\n\n#[repr(C)]\npub struct Point { x: i32 }\n\n"
+            "impl Point {\n    fn x(&self) {}\n}\n\nimpl Point {\n    fn y(&self) {}\n}\n\nfn norm() {}",
+        ])
+
+        self.assertEqual(code, (
+            "use std::ffi::c_int;\nuse std::ptr;\n\n"
+            "#[repr(C)]\npub struct Point { x: i32 }\n\nimpl Point {\n    fn x(&self) {}\n}\n\n"
+            "impl Point {\n    fn y(&self) {}\n}\n\nfn norm() {}\n"
+        ))
+
+
+if __name__ == '__main__':
+    unittest.main()
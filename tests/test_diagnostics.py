@@ -0,0 +1,105 @@
+import json
+import unittest
+
+from sorcestone.utils.diagnostics import (
+    format_diagnostics, get_items, parse_compiler_output, summarize_test_failures
+)
+
+
+SOURCE = """#[unsafe(no_mangle)]
+pub extern "C" fn add(a: i32, b: i32) -> i32 {
+    a + b + y
+}
+
+impl Point {
+    fn norm(&self) -> i64 { self.x }
+}
+"""
+
+
+def cargo_message(message, code, line, column, text, label=None, children=()):
+    return json.dumps({
+        "reason": "compiler-message",
+        "message": {
+            "level": "error",
+            "message": message,
+            "code": {"code": code, "explanation": "Long explanation"},
+            "spans": [{"is_primary": True, "line_start": line, "column_start": column,
+                       "label": label, "text": [{"text": text}]}],
+            "children": list(children),
+        }
+    })
+
+
+class TestDiagnostics(unittest.TestCase):
+    def test_cargo_messages(self):
+        """
+        Test that cargo errors are deduplicated and mapped to items
+        """
+        stdout = "\n".join([
+            "=== Build ===",
+            cargo_message("cannot find value `y` in this scope", "E0425", 3, 13, "    a + b + y", children=[
+                {"level": "help", "message": "a local variable with a similar name exists",
+                 "spans": [{"suggested_replacement": "a"}]}
+            ]),
+            cargo_message("cannot find value `y` in this scope", "E0425", 3, 13, "    a + b + y"),
+            cargo_message("mismatched types", "E0308", 7, 29, "    fn norm(&self) -> i64 { self.x }",
+                          label="expected `i64`, found `i32`"),
+            json.dumps({"reason": "compiler-message", "message": {
+                "level": "error", "message": "aborting due to 2 previous errors", "code": None, "spans": []
+            }}),
+            json.dumps({"reason": "build-finished", "success": False}),
+        ])
+        diagnostics = parse_compiler_output(stdout, "error: could not compile", SOURCE)
+        self.assertEqual([d["item"] for d in diagnostics], ["fn add", "fn norm"])
+        self.assertEqual(format_diagnostics(diagnostics), "\n".join([
+            "error[E0425] in fn add, line 3:13: cannot find value `y` in this scope",
+            "    a + b + y",
+            "    help: a local variable with a similar name exists ('a')",
+            "error[E0308] in fn norm, line 7:29: mismatched types",
+            "    fn norm(&self) -> i64 { self.x }  <- expected `i64`, found `i32`",
+        ]))
+
+    def test_gcc_messages(self):
+        """
+        Test that gcc errors are parsed when there are no cargo messages
+        """
+        stderr = "a.c: In function 'add':\na.c:2:12: error: 'y' undeclared (first use in this function)\n"
+        diagnostics = parse_compiler_output("", stderr, "int add(int a) {\n    return y;\n}\n")
+        self.assertEqual(format_diagnostics(diagnostics), "\n".join([
+            "error in line 2:12: 'y' undeclared (first use in this function)",
+            "    return y;",
+        ]))
+
+    def test_items(self):
+        """
+        Test Rust item lookup
+        """
+        self.assertEqual(get_items(SOURCE), [(2, "fn add"), (6, "impl Point"), (7, "fn norm")])
+        self.assertEqual(get_items("impl<T> Display for Wrapper<T> where T: Copy {\n}\n"), [(1, "impl Wrapper")])
+
+    def test_test_failures(self):
+        """
+        Test that test failures with the same error are grouped
+        """
+        traceback = (
+            'Traceback (most recent call last):\n'
+            '  File "t.py", line 9, in test_one\n'
+            '    self.assertEqual(lib.add(1, 2), 3)\n'
+            '  File "/usr/lib/python3/unittest/case.py", line 873, in assertEqual\n'
+            '    assertion_func(first, second, msg=msg)\n'
+            'AssertionError: 4 != 3\n'
+        )
+        tests = [
+            {"name": "T.test_one", "status": "failed", "error": "AssertionError: 4 != 3", "traceback": traceback},
+            {"name": "T.test_two", "status": "failed", "error": "AssertionError: 4 != 3", "traceback": None},
+            {"name": "T.test_three", "status": "passed", "error": None, "traceback": None},
+        ]
+        self.assertEqual(summarize_test_failures(tests), [
+            "FAILED T.test_one, T.test_two: AssertionError: 4 != 3",
+            "    at test_one line 9: self.assertEqual(lib.add(1, 2), 3)",
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+import os
+import shutil
+import tempfile
+import unittest
+import subprocess
+from unittest.mock import patch
+
+import cffi
+from pycparser import c_parser
+
+from sorcestone.utils.ast_render import from_pycparser
+from sorcestone.main import fuzz
+from sorcestone.main.fuzz import FuzzStage, get_fuzz_signatures, get_failures, run_fuzz, get_shrink_candidates
+
+
+SOURCE = """
+typedef unsigned long size_t;
+int clamp(int x) { return x > 1000 ? 1000 : x; }
+void negate(int *values, size_t n) { for (size_t i = 0; i < n; i++) values[i] = -values[i]; }
+long total(const int *values, int n) { long s = 0; for (int i = 0; i < n; i++) s += values[i]; return s; }
+int safe_div(int x) { return 1000 / x; }
+static int hidden(int v) { return v; }
+void log_value(const int *value) { }
+"""
+
+# Translation with an off by one in clamp, negate skipping large values and
+# a crash where the source divides by -10
+TRANSLATION = """
+typedef unsigned long size_t;
+int clamp(int x) { return x > 1001 ? 1000 : x; }
+void negate(int *values, size_t n) { for (size_t i = 0; i < n; i++) values[i] = values[i] > 5000 ? values[i] : -values[i]; }
+long total(const int *values, int n) { long s = 0; for (int i = 0; i < n; i++) s += values[i]; return s; }
+int safe_div(int x) { if (x == -10) { volatile int *p = 0; return *p; } return 1000 / x; }
+"""
+
+
+class TestFuzz(unittest.TestCase):
+    def test_signatures(self):
+        """
+        Test that arrays are paired with their lengths and constants are collected
+        """
+        signatures = get_fuzz_signatures(from_pycparser(c_parser.CParser().parse(SOURCE)))
+        by_name = {signature["name"]: signature for signature in signatures}
+
+        self.assertNotIn("hidden", by_name)
+        self.assertEqual(by_name["clamp"]["constants"], [1000])
+        self.assertEqual([(param["kind"], param["ctype"]) for param in by_name["negate"]["params"]],
+                         [("array", "c_int"), ("length", "c_size_t")])
+        self.assertTrue(by_name["total"]["params"][0]["const"])
+        self.assertIn("skipped", by_name["log_value"])
+
+    def test_shrink_candidates(self):
+        """
+        Test that shrinking keeps lengths in sync with arrays
+        """
+        signature = get_fuzz_signatures(from_pycparser(c_parser.CParser().parse(SOURCE)))[1]
+        candidates = list(get_shrink_candidates(signature, [[7, 9], 2]))
+
+        self.assertEqual(candidates[:2], [[[7], 1], [[9], 1]])
+        self.assertIn([[0, 9], 2], candidates)
+
+    @unittest.skipUnless(shutil.which('gcc'), "gcc is not available")
+    def test_drivers_match_single_calls(self):
+        """
+        Test that batches called through the C loops give the same results
+        as calling the function once per case
+        """
+        signatures = [signature for signature in get_fuzz_signatures(from_pycparser(c_parser.CParser().parse(SOURCE)))
+                      if "skipped" not in signature]
+        cases = {
+            "clamp": [[1], [2000], [-5]],
+            "negate": [[[1, 2], 2], [[], 0], [[7], 1]],
+            "total": [[[3, 4], 2], [[], 0]],
+            "safe_div": [[5], [-7]],
+        }
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            source = os.path.join(tmp_dir, "src.c")
+            with open(source, 'w') as f:
+                f.write(SOURCE)
+            lib = os.path.join(tmp_dir, "src.so")
+            subprocess.run(['gcc', '-O1', '-fwrapv', '-shared', '-fPIC', source, '-o', lib], check=True)
+
+            ffi = cffi.FFI()
+            ffi.cdef(fuzz.get_cdef(signatures))
+            src_lib = ffi.dlopen(lib)
+            drivers = fuzz.load_drivers(ffi, signatures, tmp_dir)
+            self.assertIsNotNone(drivers)
+            for signature in signatures:
+                batched = fuzz.Runner(ffi, src_lib, src_lib, signature, drivers=drivers)
+                single = fuzz.Runner(ffi, src_lib, src_lib, signature)
+                copies = [[list(value) if isinstance(value, list) else value for value in case]
+                          for case in cases[signature["name"]]]
+                self.assertEqual(batched.call_all(batched.src_func, cases[signature["name"]]),
+                                 single.call_all(single.src_func, copies))
+
+    @unittest.skipUnless(shutil.which('gcc'), "gcc is not available")
+    def test_counterexamples(self):
+        """
+        Test that differences are found and minimized, crashes of the
+        source are not counted as counterexamples
+        """
+        signatures = get_fuzz_signatures(from_pycparser(c_parser.CParser().parse(SOURCE)))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            libs = []
+            for name, code in [("src", SOURCE), ("dst", TRANSLATION)]:
+                source = os.path.join(tmp_dir, f"{name}.c")
+                with open(source, 'w') as f:
+                    f.write(code)
+                libs.append(os.path.join(tmp_dir, f"{name}.so"))
+                subprocess.run(['gcc', '-O1', '-fwrapv', '-shared', '-fPIC', source, '-o', libs[-1]], check=True)
+
+            results = run_fuzz(libs[0], libs[1], signatures, cases=5000, seed=1)
+
+        by_name = {result["name"]: result for result in results}
+        self.assertEqual([result["name"] for result in get_failures(results)], ["clamp", "negate", "safe_div"])
+        self.assertEqual(by_name["clamp"]["counterexamples"][0]["args"], [1001])
+        self.assertEqual(by_name["negate"]["counterexamples"],
+                         [{"args": [[5001], 1], "expected": (None, ([-5001],)), "actual": (None, ([5001],))}])
+        self.assertEqual(by_name["safe_div"]["counterexamples"][0]["args"], [-10])
+        self.assertEqual(by_name["safe_div"]["counterexamples"][0]["actual"], "crash")
+        self.assertGreater(by_name["safe_div"]["source_crashes"], 0)
+        self.assertGreaterEqual(by_name["total"]["cases"], 5000)
+
+    @unittest.skipUnless(shutil.which('gcc'), "gcc is not available")
+    def test_function_timeout(self):
+        """
+        Test that every function stops at its own timeout with the results
+        found so far
+        """
+        signatures = [signature for signature in get_fuzz_signatures(from_pycparser(c_parser.CParser().parse(SOURCE)))
+                      if signature["name"] in ("clamp", "total")]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            source = os.path.join(tmp_dir, "src.c")
+            with open(source, 'w') as f:
+                f.write(SOURCE)
+            lib = os.path.join(tmp_dir, "src.so")
+            subprocess.run(['gcc', '-O1', '-fwrapv', '-shared', '-fPIC', source, '-o', lib], check=True)
+
+            results = run_fuzz(lib, lib, signatures, cases=10 ** 9, seed=1, function_timeout=0.5)
+
+        self.assertEqual([result["name"] for result in results], ["clamp", "total"])
+        for result in results:
+            self.assertTrue(result["timed_out"])
+            self.assertGreater(result["cases"], 0)
+            self.assertLess(result["seconds"], 5)
+
+    def test_measure_error(self):
+        """
+        Test that fuzzing which fails to run is reported as an error of
+        every function instead of failing the stage
+        """
+        signatures = get_fuzz_signatures(from_pycparser(c_parser.CParser().parse(SOURCE)))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            stage = FuzzStage(f"{tmp_dir}/a.ast", f"{tmp_dir}/src.so", f"{tmp_dir}/a.rs", f"{tmp_dir}/test.py")
+            with patch("sorcestone.main.fuzz.run_fuzz", side_effect=Exception("Fuzzing process crashed")):
+                results = stage.report(signatures)
+
+        by_name = {result["name"]: result for result in results}
+        self.assertEqual(by_name["clamp"], {"name": "clamp", "error": "Fuzzing process crashed"})
+        self.assertIn("skipped", by_name["log_value"])
+        self.assertEqual(get_failures(results), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
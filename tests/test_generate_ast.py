@@ -0,0 +1,55 @@
+import time
+import subprocess
+import unittest
+from concurrent.futures import Future
+from unittest.mock import Mock, patch
+
+from sorcestone.main import generate_ast
+
+
+class TestGenerateAst(unittest.TestCase):
+    @patch("sorcestone.main.generate_ast.PARSE_TIMEOUT", 0.1)
+    @patch("sorcestone.main.generate_ast.PARSE_GRACE", 0)
+    @patch("sorcestone.main.generate_ast.run_parse_script")
+    @patch("sorcestone.main.generate_ast.get_parser_pool")
+    def test_pool_timeout_falls_back(self, get_parser_pool, run_parse_script):
+        """
+        Test that a parser server which does not answer is replaced by parse.sh
+        """
+        pool = Mock()
+        pool.submit.return_value = Future()
+        get_parser_pool.return_value = pool
+        run_parse_script.return_value = subprocess.CompletedProcess(args=[], returncode=0, stdout="", stderr="")
+
+        result = generate_ast.generate_ast("a.c", "C", output_file="a.ast")
+
+        self.assertIs(result, run_parse_script.return_value)
+        self.assertEqual(run_parse_script.call_args[0][1:3], ("a.c", "a.ast"))
+        self.assertEqual(pool.submit.call_args[0][:2], ("a.c", "a.ast"))
+        pool.forget.assert_called_once_with(pool.submit.return_value)
+
+    @patch("sorcestone.main.generate_ast.PARSE_TIMEOUT", 0.2)
+    @patch("sorcestone.main.generate_ast.PARSE_GRACE", 0)
+    @patch("sorcestone.main.generate_ast.run_parse_script")
+    @patch("sorcestone.main.generate_ast.get_parser_pool")
+    def test_index_sources_share_deadline(self, get_parser_pool, run_parse_script):
+        """
+        Test that indexing waits for all stuck jobs together, not one
+        PARSE_TIMEOUT after another
+        """
+        pool = Mock()
+        pool.submit.side_effect = lambda *args, **kwargs: Future()
+        get_parser_pool.return_value = pool
+        run_parse_script.return_value = subprocess.CompletedProcess(args=[], returncode=0, stdout="", stderr="")
+
+        started = time.monotonic()
+        failed = generate_ast.index_sources(["a.c", "b.c", "c.c"], "C", "index.db")
+
+        self.assertEqual(failed, [])
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual(pool.forget.call_count, 3)
+        self.assertEqual(run_parse_script.call_count, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
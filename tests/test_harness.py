@@ -0,0 +1,109 @@
+import os
+import tempfile
+import unittest
+
+from sorcestone.utils import harness
+
+
+TEST_FILE = """
+import sys
+
+def test_pass():
+    assert sys.argv[1:] == ["lib.so", "C"]
+
+def test_handled():
+    try:
+        raise ValueError("handled")
+    except ValueError:
+        pass
+
+def test_fail():
+    assert 1 + 1 == 3, "wrong sum"
+
+for test in [test_pass, test_handled, test_fail]:
+    try:
+        test()
+    except AssertionError:
+        pass
+print("done")
+sys.exit(1)
+"""
+
+
+class TestHarness(unittest.TestCase):
+    def setUp(self):
+        """
+        Set up test server and a folder for test files
+        """
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.runner = harness.TestRunner()
+
+    def tearDown(self):
+        self.runner.close()
+        self.tmp_dir.cleanup()
+
+    def _write(self, content):
+        path = os.path.join(self.tmp_dir.name, 'sample_test.py')
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_per_test_results(self):
+        """
+        Test that every test function is reported with its status
+        """
+        result = self.runner.submit(self._write(TEST_FILE), ["lib.so", "C"]).result()
+
+        self.assertEqual(result.returncode, 1)
+        self.assertEqual(result.stdout, "done\n")
+        self.assertEqual(
+            [(test["name"], test["status"]) for test in result.tests],
+            [("test_pass", "passed"), ("test_handled", "passed"), ("test_fail", "failed")]
+        )
+        self.assertEqual(result.tests[2]["error"], "AssertionError: wrong sum")
+        self.assertIn("FAILED test_fail: AssertionError: wrong sum", result.get_message())
+
+    def test_exit_code_without_failed_tests(self):
+        """
+        Test that a script failing outside of traced tests reports its exit
+        code and output
+        """
+        script = "import sys\n\ndef test_ok():\n    pass\n\ntest_ok()\nprint('add(1, 2): expected 3, got 4')\nsys.exit(1)\n"
+        message = self.runner.submit(self._write(script)).result().get_message()
+
+        self.assertIn("Tests: 1 passed, 0 failed", message)
+        self.assertIn("Test script exited with code 1", message)
+        self.assertIn("add(1, 2): expected 3, got 4", message)
+
+    def test_crash_is_isolated(self):
+        """
+        Test that a crashing run is reported and the server keeps working
+        """
+        crash = self._write("import ctypes\nctypes.string_at(0)\n")
+        result = self.runner.submit(crash).result()
+
+        self.assertEqual(result.returncode, -11)
+        self.assertIn("SIGSEGV", result.stderr)
+        self.assertEqual(self.runner.submit(self._write("pass\n")).result().returncode, 0)
+
+    def test_missing_result_fails(self):
+        """
+        Test that a run exiting before it reports its result is a failure
+        """
+        result = self.runner.submit(self._write("import os\nos._exit(0)\n")).result()
+
+        self.assertEqual(result.returncode, 1)
+        self.assertIn("without reporting", result.stderr)
+
+    def test_timeout(self):
+        """
+        Test that a hanging run is killed
+        """
+        result = self.runner.submit(self._write("while True:\n    pass\n"), timeout=0.5).result()
+
+        self.assertEqual(result.returncode, 124)
+        self.assertIn("timed out", result.stderr)
+
+
+if __name__ == '__main__':
+    unittest.main()
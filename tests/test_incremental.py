@@ -0,0 +1,183 @@
+import json
+import asyncio
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from pycparser import c_parser
+
+from sorcestone.utils.ast_render import from_pycparser
+from sorcestone.utils.ast_utils import get_dependents
+from sorcestone.utils.code_utils import get_rust_items, splice_items
+from sorcestone.main.incremental import IncrementalTranslation, get_changes, get_decl_hashes, get_translated_items
+
+
+def func_def(name, calls=()):
+    return {
+        '_nodetype': 'FuncDef',
+        'decl': {'_nodetype': 'Decl', 'name': name},
+        'body': {'_nodetype': 'Compound', 'block_items': [
+            {'_nodetype': 'FuncCall', 'name': {'_nodetype': 'ID', 'name': call}, 'args': None}
+            for call in calls
+        ]}
+    }
+
+
+RUST_CODE = '''use std::os::raw::c_int;
+
+/// Adds
+#[no_mangle]
+pub extern "C" fn add(a: c_int, b: c_int) -> c_int {
+    let brace = '}';
+    a + b
+}
+
+pub struct Point {
+    x: c_int,
+}
+
+impl Point {
+    fn new() -> Self { Point { x: 0 } }
+}
+
+static LIMIT: c_int = 10;
+'''
+
+OLD_SOURCE = """
+typedef struct point { int x; int y; } point_t;
+struct pair { int a; int b; };
+int is_odd(int n);
+int is_even(int n) { return n == 0 ? 1 : is_odd(n - 1); }
+int is_odd(int n) { return n == 0 ? 0 : is_even(n - 1); }
+int square(int x) { return x * x; }
+int norm(point_t p) { return square(p.x) + square(p.y); }
+int parity_norm(point_t p) { return is_even(norm(p)); }
+int unused(int x) { return x; }
+"""
+
+# square changed, struct pair and unused removed
+NEW_SOURCE = """
+typedef struct point { int x; int y; } point_t;
+int is_odd(int n);
+int is_even(int n) { return n == 0 ? 1 : is_odd(n - 1); }
+int is_odd(int n) { return n == 0 ? 0 : is_even(n - 1); }
+int square(int x) { return x * x + 0; }
+int norm(point_t p) { return square(p.x) + square(p.y); }
+int parity_norm(point_t p) { return is_even(norm(p)); }
+"""
+
+OLD_TRANSLATION = """#[repr(C)]
+pub struct Point { x: i32, y: i32 }
+
+#[repr(C)]
+pub struct Pair { a: i32, b: i32 }
+
+impl Pair {
+    fn sum(&self) -> i32 { self.a + self.b }
+}
+
+pub extern "C" fn is_even(n: i32) -> i32 { 0 }
+
+pub extern "C" fn is_odd(n: i32) -> i32 { 0 }
+
+pub extern "C" fn square(x: i32) -> i32 { 0 }
+
+pub extern "C" fn norm(p: Point) -> i32 { 0 }
+
+pub extern "C" fn parity_norm(p: Point) -> i32 { 0 }
+
+pub extern "C" fn unused(x: i32) -> i32 { 0 }
+"""
+
+
+class TestIncremental(unittest.TestCase):
+    def test_rust_items(self):
+        """
+        Test that items are found with their attributes and doc comments
+        """
+        items = get_rust_items(RUST_CODE)
+        self.assertEqual([item['key'] for item in items], ['add', 'Point', 'impl Point', 'LIMIT'])
+        add = RUST_CODE[items[0]['start']:items[0]['end']]
+        self.assertTrue(add.startswith('/// Adds\n#[no_mangle]\n'))
+        self.assertTrue(add.endswith('    a + b\n}\n'))
+
+    def test_splice_items(self):
+        """
+        Test that items are replaced in place, added and removed
+        """
+        code = splice_items(RUST_CODE, [
+            'use std::ffi::c_long;\n\n#[no_mangle]\npub extern "C" fn add(a: c_int, b: c_int) -> c_int { b + a }\n',
+            'fn sub(a: c_int, b: c_int) -> c_int { a - b }\n',
+        ], removed={'LIMIT'})
+        self.assertTrue(code.startswith('use std::ffi::c_long;\nuse std::os::raw::c_int;\n'))
+        self.assertIn('pub extern "C" fn add(a: c_int, b: c_int) -> c_int { b + a }\n', code)
+        self.assertNotIn('/// Adds', code)
+        self.assertNotIn('LIMIT', code)
+        self.assertLess(code.index('fn add'), code.index('struct Point'))
+        self.assertTrue(code.endswith('fn sub(a: c_int, b: c_int) -> c_int { a - b }\n'))
+
+    def test_dependents(self):
+        """
+        Test that callers of changed functions are found transitively
+        """
+        decls = {
+            'add': func_def('add'),
+            'twice': func_def('twice', ['add']),
+            'quad': func_def('quad', ['twice']),
+            'sub': func_def('sub'),
+        }
+        self.assertEqual(get_dependents(decls, {'add'}), {'twice', 'quad'})
+        self.assertEqual(get_dependents(decls, {'sub'}), set())
+
+    def test_changes(self):
+        """
+        Test that changed, added and removed declarations are told apart
+        """
+        changed, removed = get_changes({'add': '1', 'sub': '2', 'mul': '3'}, {'add': '1', 'sub': '4', 'div': '5'})
+        self.assertEqual(changed, {'sub', 'div'})
+        self.assertEqual(removed, {'mul'})
+
+    def test_translated_items(self):
+        """
+        Test that declarations are matched with the Rust items translated
+        from them, whatever their naming convention
+        """
+        self.assertEqual(get_translated_items({'struct pair', 'point_t', 'unused'}, OLD_TRANSLATION),
+                         {'Point', 'Pair', 'impl Pair', 'unused'})
+
+    def test_translation_order(self):
+        """
+        Test that only changed declarations and their dependents are
+        translated and the items of removed declarations are dropped
+        """
+        async def translate_unit(translation, unit, functions, context, llm_client, limit):
+            calls.append(unit)
+            return "\n".join(f'pub extern "C" fn {name}() -> i32 {{ 1 }}' for name in unit)
+
+        async def verify(translation, code, llm_client):
+            return code
+
+        old_ast = from_pycparser(c_parser.CParser().parse(OLD_SOURCE))
+        calls = []
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            meta_file, dst_file = f"{tmp_dir}/a.ast", f"{tmp_dir}/a.rs"
+            with open(meta_file, 'w') as f:
+                json.dump(from_pycparser(c_parser.CParser().parse(NEW_SOURCE)), f)
+            with open(dst_file, 'w') as f:
+                f.write(OLD_TRANSLATION)
+            translation = IncrementalTranslation(meta_file, dst_file, None, previous_hashes=get_decl_hashes(old_ast))
+            with patch.object(IncrementalTranslation, "translate_unit", translate_unit), \
+                    patch.object(IncrementalTranslation, "verify", verify), \
+                    patch.object(IncrementalTranslation, "_compile_stage") as compile_stage:
+                code = asyncio.run(translation.arun(None))
+
+        compile_stage.assert_not_called()
+        self.assertEqual(calls, [["square"], ["norm"], ["parity_norm"]])
+        self.assertEqual([item['key'] for item in get_rust_items(code)],
+                         ['Point', 'is_even', 'is_odd', 'square', 'norm', 'parity_norm'])
+        self.assertIn('fn square() -> i32 { 1 }', code)
+        self.assertIn('fn is_even(n: i32) -> i32 { 0 }', code)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,11 @@
+import os
+import json
+import time
+import asyncio
+import tempfile
 import unittest
-from unittest.mock import Mock, patch
-from sorcestone.main.iteration import Iteration
+from unittest.mock import Mock, AsyncMock, patch
+from sorcestone.main.iteration import Iteration, IterationPolicy, IterationBudgetExceeded
 
 
 class TestIteration(unittest.TestCase):
@@ -124,5 +129,159 @@ class TestIteration(unittest.TestCase):
         # Verify LLM client was called multiple times
         self.assertEqual(self.mock_llm_client.send_message.call_count, 2)
 
+    def test_arun_with_async_client_and_callback(self):
+        """
+        Test async run uses async LLM client and async validation callback
+        """
+        llm_client = Mock(spec=['asend_message'])
+        llm_client.asend_message = AsyncMock(side_effect=["First attempt", "Improved solution"])
+        validation_calls = [(1, "Needs improvement"), (0, "done")]
+
+        async def mock_validation(result):
+            return validation_calls.pop(0)
+
+        iteration = Iteration(
+            initial_query=self.initial_query,
+            async_validation_callback=mock_validation
+        )
+
+        with patch.object(iteration, 'ask_feedback', return_value=""):
+            result = asyncio.run(iteration.arun(llm_client))
+
+        self.assertEqual(result, "done")
+        self.assertEqual(llm_client.asend_message.await_count, 2)
+        self.assertIn("Error: Needs improvement", llm_client.asend_message.await_args.args[0])
+
+    def test_arun_with_sync_client_and_callback(self):
+        """
+        Test async run falls back to blocking client and callback in threads
+        """
+        llm_client = Mock(spec=['send_message'])
+        llm_client.send_message.return_value = "Python function solution"
+
+        iteration = Iteration(
+            initial_query=self.initial_query,
+            validation_callback=lambda result: (0, result)
+        )
+
+        with patch.object(iteration, 'ask_feedback', return_value=""):
+            result = asyncio.run(iteration.arun(llm_client))
+
+        self.assertEqual(result, "Python function solution")
+        llm_client.send_message.assert_called_once_with(self.initial_query)
+
+    def test_run_with_messages_client(self):
+        """
+        Test that chat clients get the stable prefix plus only the latest rounds
+        """
+        llm_client = Mock(spec=['send_messages', 'supports_messages'])
+        llm_client.supports_messages = True
+        sent = []
+        llm_client.send_messages.side_effect = lambda messages: sent.append(messages) or f"Attempt {len(sent)}"
+        validation_calls = [(1, "First error"), (1, "Second error"), (0, "done")]
+
+        iteration = Iteration(
+            initial_query=self.initial_query,
+            validation_callback=lambda result: validation_calls.pop(0),
+            history_window=1
+        )
+
+        with patch.object(iteration, 'ask_feedback', return_value=""):
+            result = iteration.run(llm_client)
+
+        self.assertEqual(result, "done")
+        self.assertEqual(sent[0][0]["content"][0]["text"], self.initial_query)
+        self.assertIn("cache_control", sent[0][0]["content"][0])
+        self.assertEqual(
+            [message["content"] for message in sent[2][1:]],
+            ["Attempt 2", "Error: Second error"]
+        )
+
+    def test_history_window_limits_query(self):
+        """
+        Test that the flat query only carries errors of the latest rounds
+        """
+        llm_client = Mock(spec=['send_message'])
+        llm_client.send_message.return_value = "Attempt"
+        validation_calls = [(1, "First error"), (1, "Second error"), (0, "done")]
+
+        iteration = Iteration(
+            initial_query=self.initial_query,
+            validation_callback=lambda result: validation_calls.pop(0),
+            history_window=1
+        )
+
+        with patch.object(iteration, 'ask_feedback', return_value=""):
+            iteration.run(llm_client)
+
+        query = llm_client.send_message.call_args.args[0]
+        self.assertNotIn("First error", query)
+        self.assertIn("Second error", query)
+        self.assertEqual(iteration.log, ["Error: done"])
+        self.assertEqual(iteration.round_count, 3)
+
+    @patch('builtins.input')
+    def test_autopilot_accepts_without_feedback(self, mock_input):
+        """
+        Test that autopilot never asks for feedback and queues the result
+        """
+        llm_client = Mock(spec=['send_message'])
+        llm_client.send_message.side_effect = ["First attempt", "Improved solution"]
+        validation_calls = [(1, "Needs improvement"), (0, "done")]
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            review_queue = os.path.join(tmp_dir, "review.jsonl")
+            iteration = Iteration(
+                initial_query=self.initial_query,
+                validation_callback=lambda result: validation_calls.pop(0),
+                name="stage",
+                policy=IterationPolicy(interactive=False, review_queue=review_queue)
+            )
+
+            result = iteration.run(llm_client)
+            with open(review_queue) as f:
+                records = [json.loads(line) for line in f]
+
+        self.assertEqual(result, "done")
+        mock_input.assert_not_called()
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]["status"], "accepted")
+        self.assertEqual(records[0]["rounds"], 2)
+        self.assertEqual(records[0]["response"], "Improved solution")
+
+    def test_max_rounds_budget(self):
+        """
+        Test that stage fails once it runs out of rounds
+        """
+        llm_client = Mock(spec=['send_message'])
+        llm_client.send_message.return_value = "Attempt"
+
+        iteration = Iteration(
+            initial_query=self.initial_query,
+            validation_callback=lambda result: (1, "Still broken"),
+            policy=IterationPolicy(interactive=False, max_rounds=2)
+        )
+
+        with self.assertRaises(IterationBudgetExceeded):
+            iteration.run(llm_client)
+        self.assertEqual(llm_client.send_message.call_count, 2)
+
+    def test_max_seconds_counts_first_request(self):
+        """
+        Test that time spent waiting for the first response counts against the budget
+        """
+        llm_client = Mock(spec=['send_message'])
+        llm_client.send_message.side_effect = lambda query: time.sleep(0.2) or "Attempt"
+
+        iteration = Iteration(
+            initial_query=self.initial_query,
+            validation_callback=lambda result: (1, "Still broken"),
+            policy=IterationPolicy(interactive=False, max_seconds=0.1)
+        )
+
+        with self.assertRaises(IterationBudgetExceeded):
+            iteration.run(llm_client)
+        self.assertEqual(llm_client.send_message.call_count, 1)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,83 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import Mock, patch
+
+from sorcestone.utils.llm_cache import CachedClient, ResponseStore, round_context
+
+
+class TestCachedClient(unittest.TestCase):
+    def setUp(self):
+        """
+        Set up a response store in a temporary folder
+        """
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, 'responses.sqlite')
+        self.client = Mock(spec=['send_message'])
+        self.client.send_message.side_effect = ["first", "second"]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _cached_client(self, model='model', **kwargs):
+        return CachedClient(
+            self.client, vendor='vendor', model=model,
+            store=ResponseStore(self.db_path, **kwargs)
+        )
+
+    def test_replay_identical_prompt(self):
+        """
+        Test that identical prompt is answered from the store
+        """
+        client = self._cached_client()
+
+        self.assertEqual(client.send_message("prompt"), "first")
+        self.assertEqual(self._cached_client().send_message("prompt"), "first")
+        self.client.send_message.assert_called_once_with("prompt")
+
+    def test_round_is_part_of_the_key(self):
+        """
+        Test that a round repeating the prompt of a failed round is not
+        answered with the failed response, but reruns replay every round
+        """
+        for number in (1, 2):
+            with round_context(number):
+                self._cached_client().send_message("prompt")
+
+        for number, expected in [(1, "first"), (2, "second")]:
+            with round_context(number):
+                self.assertEqual(self._cached_client().send_message("prompt"), expected)
+        self.assertEqual(self.client.send_message.call_count, 2)
+
+    def test_model_is_part_of_the_key(self):
+        """
+        Test that other model does not get cached responses
+        """
+        self._cached_client().send_message("prompt")
+
+        self.assertEqual(self._cached_client(model='other').send_message("prompt"), "second")
+
+    def test_expired_response_is_not_used(self):
+        """
+        Test that responses older than ttl are sent again
+        """
+        client = self._cached_client(ttl=60)
+        client.send_message("prompt")
+
+        with patch('sorcestone.utils.llm_cache.time.time', return_value=10 ** 10):
+            self.assertEqual(client.send_message("prompt"), "second")
+
+    def test_size_limit_evicts_least_recently_used(self):
+        """
+        Test that store drops old responses above max_size
+        """
+        store = ResponseStore(self.db_path, max_size=10)
+        store.put("a", "123456")
+        store.put("b", "123456")
+
+        self.assertIsNone(store.get("a"))
+        self.assertEqual(store.get("b"), "123456")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import os
+import threading
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+
+from sorcestone.utils.logger import logger, get_log_path
+
+
+def log_in_worker(message):
+    logger.info(message)
+    return os.getpid()
+
+
+class TestLogger(unittest.TestCase):
+    def test_worker_log_file(self):
+        """
+        Test that a multiprocessing worker writes its own log file
+        """
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            pid = executor.submit(log_in_worker, "record of the worker").result()
+
+        with open(get_log_path(f"convertor_{pid}")) as f:
+            self.assertIn("record of the worker", f.read())
+
+    def test_short_lived_fork(self):
+        """
+        Test that a plain fork starts no listener thread and opens no log file
+        """
+        pid = os.fork()
+        if pid == 0:
+            logger.info("record of the fork")
+            started = threading.active_count() > 1 or os.path.exists(get_log_path(f"convertor_{os.getpid()}"))
+            os._exit(1 if started else 0)
+
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import Mock
+
+from sorcestone.main.manifest import Manifest, get_source_inputs
+
+
+class TestManifest(unittest.TestCase):
+    def setUp(self):
+        """
+        Set up a manifest and a stage producing a file
+        """
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.manifest_path = os.path.join(self.tmp_dir.name, 'a.manifest.json')
+        self.output = os.path.join(self.tmp_dir.name, 'a.out')
+        self.stage = Mock(side_effect=lambda: self._write('a.out', 'result'))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _write(self, name, content):
+        path = os.path.join(self.tmp_dir.name, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def _run(self, inputs, **kwargs):
+        return Manifest(self.manifest_path).run_stage('stage', inputs, [self.output], self.stage, **kwargs)
+
+    def test_up_to_date_stage_is_skipped(self):
+        """
+        Test that stage runs again only when needed
+        """
+        self.assertTrue(self._run({"source": "1"}))
+        self.assertFalse(self._run({"source": "1"}))
+        self.assertTrue(self._run({"source": "1"}, force=True))
+        self.assertTrue(self._run({"source": "2"}))
+        self.assertEqual(self.stage.call_count, 3)
+
+    def test_changed_output_is_rebuilt(self):
+        """
+        Test that stage runs again when its output was modified or removed
+        """
+        self._run({"source": "1"})
+        self._write('a.out', 'edited')
+        self.assertTrue(self._run({"source": "1"}))
+        os.remove(self.output)
+        self.assertTrue(self._run({"source": "1"}))
+
+    def test_local_includes_are_inputs(self):
+        """
+        Test that local headers are hashed together with the source
+        """
+        header = self._write('a.h', 'int a(void);')
+        source = self._write('a.c', '#include <stdio.h>\n#include "a.h"\n')
+
+        self.assertEqual(sorted(get_source_inputs(source)), sorted([source, header]))
+
+
+if __name__ == '__main__':
+    unittest.main()
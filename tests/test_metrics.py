@@ -0,0 +1,64 @@
+import os
+import json
+import asyncio
+import tempfile
+import unittest
+
+from sorcestone.utils import metrics
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        """
+        Set up an events file
+        """
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.events_path = os.path.join(self.tmp_dir.name, 'metrics.jsonl')
+        metrics.configure_metrics(self.events_path)
+
+    def tearDown(self):
+        metrics.configure_metrics(None)
+        self.tmp_dir.cleanup()
+
+    def test_file_aggregation(self):
+        """
+        Test that values are aggregated per file, also inside async tasks
+        """
+        async def stage():
+            metrics.record('test_seconds', 3.0, language='C')
+
+        with metrics.file_context(self.tmp_dir.name + '/a.c'):
+            metrics.record('test_seconds', 1.0, language='C')
+            asyncio.run(stage())
+        with metrics.file_context(self.tmp_dir.name + '/b.c'):
+            metrics.record('test_seconds', 2.0, language='C')
+
+        a_metrics = metrics.get_file_metrics(self.tmp_dir.name + '/a.c')
+        self.assertEqual(a_metrics, [{
+            'metric': 'test_seconds', 'labels': {'language': 'C'}, 'count': 2, 'sum': 4.0, 'min': 1.0, 'max': 3.0
+        }])
+
+        merged = metrics.merge_metrics([a_metrics, metrics.get_file_metrics(self.tmp_dir.name + '/b.c')])
+        self.assertEqual((merged[0]['count'], merged[0]['sum'], merged[0]['min']), (3, 6.0, 1.0))
+
+        with open(self.events_path) as f:
+            events = [json.loads(line) for line in f]
+        self.assertEqual([event['value'] for event in events], [1.0, 3.0, 2.0])
+        self.assertEqual(events[0]['file'], self.tmp_dir.name + '/a.c')
+        self.assertEqual(events[0]['run_id'], metrics.get_run_id())
+
+    def test_openmetrics(self):
+        """
+        Test OpenMetrics rendering
+        """
+        text = metrics.to_openmetrics([
+            {'metric': 'stage_seconds', 'labels': {'stage': 'compile'}, 'count': 2, 'sum': 1.5, 'min': 0.5, 'max': 1.0}
+        ], run_id='r1')
+        self.assertIn('# TYPE sorcestone_stage_seconds summary\n', text)
+        self.assertIn('sorcestone_stage_seconds_sum{run_id="r1",stage="compile"} 1.5\n', text)
+        self.assertIn('sorcestone_stage_seconds_max{run_id="r1",stage="compile"} 1.0\n', text)
+        self.assertTrue(text.endswith('# EOF\n'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,220 @@
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import signal
+import tempfile
+import unittest
+import importlib
+import importlib.util
+from contextlib import redirect_stdout
+from unittest.mock import patch
+
+from sorcestone.utils.ast_pack import load_ast
+
+
+TOOLBOX_DIR = os.path.join(os.path.dirname(__file__), '../sorcestone/language_tools/C/toolbox')
+
+# Preprocessed translation unit, line markers with flag 3 come from system headers
+UNIT = """# 1 "sample.c"
+# 1 "/usr/include/stdio.h" 1 3
+typedef unsigned long size_t;
+struct _IO_FILE { int fd; size_t size; };
+typedef struct _IO_FILE FILE;
+typedef struct _IO_cookie { int unused; } cookie_t;
+extern int fprintf(FILE *stream, const char *format, ...);
+extern int puts(const char *s);
+# 3 "sample.c" 2
+
+typedef struct point { int x; int y; } point_t;
+
+static const char *GREETING = "say \\"hi\\"\\\\ caf\u00e9\\n";
+
+int show(FILE *out, point_t p) {
+    int values[] = {1, 2, 3};
+    return fprintf(out, "%d %d\\n", p.x, p.y) + values[0];
+}
+
+int deep(int x) {
+    return DEEP;
+}
+"""
+
+
+def load_parser():
+    """ Load parse.py of the C toolbox, it imports its siblings as top level modules """
+    if TOOLBOX_DIR not in sys.path:
+        sys.path.insert(0, TOOLBOX_DIR)
+    spec = importlib.util.spec_from_file_location('c_parse', os.path.join(TOOLBOX_DIR, 'parse.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class TestParse(unittest.TestCase):
+    def setUp(self):
+        """
+        Set up a translation unit including a system header
+        """
+        self.parse = load_parser()
+        self.text = UNIT.replace("DEEP", "(" * 200 + "x" + " + 1)" * 200)
+        self.ast = self.parse.get_parser().parse(self.text, "sample.c")
+
+    def test_write_json_matches_json_dumps(self):
+        """
+        Test that the streaming writer gives the same bytes as json.dumps,
+        including deeply nested expressions and escaped strings
+        """
+        output = io.StringIO()
+        self.parse.write_json(self.ast, output)
+
+        self.assertEqual(output.getvalue(), json.dumps(self.parse.to_dict(self.ast), indent=4, sort_keys=True))
+        self.assertIn(r'"value": "\"say \\\"hi\\\"\\\\ caf\u00e9\\n\""', output.getvalue())
+
+    def test_pack_matches_json(self):
+        """
+        Test that the binary AST decodes to the same dict as the JSON AST
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            json_file, pack_file = f"{tmp_dir}/a.json", f"{tmp_dir}/a.pack"
+            with open(json_file, "w") as f:
+                self.parse.write_json(self.ast, f)
+            with open(pack_file, "wb") as f:
+                self.parse.write_pack(self.ast, f, self.parse.iter_fields)
+
+            self.assertEqual(load_ast(pack_file), load_ast(json_file))
+            self.assertLess(os.path.getsize(pack_file), os.path.getsize(json_file))
+
+    def test_prune_ast(self):
+        """
+        Test that system declarations are dropped unless user code refers to
+        their types, directly or through other system types
+        """
+        ast = self.parse.prune_ast(self.ast, self.parse.system_files_of(self.text))
+        names = [
+            f"struct {ext.type.name}" if ext.name is None else ext.name
+            for ext in ast.ext
+            if not isinstance(ext, self.parse.c_ast.FuncDef)
+        ]
+
+        self.assertEqual(names, ["size_t", "struct _IO_FILE", "FILE", "point_t", "GREETING"])
+        self.assertEqual([ext.decl.name for ext in ast.ext if isinstance(ext, self.parse.c_ast.FuncDef)],
+                         ["show", "deep"])
+
+
+@unittest.skipUnless(shutil.which('gcc'), "gcc is not available")
+class TestAstCache(unittest.TestCase):
+    def setUp(self):
+        """
+        Set up a source file including a header, with the AST cache in a
+        temporary folder
+        """
+        self.parse = load_parser()
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.tmp_dir = tmp_dir.name
+        patcher = patch.dict(os.environ, {'SORCESTONE_CACHE_DIR': os.path.join(self.tmp_dir, 'cache')})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.source = os.path.join(self.tmp_dir, "a.c")
+        with open(self.source, "w") as f:
+            f.write('#include "point.h"\nint norm(struct point p) { return p.x * p.x + p.y * p.y; }\n')
+        self.write_header("struct point { int x; int y; };\n")
+
+    def write_header(self, text):
+        with open(os.path.join(self.tmp_dir, "point.h"), "w") as f:
+            f.write(text)
+
+    def c_to_meta(self):
+        """
+        Returns:
+            tuple: (stdout of c_to_meta, written AST)
+        """
+        ast_file = os.path.join(self.tmp_dir, "a.ast")
+        output = io.StringIO()
+        with redirect_stdout(output):
+            self.parse.c_to_meta(self.source, ast_file, use_cache=True)
+        with open(ast_file) as f:
+            return output.getvalue(), f.read()
+
+    def test_key(self):
+        """
+        Test that the key changes with the content of included headers and
+        with the cpp args
+        """
+        text = self.parse.preprocess(self.source)
+        key = self.parse.ast_cache_key(text)
+        self.write_header("struct point { long x; long y; };\n")
+
+        self.assertEqual(self.parse.ast_cache_key(text), key)
+        self.assertNotEqual(self.parse.ast_cache_key(self.parse.preprocess(self.source)), key)
+        self.assertNotEqual(self.parse.ast_cache_key(text, "-DNDEBUG"), key)
+
+    def test_reuse(self):
+        """
+        Test that parsing the same translation unit again copies the stored
+        AST instead of parsing
+        """
+        output, ast = self.c_to_meta()
+        self.assertNotIn("Reused cached AST", output)
+
+        with patch.object(self.parse, 'get_parser', side_effect=AssertionError("parsed again")):
+            output, cached_ast = self.c_to_meta()
+
+        self.assertIn("Reused cached AST", output)
+        self.assertEqual(cached_ast, ast)
+
+    def test_header_change(self):
+        """
+        Test that changing an included header invalidates the stored AST
+        """
+        _, ast = self.c_to_meta()
+        self.write_header("struct point { int x; int y; int z; };\n")
+        output, changed_ast = self.c_to_meta()
+
+        self.assertNotIn("Reused cached AST", output)
+        self.assertNotIn('"name": "z"', ast)
+        self.assertIn('"name": "z"', changed_ast)
+        self.assertEqual(len(os.listdir(os.path.join(self.tmp_dir, 'cache', 'ast'))), 2)
+
+
+class TestParseServer(unittest.TestCase):
+    def setUp(self):
+        load_parser()
+        self.server = importlib.import_module('parse_server')
+        self.addCleanup(signal.signal, signal.SIGALRM, signal.getsignal(signal.SIGALRM))
+        self.server.warm_up()
+
+    def test_job_timeout(self):
+        """
+        Test that a job running past its deadline is stopped and answered
+        with an error
+        """
+        job = {'id': 7, 'src_file_path': "a.c", 'ast_file_path': "a.ast", 'timeout': 0.1,
+               'deadline': time.time() + 0.1}
+        started = time.monotonic()
+        with patch.object(self.server, 'c_to_meta', lambda **kwargs: time.sleep(5)):
+            response = self.server.parse_job(job)
+
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual(response['id'], 7)
+        self.assertEqual(response['returncode'], 1)
+        self.assertIn("timed out", response['stderr'])
+
+    def test_job_past_deadline_is_not_started(self):
+        """
+        Test that a job which waited in the queue past its deadline does not run
+        """
+        job = {'id': 8, 'src_file_path': "a.c", 'ast_file_path': "a.ast", 'timeout': 1, 'deadline': time.time() - 1}
+        with patch.object(self.server, 'c_to_meta') as c_to_meta:
+            response = self.server.parse_job(job)
+
+        c_to_meta.assert_not_called()
+        self.assertEqual(response['returncode'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import time
+import threading
+import unittest
+
+from sorcestone.main.pipeline import Pipeline
+
+
+class TestPipeline(unittest.TestCase):
+    def test_independent_stages_overlap(self):
+        """
+        Test that independent stages run concurrently and dependents wait
+        """
+        barrier = threading.Barrier(2, timeout=5)
+        order = []
+        pipeline = Pipeline()
+        # Both stages pass the barrier only if they run at the same time
+        pipeline.add_stage('parse', lambda: (barrier.wait(), order.append('parse')))
+        pipeline.add_stage('compile', lambda: (barrier.wait(), order.append('compile')))
+        pipeline.add_stage('tests', lambda: order.append('tests') or 'done', deps=['parse', 'compile'])
+
+        results = pipeline.run()
+        self.assertEqual(results['tests'], 'done')
+        self.assertEqual(order[-1], 'tests')
+
+    def test_failure_propagates_to_dependents(self):
+        """
+        Test that dependents of a failed stage do not run, others finish
+        """
+        ran = []
+        pipeline = Pipeline()
+
+        def fail():
+            raise ValueError('parse failed')
+
+        pipeline.add_stage('parse', fail)
+        pipeline.add_stage('compile', lambda: (time.sleep(0.1), ran.append('compile')))
+        pipeline.add_stage('tests', lambda: ran.append('tests'), deps=['parse', 'compile'])
+
+        with self.assertRaisesRegex(ValueError, 'parse failed'):
+            pipeline.run()
+        self.assertEqual(ran, ['compile'])
+        self.assertIsInstance(pipeline.futures['tests'].exception(), ValueError)
+
+    def test_unknown_dependency(self):
+        """
+        Test that dependencies must be added first
+        """
+        with self.assertRaises(ValueError):
+            Pipeline().add_stage('tests', lambda: None, deps=['parse'])
+
+
+if __name__ == '__main__':
+    unittest.main()
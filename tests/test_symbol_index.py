@@ -0,0 +1,93 @@
+import os
+import tempfile
+import unittest
+import importlib.util
+
+from pycparser import c_parser
+
+from sorcestone.utils.symbol_index import SymbolIndex, format_symbols
+
+
+TOOLBOX_DIR = os.path.join(os.path.dirname(__file__), '../sorcestone/language_tools/C/toolbox')
+
+HEADER = """typedef struct point { int x; int y; } point_t;
+int scale(int x, int k);
+"""
+
+# Preprocessed translation units, line markers tell which file declarations come from
+UNIT_A = """# 1 "{dir}/a.c"
+# 1 "{dir}/common.h" 1
+typedef struct point { int x; int y; } point_t;
+int scale(int x, int k);
+# 2 "{dir}/a.c" 2
+int scale(int x, int k) { return x * k; }
+static int helper(point_t p) { return p.x; }
+"""
+
+UNIT_B = """# 1 "{dir}/b.c"
+# 1 "{dir}/common.h" 1
+typedef struct point { int x; int y; } point_t;
+int scale(int x, int k);
+# 2 "{dir}/b.c" 2
+int helper(point_t p);
+int twice(point_t p) { return scale(p.x, 2) + helper(p); }
+"""
+
+
+def load_writer():
+    spec = importlib.util.spec_from_file_location('symbol_index_writer', os.path.join(TOOLBOX_DIR, 'symbol_index.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class TestSymbolIndex(unittest.TestCase):
+    def setUp(self):
+        """
+        Set up an index of two translation units sharing a header
+        """
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.dir = self.tmp_dir.name
+        with open(os.path.join(self.dir, 'common.h'), 'w') as f:
+            f.write(HEADER)
+        self.db_path = os.path.join(self.dir, 'symbols.db')
+        writer = load_writer()
+        for name, unit in [('a.c', UNIT_A), ('b.c', UNIT_B)]:
+            text = unit.replace("{dir}", self.dir)
+            unit_path = os.path.join(self.dir, name)
+            writer.index_unit(self.db_path, unit_path, name, set(), lambda: c_parser.CParser().parse(text, unit_path))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_shared_header_stored_once(self):
+        """
+        Test that declarations of a header included twice are stored once
+        """
+        with SymbolIndex(self.db_path) as index:
+            self.assertEqual(len(index.find('point_t')), 1)
+            self.assertEqual(index.find('struct point')[0]['file'], os.path.join(self.dir, 'common.h'))
+            self.assertEqual([symbol['is_definition'] for symbol in index.find('scale')], [True, False])
+
+    def test_lookups(self):
+        """
+        Test callers, callees and type users
+        """
+        with SymbolIndex(self.db_path) as index:
+            self.assertEqual([symbol['name'] for symbol in index.get_callers('scale')], ['twice'])
+            self.assertEqual(index.get_callees('twice'), ['helper', 'scale'])
+            self.assertEqual(sorted(symbol['name'] for symbol in index.get_type_users('point_t')),
+                             ['helper', 'helper', 'twice'])
+
+    def test_external_functions(self):
+        """
+        Test that only non static definitions of other files are context
+        """
+        with SymbolIndex(self.db_path) as index:
+            symbols = index.get_external_functions(['scale', 'helper'], os.path.join(self.dir, 'b.c'))
+            self.assertEqual(format_symbols(symbols), 'int scale(int x, int k); /* a.c:2 */')
+            self.assertEqual(index.get_external_functions(['scale'], os.path.join(self.dir, 'a.c')), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
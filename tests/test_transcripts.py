@@ -0,0 +1,32 @@
+import tempfile
+import unittest
+
+from sorcestone.utils.metrics import file_context
+from sorcestone.utils.transcripts import TranscriptArchive, read_transcripts
+
+
+class TestTranscripts(unittest.TestCase):
+    def test_write_and_read(self):
+        """
+        Test that transcripts are archived and found through the index
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            archive = TranscriptArchive(tmp_dir)
+            with file_context('a.c'):
+                archive.write('a.rs', 1, 'query', 'response 1', return_code=1)
+                archive.write('a.rs', 2, [{'role': 'user', 'content': 'query'}], 'response 2', return_code=0)
+            with file_context('b.c'):
+                archive.write('b.rs', 1, 'query', 'response 3')
+            archive.close()
+
+            records = list(read_transcripts(tmp_dir, file_path='a.c'))
+            self.assertEqual([record['response'] for record in records], ['response 1', 'response 2'])
+            self.assertEqual(records[1]['request'], [{'role': 'user', 'content': 'query'}])
+            self.assertEqual(records[0]['return_code'], 1)
+
+            records = list(read_transcripts(tmp_dir, stage='b.rs'))
+            self.assertEqual([(record['file'], record['round']) for record in records], [('b.c', 1)])
+
+
+if __name__ == '__main__':
+    unittest.main()